@@ -3,18 +3,23 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_migrate import Migrate
 from config import Config
+from .cache import Cache
+from .replicas import RoutingSession
+from .database import configure_engine, enable_sqlite_wal
 
 
 # Initialize the Flask extensions
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 login_manager = LoginManager()
 migrate = Migrate()
+cache = Cache()
 
 
 @login_manager.user_loader
 def load_user(user_id):
-    from .models import User
-    return User.query.get(int(user_id))
+    # a cached SessionUser, not the User model: most requests don't look the user up
+    from .cache import get_session_user
+    return get_session_user(int(user_id))
 
 
 def create_app(config=Config):
@@ -22,13 +27,29 @@ def create_app(config=Config):
     app.config.from_object(config)
 
     # Initialize extensions
+    configure_engine(app)
     db.init_app(app)
+    with app.app_context():
+        enable_sqlite_wal(db.engine, app.config)
     login_manager.init_app(app)
     
     migrate.init_app(app, db)
+    cache.init_app(app)
 
     # Import and register Blueprints
     from .routes import main
     app.register_blueprint(main)
+    from .api import api
+    app.register_blueprint(api)
+    if app.config.get('METRICS_ENABLED'):
+        from .metrics import metrics
+        app.register_blueprint(metrics)
+    if app.config.get('PROFILING_ENABLED'):
+        from .profiling import init_profiling
+        init_profiling(app)
+
+    # Register the flask commands
+    from .commands import register_commands
+    register_commands(app)
 
     return app
@@ -0,0 +1,357 @@
+import hashlib
+from datetime import datetime, timezone
+from functools import wraps
+from flask import Blueprint, jsonify, request, current_app, abort, g
+from flask_login import current_user
+from flask_wtf.csrf import generate_csrf, validate_csrf
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from wtforms.validators import ValidationError
+
+from . import db
+from .models import Quiz, User
+from .cache import get_cache, get_categories, get_quiz_snapshot, get_session_user
+from .passwords import HashingBusy, check_user_password, needs_rehash, rehash_in_background
+from .throttle import auth_throttled, record_login
+from .pagination import keyset_paginate
+from .results import load_result_view, load_user_results
+from .submission import parse_json_answers, submit_quiz
+from .attempts import parse_saved_answers, load_attempt, start_attempt, save_answers, finish_attempt, attempt_json
+from .utils import read_only
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+# the methods which don't change anything, the others need a token or a CSRF token
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def token_serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt='api-token')
+
+
+def issue_token(user):
+    ''' Sign a token standing for the user, valid for API_TOKEN_TTL seconds or until the token_version
+        of the user changes (a new password). '''
+    return token_serializer().dumps([user.id, user.token_version or 0])
+
+
+def get_token_version(user_id):
+    ''' Get the token_version of a user from the cache, like get_session_user, None if the user is gone. '''
+    def load():
+        user = db.session.get(User, user_id)
+        return None if user is None else user.token_version or 0
+    return get_cache().get_or_load(
+        f'user:{user_id}', 'token_version', load, ttl=current_app.config['SESSION_USER_TTL']
+    )
+
+
+def load_token_user(token):
+    ''' Get the SessionUser of a token, None if the token is invalid, expired or revoked or the user is gone. '''
+    try:
+        payload = token_serializer().loads(token, max_age=current_app.config['API_TOKEN_TTL'])
+    except BadSignature:
+        return None
+    if not isinstance(payload, list) or len(payload) != 2 or not all(type(value) is int for value in payload):
+        return None
+    user_id, version = payload
+    if get_token_version(user_id) != version:
+        return None
+    return get_session_user(user_id)
+
+
+@api.before_request
+def authenticate():
+    ''' A request with an "Authorization: Bearer <token>" header is made by the user of the token, whatever
+        the cookies. The other requests use the session of the site: as a browser sends its cookie with any
+        request, they must also send the CSRF token of the session in an X-CSRFToken header to change anything. '''
+    authorization = request.headers.get('Authorization', '')
+    if authorization.startswith('Bearer '):
+        user = load_token_user(authorization[len('Bearer '):].strip())
+        if user is None:
+            return jsonify({"message": "invalid or expired token"}), 401
+        # read by current_user instead of the user of the session
+        g._login_user = user
+        return None
+    if request.method in SAFE_METHODS or request.endpoint == 'api.create_token':
+        return None
+    if current_user.is_authenticated and current_app.config.get('WTF_CSRF_ENABLED', True):
+        try:
+            validate_csrf(request.headers.get('X-CSRFToken'))
+        except ValidationError as error:
+            return jsonify({"message": f"CSRF check failed: {error}"}), 400
+    return None
+
+
+def api_login_required(f):
+    ''' Like login_required, but answers 401 in JSON instead of redirecting to the login page. '''
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not current_user.is_authenticated:
+            return jsonify({"message": "authentication required"}), 401
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def conditional(*namespaces):
+    ''' Make a content endpoint answer conditional GETs (If-None-Match / If-Modified-Since).
+        The ETag and Last-Modified come from the cache generations of the namespaces the content
+        depends on (a callable gets the view arguments), so a 304 is sent without any database read. '''
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            cache = get_cache()
+            names = [namespace(**kwargs) if callable(namespace) else namespace for namespace in namespaces]
+            version = ','.join(f'{name}={cache.generation(name)}' for name in names)
+            etag = hashlib.sha1(f'{request.full_path}|{version}'.encode()).hexdigest()
+            modified = [time for time in (cache.modified_at(name) for name in names) if time is not None]
+            last_modified = datetime.fromtimestamp(int(max(modified)), timezone.utc) if modified else None
+
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains(etag)
+            else:
+                not_modified = bool(last_modified and request.if_modified_since
+                                    and last_modified <= request.if_modified_since)
+            if not_modified:
+                response = current_app.response_class(status=304)
+            else:
+                response = current_app.make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            if last_modified:
+                response.last_modified = last_modified
+            # clients may keep the content but must check it is still fresh
+            response.cache_control.no_cache = True
+            return response
+        return decorated_function
+    return decorator
+
+
+def page_json(page, serialize):
+    return {
+        'items': [serialize(item) for item in page.items],
+        'next': page.next_cursor,
+        'prev': page.prev_cursor,
+    }
+
+
+def quiz_json(quiz):
+    return {
+        'id': quiz.id,
+        'title': quiz.title,
+        'description': quiz.description,
+        'category_id': quiz.category_id,
+        'total_questions': quiz.total_questions,
+    }
+
+
+def question_json(question):
+    # the answer key is never sent
+    return {
+        'id': question.id,
+        'text': question.text,
+        'options': list(question.options),
+    }
+
+
+# get a token for the API: {"email": ..., "password": ...}, sent back as "Authorization: Bearer <token>"
+@api.route('/tokens', methods=['POST'])
+def create_token():
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not all(isinstance(payload.get(field), str) for field in ('email', 'password')):
+        return jsonify({"message": "an email and a password are expected"}), 400
+    email, password = payload['email'], payload['password']
+    # throttled like the login page, before any password is hashed
+    if auth_throttled(email):
+        return jsonify({"message": "too many attempts, please try again later"}), 429
+    user = User.query.filter_by(email=email).first()
+    try:
+        valid = check_user_password(user, password)
+    except HashingBusy:
+        return jsonify({"message": "the server is busy, please try again in a moment"}), 503
+    record_login(email, valid)
+    if not valid:
+        return jsonify({"message": "invalid email or password"}), 401
+    if needs_rehash(user.password):
+        rehash_in_background(user.id, user.password, password)
+    return jsonify({'token': issue_token(user), 'expires_in': current_app.config['API_TOKEN_TTL']}), 201
+
+
+# get the CSRF token of the session, for the clients authenticated by the cookie of the site
+@api.route('/csrf-token')
+def csrf_token():
+    return jsonify({'csrf_token': generate_csrf()})
+
+
+# list all categories
+@api.route('/categories')
+@conditional('categories')
+def categories():
+    return jsonify([{'id': category.id, 'name': category.name} for category in get_categories()])
+
+
+# get a category with its quizzes
+@api.route('/categories/<int:category_id>')
+@conditional('categories', 'quizzes')
+def category(category_id):
+    category = next((c for c in get_categories() if c.id == category_id), None)
+    if category is None:
+        abort(404)
+    quizzes = keyset_paginate(
+        Quiz.query.filter_by(category_id=category_id), [Quiz.id], current_app.config['QUIZZES_PER_PAGE'],
+        after=request.args.get('after'), before=request.args.get('before')
+    )
+    return jsonify({'id': category.id, 'name': category.name, 'quizzes': page_json(quizzes, quiz_json)})
+
+
+# list the quizzes, optionally of one category
+@api.route('/quizzes')
+@conditional('quizzes')
+def quizzes():
+    query = Quiz.query
+    category_id = request.args.get('category_id', type=int)
+    if category_id is not None:
+        query = query.filter_by(category_id=category_id)
+    quizzes = keyset_paginate(
+        query, [Quiz.id], current_app.config['QUIZZES_PER_PAGE'],
+        after=request.args.get('after'), before=request.args.get('before')
+    )
+    return jsonify(page_json(quizzes, quiz_json))
+
+
+# get a quiz
+@api.route('/quizzes/<int:quiz_id>')
+@conditional(lambda quiz_id: f'quiz:{quiz_id}')
+def quiz(quiz_id):
+    quiz = get_quiz_snapshot(quiz_id)
+    if quiz is None:
+        abort(404)
+    return jsonify(quiz_json(quiz))
+
+
+# list the questions of a quiz
+@api.route('/quizzes/<int:quiz_id>/questions')
+@conditional(lambda quiz_id: f'quiz:{quiz_id}')
+def questions(quiz_id):
+    quiz = get_quiz_snapshot(quiz_id)
+    if quiz is None:
+        abort(404)
+    return jsonify([question_json(question) for question in quiz.questions])
+
+
+# get a question of a quiz
+@api.route('/quizzes/<int:quiz_id>/questions/<int:question_id>')
+@conditional(lambda quiz_id, question_id: f'quiz:{quiz_id}')
+def question(quiz_id, question_id):
+    quiz = get_quiz_snapshot(quiz_id)
+    question = next((q for q in quiz.questions if q.id == question_id), None) if quiz else None
+    if question is None:
+        abort(404)
+    return jsonify(question_json(question))
+
+
+# submit the answers to a quiz: {"answers": {"<question id>": <selected option>, ...}}
+@api.route('/quizzes/<int:quiz_id>/submit', methods=['POST'])
+@api_login_required
+def submit(quiz_id):
+    quiz = get_quiz_snapshot(quiz_id)
+    if quiz is None:
+        abort(404)
+    if quiz.total_questions == 0:
+        return jsonify({"message": "no questions available for this quiz"}), 400
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({"message": "a JSON object is expected"}), 400
+    try:
+        answers = parse_json_answers(payload.get('answers'), quiz.answer_key)
+    except ValueError as error:
+        return jsonify({"message": str(error)}), 400
+    submission = submit_quiz(current_user.id, quiz.id, answers, quiz.answer_key, category_id=quiz.category_id)
+    return jsonify(submission._asdict()), 201
+
+
+# start an attempt at a quiz, or get the open one
+@api.route('/quizzes/<int:quiz_id>/attempts', methods=['POST'])
+@api_login_required
+def start(quiz_id):
+    quiz = get_quiz_snapshot(quiz_id)
+    if quiz is None:
+        abort(404)
+    attempt = start_attempt(current_user.id, quiz.id)
+    return jsonify(attempt_json(attempt, quiz.total_questions)), 201
+
+
+# get an attempt of the current user with its saved answers
+@api.route('/attempts/<int:attempt_id>')
+@api_login_required
+def attempt(attempt_id):
+    attempt = load_attempt(attempt_id, current_user.id)
+    quiz = get_quiz_snapshot(attempt.quiz_id) if attempt else None
+    if quiz is None:
+        abort(404)
+    return jsonify(attempt_json(attempt, quiz.total_questions))
+
+
+# save some answers of an open attempt: {"answers": {"<question id>": <selected option>, ...}}
+@api.route('/attempts/<int:attempt_id>', methods=['PATCH'])
+@api_login_required
+def save(attempt_id):
+    attempt = load_attempt(attempt_id, current_user.id)
+    quiz = get_quiz_snapshot(attempt.quiz_id) if attempt else None
+    if quiz is None:
+        abort(404)
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({"message": "a JSON object is expected"}), 400
+    try:
+        answers = parse_saved_answers(payload.get('answers'), quiz.answer_key)
+    except ValueError as error:
+        return jsonify({"message": str(error)}), 400
+    saved = save_answers(attempt_id, current_user.id, answers)
+    if saved is None:
+        return jsonify({"message": "the attempt is finished"}), 409
+    return jsonify({'saved': len(answers), 'answered': len(saved), 'total_questions': quiz.total_questions})
+
+
+# finish an open attempt, its saved answers are scored like a submission
+@api.route('/attempts/<int:attempt_id>/finish', methods=['POST'])
+@api_login_required
+def finish(attempt_id):
+    attempt = load_attempt(attempt_id, current_user.id)
+    quiz = get_quiz_snapshot(attempt.quiz_id) if attempt else None
+    if quiz is None:
+        abort(404)
+    submission = finish_attempt(attempt_id, current_user.id, quiz)
+    if submission is None:
+        return jsonify({"message": "the attempt is finished"}), 409
+    return jsonify(submission._asdict()), 201
+
+
+# list the quiz results of the current user
+@api.route('/results')
+@api_login_required
+@read_only
+def results():
+    return jsonify([
+        {'id': result.id, 'quiz_id': result.quiz_id, 'quiz_title': result.quiz.title,
+         'score': result.score, 'total_questions': result.quiz.total_questions}
+        for result in load_user_results(current_user.id)
+    ])
+
+
+# get a quiz result of the current user with its responses
+@api.route('/results/<int:quiz_result_id>')
+@api_login_required
+@read_only
+def result(quiz_result_id):
+    quiz_result = load_result_view(quiz_result_id, current_user.id)
+    if quiz_result is None:
+        abort(404)
+    data = quiz_result._asdict()
+    data['responses'] = [response._asdict() for response in quiz_result.responses]
+    data['attempts'] = [attempt._asdict() for attempt in quiz_result.attempts]
+    return jsonify(data)
+
+
+@api.errorhandler(404)
+def not_found(error):
+    return jsonify({"message": "not found"}), 404
@@ -0,0 +1,313 @@
+import io
+import sys
+from functools import wraps
+from flask import render_template, url_for, flash, redirect, request, session, g, abort, current_app
+from flask import request_started
+from flask_login import current_user
+from a2wsgi import WSGIMiddleware
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from werkzeug.exceptions import HTTPException
+
+from config import Config
+from . import create_app
+from .cache import get_cache, get_cached_html_async, load_quiz_snapshot, load_session_user
+from .database import engine_options, enable_sqlite_wal
+from .forms import QuizTakingForm
+from .models import Quiz
+from .pagination import keyset_paginate
+from .results import load_result_view
+from .status import load_quiz_statuses, NO_STATUS
+from .leaderboards import record_score
+from .submission import parse_answers, store_submission
+
+
+# The async driver used for each database of SQLALCHEMY_DATABASE_URI
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'mysql': 'mysql+aiomysql',
+    'postgresql': 'postgresql+asyncpg',
+}
+
+# endpoint -> async view, the other endpoints are served by the Flask app
+ASYNC_VIEWS = {}
+
+
+def async_database_uri(config):
+    ''' Get the uri of the async engine: ASYNC_DATABASE_URI, or SQLALCHEMY_DATABASE_URI with an async driver. '''
+    if config.get('ASYNC_DATABASE_URI'):
+        return make_url(config['ASYNC_DATABASE_URI'])
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() not in ASYNC_DRIVERS:
+        raise RuntimeError(f'no async driver for {url.get_backend_name()}, set ASYNC_DATABASE_URI')
+    return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+
+
+def async_view(endpoint):
+    ''' Serve an endpoint of the main blueprint with an async view in the ASGI app.
+        The view gets an AsyncSession followed by the view arguments. '''
+    def decorator(f):
+        ASYNC_VIEWS[endpoint] = f
+        return f
+    return decorator
+
+
+def async_login_required(f):
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        if not current_user.is_authenticated:
+            return current_app.login_manager.unauthorized()
+        return await f(*args, **kwargs)
+    return decorated_function
+
+
+async def load_current_user(db_session):
+    ''' Load the user of the session like Flask-Login does on the first use of current_user,
+        but with the async engine. '''
+    user_id = session.get('_user_id')
+    user = None
+    if user_id:
+        user_id = int(user_id)
+        # the same cached SessionUser as load_user
+        user = await get_cache().get_or_load_async(
+            f'user:{user_id}', 'session', lambda: db_session.run_sync(lambda s: load_session_user(user_id, s)),
+            ttl=current_app.config['SESSION_USER_TTL']
+        )
+    g._login_user = user or current_app.login_manager.anonymous_user()
+
+
+async def get_quiz_snapshot_async(db_session, quiz_id):
+    ''' Same as cache.get_quiz_snapshot, the snapshot is loaded with the async engine on a miss. '''
+    cache = get_cache()
+    namespace = f'quiz:{quiz_id}'
+    version = await cache.call_async(cache.generation, namespace)
+    return await cache.get_or_load_async(
+        namespace, 'snapshot', lambda: db_session.run_sync(lambda s: load_quiz_snapshot(quiz_id, version, s))
+    )
+
+
+class AsyncApp:
+    ''' ASGI application in front of the Flask app.
+        The read-heavy routes and the quiz submission (see ASYNC_VIEWS) are served by async views on an
+        async engine and its pool, so a worker keeps serving requests while they wait on the database.
+        They reuse the database code of the sync views through AsyncSession.run_sync, and run in a Flask
+        request context so that the session, url_for, flash and the templates work as usual.
+        The calls to the cache backend, a file or a server, run in threads (see Cache.call_async).
+        Every other route is served by the Flask app itself, in a pool of ASYNC_WSGI_THREADS threads. '''
+
+    def __init__(self, app):
+        self.app = app
+        self.wsgi = WSGIMiddleware(app, workers=app.config['ASYNC_WSGI_THREADS'])
+        url = async_database_uri(app.config)
+        self.engine = create_async_engine(url, **engine_options(
+            app.config, url, 'async', app.config['ASYNC_POOL_SIZE'], app.config['ASYNC_MAX_OVERFLOW']
+        ))
+        enable_sqlite_wal(self.engine.sync_engine, app.config)
+        self.sessions = async_sessionmaker(self.engine, expire_on_commit=False)
+        app.extensions['async_db'] = self
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        view, view_args = self.match(scope)
+        if view is None:
+            return await self.wsgi(scope, receive, send)
+
+        body = await read_body(receive)
+        response = await self.dispatch(scope, body, view, view_args)
+        if response is None:
+            return await self.wsgi(scope, replay_body(body, receive), send)
+        await send_response(response, send, head=scope['method'] == 'HEAD')
+
+    def match(self, scope):
+        ''' Find the async view of a request with the url map of the Flask app, (None, None) if there is none. '''
+        if scope['type'] != 'http':
+            return None, None
+        adapter = self.app.url_map.bind('localhost', script_name=scope.get('root_path') or None)
+        try:
+            endpoint, view_args = adapter.match(scope['path'], scope['method'])
+        except HTTPException:
+            return None, None
+        return ASYNC_VIEWS.get(endpoint), view_args
+
+    async def dispatch(self, scope, body, view, view_args):
+        ''' Run an async view like Flask.full_dispatch_request runs a view.
+            Returns the response, None if the request must be served by the Flask app. '''
+        environ = build_environ(scope, body)
+        with self.app.request_context(environ):
+            remember_cookie = self.app.config.get('REMEMBER_COOKIE_NAME', 'remember_token')
+            if '_user_id' not in session and remember_cookie in request.cookies:
+                # logging in again from the remember me cookie is left to Flask-Login
+                return None
+            try:
+                try:
+                    request_started.send(self.app, _async_wrapper=self.app.ensure_sync)
+                    rv = self.app.preprocess_request()
+                    if rv is None:
+                        async with self.sessions() as db_session:
+                            await load_current_user(db_session)
+                            rv = await view(db_session, **view_args)
+                except Exception as e:
+                    rv = self.app.handle_user_exception(e)
+                return self.app.finalize_request(rv)
+            except Exception as e:
+                return self.app.handle_exception(e)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def build_environ(scope, body):
+    ''' Build the WSGI environ of an ASGI http request. '''
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope['query_string'].decode('ascii'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f'HTTP/{scope["http_version"]}',
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin1')
+        if name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        elif name == 'content-type':
+            key = 'CONTENT_TYPE'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        value = value.decode('latin1')
+        if key in environ:
+            value = environ[key] + ('; ' if key == 'HTTP_COOKIE' else ',') + value
+        environ[key] = value
+    return environ
+
+
+async def read_body(receive):
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    return body
+
+
+def replay_body(body, receive):
+    ''' Give back a request body already read to the Flask app. '''
+    sent = False
+
+    async def replayed():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        return await receive()
+    return replayed
+
+
+async def send_response(response, send, head=False):
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': [(key.lower().encode('latin1'), value.encode('latin1')) for key, value in response.headers.items()],
+    })
+    await send({'type': 'http.response.body', 'body': b'' if head else response.get_data()})
+    response.close()
+
+
+def create_asgi_app(config=Config):
+    ''' Create the Flask app with create_app and serve it as an ASGI app with the async views. '''
+    return AsyncApp(create_app(config))
+
+
+# Async versions of the views of routes.py, they must behave the same way
+
+# home page
+@async_view('main.home')
+async def home(db_session):
+    per_page = current_app.config['QUIZZES_PER_PAGE']
+    after, before = request.args.get('after'), request.args.get('before')
+    if not current_user.is_authenticated and not after and not before:
+        async def render():
+            quizzes = await db_session.run_sync(lambda s: keyset_paginate(s.query(Quiz), [Quiz.id], per_page))
+            return render_template('home.html', quizzes=quizzes, statuses={}, no_status=NO_STATUS)
+        return await get_cached_html_async('quizzes', 'home', render)
+    quizzes = await db_session.run_sync(
+        lambda s: keyset_paginate(s.query(Quiz), [Quiz.id], per_page, after=after, before=before)
+    )
+    statuses = {}
+    if current_user.is_authenticated:
+        user = current_user._get_current_object()
+        quiz_ids = [quiz.id for quiz in quizzes]
+        statuses = await db_session.run_sync(lambda s: load_quiz_statuses(user, quiz_ids, s))
+    return render_template('home.html', quizzes=quizzes, statuses=statuses, no_status=NO_STATUS)
+
+
+# take a quiz
+@async_view('main.quiz')
+@async_login_required
+async def quiz(db_session, quiz_id):
+    form = QuizTakingForm()
+    quiz = await get_quiz_snapshot_async(db_session, quiz_id)
+    if quiz is None:
+        abort(404)
+
+    if request.method == 'POST':
+        if not form.validate():
+            flash('The page expired, please submit the quiz again.', 'danger')
+            return redirect(url_for('main.quiz', quiz_id=quiz.id))
+        if quiz.total_questions == 0:
+            flash('No questions available for this quiz.', 'danger')
+            return redirect(url_for('main.quiz', quiz_id=quiz.id))
+        try:
+            answers = parse_answers(request.form, quiz.answer_key)
+        except ValueError:
+            flash('Please answer every question.', 'danger')
+            return redirect(url_for('main.quiz', quiz_id=quiz.id))
+
+        user_id = current_user.id
+        submission, previous_score = await db_session.run_sync(
+            lambda s: store_submission(user_id, quiz.id, answers, quiz.answer_key, s)
+        )
+        # the leaderboards are in the cache backend, like submit_quiz but out of the event loop
+        await get_cache().call_async(
+            record_score, user_id, quiz.id, quiz.category_id, submission.score, previous_score
+        )
+        flash(f'Your score: {submission.score}/{submission.total}', 'success')
+        return redirect(url_for('main.quiz_result', quiz_result_id=submission.result_id))
+
+    async def render_questions():
+        return render_template('quiz_questions.html', questions=quiz.questions)
+    questions_html = await get_cached_html_async(f'quiz:{quiz.id}', 'questions', render_questions)
+    return render_template('quiz.html', quiz=quiz, questions_html=questions_html, form=form)
+
+
+# view a quiz result
+@async_view('main.quiz_result')
+@async_login_required
+async def quiz_result(db_session, quiz_result_id):
+    user_id = current_user.id
+    quiz_result = await db_session.run_sync(lambda s: load_result_view(quiz_result_id, user_id, s))
+    if not quiz_result:
+        flash('Quiz result not found.', 'danger')
+        return redirect(url_for('main.home'))
+    return render_template('quiz_result.html', quiz_result=quiz_result)
@@ -0,0 +1,217 @@
+from collections import defaultdict
+from datetime import datetime, timezone
+from sqlalchemy import select, update, delete, bindparam, or_
+
+from . import db
+from .models import QuizAttempt, QuizResult, Response
+from .packing import fits, pack_answers
+from .submission import check_options, submit_quiz
+
+
+def parse_saved_answers(answers, answer_key):
+    ''' Read answers to save in an attempt, a dict of question id -> selected option (from a form page or JSON),
+        some questions of the quiz may be left out. Raises ValueError for a question which is not part of the
+        quiz or an option which is not an option number. '''
+    if not isinstance(answers, dict):
+        raise ValueError('answers must be an object of question id -> selected option')
+    try:
+        answers = {int(question_id): int(option) for question_id, option in answers.items()}
+    except (TypeError, ValueError):
+        raise ValueError('question ids and selected options must be numbers')
+    unknown = set(answers) - set(answer_key)
+    if unknown:
+        raise ValueError(f'questions {sorted(unknown)} are not part of the quiz')
+    check_options(answers)
+    return answers
+
+
+def page_answers(form, questions):
+    ''' Read the answers of a page of questions from a submitted form, the unanswered questions are left out. '''
+    return {question.id: form[f'question_{question.id}'] for question in questions
+            if form.get(f'question_{question.id}')}
+
+
+def load_attempt(attempt_id, user_id, session=None, for_update=False):
+    ''' Get an attempt of a user, None if it does not exist or belongs to another user. '''
+    query = select(QuizAttempt).where(QuizAttempt.id == attempt_id, QuizAttempt.user_id == user_id)
+    if for_update:
+        query = query.with_for_update()
+    return (session or db.session).execute(query).scalar()
+
+
+def start_attempt(user_id, quiz_id, session=None):
+    ''' Get the open attempt of a user at a quiz, a new one if there is none. '''
+    session = session or db.session
+    attempt = session.execute(
+        select(QuizAttempt).where(
+            QuizAttempt.user_id == user_id, QuizAttempt.quiz_id == quiz_id, QuizAttempt.finished_at.is_(None)
+        ).order_by(QuizAttempt.id.desc()).limit(1)
+    ).scalar()
+    if attempt is None:
+        attempt = QuizAttempt(user_id=user_id, quiz_id=quiz_id, answers={})
+        session.add(attempt)
+        session.commit()
+    return attempt
+
+
+def save_answers(attempt_id, user_id, answers, session=None):
+    ''' Add answers to an open attempt, replacing the previous answers to the same questions.
+        Only the attempt row is written. Returns all the saved answers, None if the attempt does not exist
+        or is finished. '''
+    session = session or db.session
+    try:
+        attempt = load_attempt(attempt_id, user_id, session, for_update=True)
+        if attempt is None or not attempt.is_open:
+            session.rollback()
+            return None
+        saved = {**attempt.answers, **{str(question_id): option for question_id, option in answers.items()}}
+        # unless it was finished in the meantime (databases without row locks)
+        written = session.execute(
+            update(QuizAttempt).where(QuizAttempt.id == attempt_id, QuizAttempt.finished_at.is_(None))
+            .values(answers=saved)
+        ).rowcount
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    return saved if written else None
+
+
+def finish_attempt(attempt_id, user_id, quiz, session=None):
+    ''' Finish an open attempt: its saved answers, and only them, are scored and stored as the latest attempt
+        of the result of the user for the quiz (see submission.submit_quiz), the unanswered questions count
+        as wrong.
+        Returns the Submission, None if the attempt does not exist or is already finished. '''
+    session = session or db.session
+    attempt = load_attempt(attempt_id, user_id, session)
+    if attempt is None:
+        return None
+    # the attempt is closed in the transaction of the submission, a second finish changes nothing
+    closed = session.execute(
+        update(QuizAttempt).where(QuizAttempt.id == attempt_id, QuizAttempt.finished_at.is_(None))
+        .values(finished_at=datetime.now(timezone.utc))
+    ).rowcount
+    if not closed:
+        session.rollback()
+        return None
+    session.refresh(attempt)
+    # the questions removed from the quiz since they were answered are ignored
+    answers = {int(question_id): option for question_id, option in attempt.answers.items()
+               if int(question_id) in quiz.answer_key}
+    return submit_quiz(
+        user_id, quiz.id, answers, quiz.answer_key, session, category_id=quiz.category_id, attempt_id=attempt_id
+    )
+
+
+def attempt_json(attempt, total_questions):
+    return {
+        'id': attempt.id,
+        'quiz_id': attempt.quiz_id,
+        'answers': attempt.answers,
+        'answered': len(attempt.answers),
+        'total_questions': total_questions,
+        'finished': not attempt.is_open,
+        'score': attempt.score,
+        'quiz_result_id': attempt.quiz_result_id,
+    }
+
+
+def old_attempts(before, archived):
+    ''' Select the ids of the attempts finished before a date which are neither the latest nor the best
+        attempt of a result, archived or not. '''
+    current = select(QuizResult.id).where(or_(
+        QuizResult.latest_attempt_id == QuizAttempt.id, QuizResult.best_attempt_id == QuizAttempt.id
+    ))
+    return select(QuizAttempt.id).where(
+        QuizAttempt.finished_at < before,
+        QuizAttempt.archived_at.is_not(None) if archived else QuizAttempt.archived_at.is_(None),
+        ~current.exists(),
+    ).order_by(QuizAttempt.id)
+
+
+def pack_attempt_responses(attempt_ids, session=None):
+    ''' Move the response rows of the attempts into their packed answers (see packing.py), in the current
+        transaction. The attempts without response rows are left as they are, and so are the ones with an
+        option which does not fit in a byte (stored before the submissions refused them).
+        Returns the number of attempts packed. '''
+    session = session or db.session
+    # a resubmission reads the responses of the latest attempt once its result is locked
+    session.execute(select(QuizResult.id).where(QuizResult.latest_attempt_id.in_(attempt_ids)).with_for_update())
+    rows = defaultdict(list)
+    for attempt_id, question_id, selected_option, is_correct in session.execute(
+        select(Response.attempt_id, Response.question_id, Response.selected_option, Response.is_correct)
+        .where(Response.attempt_id.in_(attempt_ids))
+    ):
+        rows[attempt_id].append(
+            {'question_id': question_id, 'selected_option': selected_option, 'is_correct': is_correct}
+        )
+    rows = {attempt_id: attempt_rows for attempt_id, attempt_rows in rows.items() if fits(attempt_rows)}
+    if rows:
+        packed = []
+        for attempt_id, attempt_rows in rows.items():
+            packed_answers, correct_bitmap = pack_answers(attempt_rows)
+            packed.append({'attempt_id': attempt_id, 'packed': packed_answers, 'bitmap': correct_bitmap})
+        session.execute(
+            update(QuizAttempt.__table__).where(QuizAttempt.id == bindparam('attempt_id'))
+            .values(packed_answers=bindparam('packed'), correct_bitmap=bindparam('bitmap')),
+            packed
+        )
+        session.execute(delete(Response).where(Response.attempt_id.in_(list(rows))))
+    return len(rows)
+
+
+def pack_responses(quiz_id=None, batch_size=1000):
+    ''' Move the response rows of every attempt (of a quiz) into their packed answers, batch_size attempts
+        per transaction, e.g. after switching RESPONSE_STORAGE to 'packed'. Returns the number of attempts packed. '''
+    session = db.session
+    packed = 0
+    last_id = 0
+    while True:
+        query = select(Response.attempt_id).distinct().where(Response.attempt_id > last_id)
+        if quiz_id is not None:
+            query = query.where(Response.quiz_id == quiz_id)
+        attempt_ids = session.execute(query.order_by(Response.attempt_id).limit(batch_size)).scalars().all()
+        if not attempt_ids:
+            return packed
+        try:
+            packed += pack_attempt_responses(attempt_ids, session)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        last_id = attempt_ids[-1]
+
+
+def compact_attempts(archive_before, delete_before=None, batch_size=1000):
+    ''' Bound the growth of the attempt history. The old attempts finished before archive_before are
+        archived: their response rows are packed in the attempt (see pack_attempt_responses), one row instead
+        of one per question. Then the archived attempts finished before delete_before, if given, are deleted.
+        The latest and the best attempt of a result are never touched. Works in batches of batch_size attempts,
+        each in its own transaction. Returns the number of attempts archived and deleted. '''
+    session = db.session
+    archived = 0
+    while True:
+        attempt_ids = session.execute(old_attempts(archive_before, archived=False).limit(batch_size)).scalars().all()
+        if not attempt_ids:
+            break
+        try:
+            pack_attempt_responses(attempt_ids, session)
+            session.execute(
+                update(QuizAttempt).where(QuizAttempt.id.in_(attempt_ids))
+                .values(archived_at=datetime.now(timezone.utc))
+            )
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        archived += len(attempt_ids)
+
+    deleted = 0
+    while delete_before is not None:
+        attempt_ids = session.execute(old_attempts(delete_before, archived=True).limit(batch_size)).scalars().all()
+        if not attempt_ids:
+            break
+        session.execute(delete(QuizAttempt).where(QuizAttempt.id.in_(attempt_ids)))
+        session.commit()
+        deleted += len(attempt_ids)
+    return archived, deleted
@@ -0,0 +1,297 @@
+import asyncio
+import pickle
+import time
+from collections import namedtuple, OrderedDict
+from threading import Lock
+from types import MappingProxyType
+from flask import current_app, g, has_app_context, has_request_context
+from flask_login import UserMixin
+from markupsafe import Markup
+
+from .cache_backends import make_backend, LocalBackend
+from .replicas import RoutingSession, use_primary
+from sqlalchemy import event
+
+
+# Immutable snapshots of a quiz and its questions, shared between requests and workers
+QuestionSnapshot = namedtuple('QuestionSnapshot', ['id', 'text', 'options'])
+CategorySnapshot = namedtuple('CategorySnapshot', ['id', 'name'])
+
+
+class SessionUser(namedtuple('SessionUser', ['id', 'username', 'email', 'is_admin']), UserMixin):
+    ''' What the requests need of the logged in user, it stands for the User model as current_user. '''
+    __slots__ = ()
+
+
+class QuizSnapshot(namedtuple('QuizSnapshot', [
+        'id', 'title', 'description', 'category_id', 'total_questions', 'version', 'questions', 'answer_key'])):
+    __slots__ = ()
+
+    def __reduce__(self):
+        # the read-only answer key can't be pickled, store it as a plain dict
+        return (_restore_quiz_snapshot, (tuple(self[:-1]), dict(self.answer_key)))
+
+
+def _restore_quiz_snapshot(fields, answer_key):
+    return QuizSnapshot(*fields, MappingProxyType(answer_key))
+
+
+class Cache:
+    ''' Cache shared by every worker, on top of a pluggable backend (see cache_backends).
+        Entries live in namespaces which have a generation counter stored in the backend.
+        Bumping the generation of a namespace invalidates all its entries on every worker:
+        generations are read at most once per request, so an edit is seen by the next request.
+        Entries without a ttl are also kept in a small in-process LRU in front of the backend.
+        Values are always loaded from the primary database, a replica could be behind the generation. '''
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.prefix = 'quiz_app:'
+        self.default_ttl = None
+        self.local_size = 1024
+        self._local = OrderedDict()
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.backend = make_backend(app.config)
+        if app.config.get('CACHE_REQUIRE_SHARED') and isinstance(self.backend, LocalBackend):
+            # each worker would have its own invalidations, counters and leaderboards
+            raise RuntimeError('CACHE_BACKEND must be "redis" or "sqlite" with this configuration, not "local"')
+        self.prefix = app.config.get('CACHE_PREFIX', 'quiz_app:')
+        self.default_ttl = app.config.get('CACHE_DEFAULT_TTL')
+        self.local_size = app.config.get('CACHE_LOCAL_SIZE', 1024)
+        # the entries in front of a previous backend belong to its generations
+        with self._lock:
+            self._local.clear()
+        app.extensions['cache'] = self
+
+    def generation(self, namespace):
+        ''' Get the current generation of a namespace. '''
+        if not has_request_context():
+            return self.backend.get_int(f'{self.prefix}gen:{namespace}')
+        generations = g.setdefault('cache_generations', {})
+        if namespace not in generations:
+            generations[namespace] = self.backend.get_int(f'{self.prefix}gen:{namespace}')
+        return generations[namespace]
+
+    def bump(self, *namespaces):
+        ''' Invalidate every entry of the given namespaces, on every worker. '''
+        for namespace in namespaces:
+            self.backend.incr(f'{self.prefix}gen:{namespace}')
+            self.backend.set(f'{self.prefix}mtime:{namespace}', str(time.time()).encode())
+            # g lives on the app context, which the requests of a test client or a command share
+            if has_app_context():
+                g.setdefault('cache_generations', {}).pop(namespace, None)
+
+    def modified_at(self, namespace):
+        ''' Get the time (a timestamp) of the last bump of a namespace, None if it was never bumped. '''
+        value = self.backend.get(f'{self.prefix}mtime:{namespace}')
+        return float(value) if value is not None else None
+
+    def incr(self, key, ttl=None):
+        ''' Increment a counter shared by the workers, which expires ttl seconds after its first increment. '''
+        return self.backend.incr(f'{self.prefix}counter:{key}', 1, ttl)
+
+    def get_counter(self, key):
+        return self.backend.get_int(f'{self.prefix}counter:{key}')
+
+    def reset_counter(self, key):
+        self.backend.delete(f'{self.prefix}counter:{key}')
+
+    def _key(self, namespace, key):
+        return f'{self.prefix}{namespace}:{self.generation(namespace)}:{key}'
+
+    def get(self, namespace, key):
+        ''' Get a cached value, None on a miss. '''
+        return self._get(self._key(namespace, key))
+
+    def _lookup(self, namespace, key):
+        full_key = self._key(namespace, key)
+        return full_key, self._get(full_key)
+
+    def _get(self, full_key):
+        with self._lock:
+            if full_key in self._local:
+                self._local.move_to_end(full_key)
+                return self._local[full_key]
+        data = self.backend.get(full_key)
+        if data is None:
+            return None
+        value = pickle.loads(data)
+        self._remember(full_key, value)
+        return value
+
+    def set(self, namespace, key, value, ttl=None):
+        ''' Cache a value for the current generation of the namespace. '''
+        full_key = self._key(namespace, key)
+        self.backend.set(full_key, pickle.dumps(value), ttl or self.default_ttl)
+        if ttl is None:
+            self._remember(full_key, value)
+
+    def delete(self, namespace, key):
+        full_key = self._key(namespace, key)
+        self.backend.delete(full_key)
+        with self._lock:
+            self._local.pop(full_key, None)
+
+    def get_or_load(self, namespace, key, load, ttl=None):
+        ''' Get a cached value, calling load() and caching its result on a miss.
+            The key is built before loading, so a value loaded while the namespace
+            was bumped is stored under the old generation and never read again. '''
+        full_key = self._key(namespace, key)
+        value = self.get(namespace, key)
+        if value is None:
+            with use_primary():
+                value = load()
+            self._store(full_key, value, ttl)
+        return value
+
+    async def get_or_load_async(self, namespace, key, load, ttl=None):
+        ''' Same as get_or_load, for the async views: load() returns an awaitable, and the backend is
+            called with call_async. '''
+        full_key, value = await self.call_async(self._lookup, namespace, key)
+        if value is None:
+            value = await load()
+            await self.call_async(self._store, full_key, value, ttl)
+        return value
+
+    async def call_async(self, function, *args):
+        ''' Call a function which uses the backend from an async view. It runs in a thread, with the context
+            of the request, so that the file or network I/O of the backend doesn't block the event loop.
+            The in-process backend has no I/O, it is called directly. '''
+        if isinstance(self.backend, LocalBackend):
+            return function(*args)
+        return await asyncio.to_thread(function, *args)
+
+    def _store(self, full_key, value, ttl):
+        if value is not None:
+            self.backend.set(full_key, pickle.dumps(value), ttl or self.default_ttl)
+            if ttl is None:
+                self._remember(full_key, value)
+
+    def _remember(self, full_key, value):
+        with self._lock:
+            self._local[full_key] = value
+            self._local.move_to_end(full_key)
+            while len(self._local) > self.local_size:
+                self._local.popitem(last=False)
+
+
+def get_cache():
+    return current_app.extensions['cache']
+
+
+def load_quiz_snapshot(quiz_id, version=0, session=None):
+    ''' Load a quiz and its questions from the database as a QuizSnapshot.
+        Returns None if the quiz does not exist. '''
+    from . import db
+    from .models import Quiz, Question
+    session = session or db.session
+    quiz = session.get(Quiz, quiz_id)
+    if quiz is None:
+        return None
+    questions = session.query(Question).filter_by(quiz_id=quiz_id).order_by(Question.id).all()
+    return QuizSnapshot(
+        id=quiz.id,
+        title=quiz.title,
+        description=quiz.description,
+        category_id=quiz.category_id,
+        total_questions=quiz.total_questions,
+        version=version,
+        questions=tuple(QuestionSnapshot(q.id, q.text, tuple(q.options)) for q in questions),
+        answer_key=MappingProxyType({q.id: q.correct_option for q in questions}),
+    )
+
+
+def get_quiz_snapshot(quiz_id):
+    ''' Get the snapshot of a quiz from the cache, None if the quiz does not exist. '''
+    cache = get_cache()
+    namespace = f'quiz:{quiz_id}'
+    version = cache.generation(namespace)
+    return cache.get_or_load(namespace, 'snapshot', lambda: load_quiz_snapshot(quiz_id, version))
+
+
+def get_cached_html(namespace, key, render):
+    ''' Get a rendered fragment of a page from the cache, calling render() on a miss.
+        The html must only depend on what the namespace covers: nothing about the user, no csrf token. '''
+    return Markup(get_cache().get_or_load(namespace, f'html:{key}', render))
+
+
+async def get_cached_html_async(namespace, key, render):
+    ''' Same as get_cached_html, for the async views: render() returns an awaitable. '''
+    return Markup(await get_cache().get_or_load_async(namespace, f'html:{key}', render))
+
+
+def invalidate_quizzes(*quiz_ids):
+    ''' Call it after a quiz or its questions change, or after a quiz is added.
+        The 'quizzes' namespace covers the lists of quizzes. '''
+    get_cache().bump('quizzes', *(f'quiz:{quiz_id}' for quiz_id in quiz_ids))
+
+
+def load_session_user(user_id, session=None):
+    ''' Load a user from the database as a SessionUser, None if the user does not exist. '''
+    from . import db
+    from .models import User
+    user = (session or db.session).get(User, user_id)
+    if user is None:
+        return None
+    return SessionUser(user.id, user.username, user.email, bool(user.is_admin))
+
+
+def get_session_user(user_id):
+    ''' Get the user of a session from the cache (for SESSION_USER_TTL seconds), None if it does not exist. '''
+    return get_cache().get_or_load(
+        f'user:{user_id}', 'session', lambda: load_session_user(user_id),
+        ttl=current_app.config['SESSION_USER_TTL']
+    )
+
+
+def invalidate_users(*user_ids):
+    ''' Called after a user is updated or deleted, see the session events below. '''
+    get_cache().bump(*(f'user:{user_id}' for user_id in user_ids))
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def collect_changed_users(db_session, flush_context):
+    from .models import User
+    changed = db_session.info.setdefault('changed_users', set())
+    for instance in (*db_session.dirty, *db_session.deleted):
+        if isinstance(instance, User) and instance.id is not None:
+            changed.add(instance.id)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def invalidate_changed_users(db_session):
+    # only once committed, a request could otherwise cache the old user again
+    changed = db_session.info.pop('changed_users', None)
+    if changed:
+        invalidate_users(*changed)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def forget_changed_users(db_session):
+    db_session.info.pop('changed_users', None)
+
+
+def get_quiz_choices():
+    ''' Get the (id, title) of every quiz, for the select fields, from the cache. '''
+    def load():
+        from . import db
+        from .models import Quiz
+        return [tuple(row) for row in db.session.query(Quiz.id, Quiz.title).order_by(Quiz.id)]
+    return get_cache().get_or_load('quizzes', 'choices', load)
+
+
+def get_categories():
+    ''' Get all the categories, as CategorySnapshot, from the cache. '''
+    def load():
+        from .models import Category
+        return [CategorySnapshot(c.id, c.name) for c in Category.query.order_by(Category.id)]
+    return get_cache().get_or_load('categories', 'all', load)
+
+
+def invalidate_categories():
+    ''' Call it after a category is added, updated or deleted. '''
+    get_cache().bump('categories')
@@ -0,0 +1,336 @@
+import bisect
+import sqlite3
+import threading
+import time
+from operator import itemgetter
+
+
+class LocalBackend:
+    ''' Cache backend kept in the memory of the current process.
+        Shared by every thread of a worker, used in development and tests.
+        A sorted set is a dict of member -> score and a list of (score, member) kept sorted with bisect:
+        a rank is logarithmic, but a new score shifts the list, it is linear in the size of the leaderboard. '''
+
+    def __init__(self):
+        self._data = {}
+        self._zsets = {}
+        self._lock = threading.Lock()
+
+    def _alive(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires is not None and expires < time.time():
+            del self._data[key]
+            return None
+        return item
+
+    def get(self, key):
+        with self._lock:
+            item = self._alive(key)
+            return item[0] if item else None
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+                self._zsets.pop(key, None)
+
+    def incr(self, key, amount=1, ttl=None):
+        # the ttl is set when the counter is created, it is not extended by the next increments
+        with self._lock:
+            item = self._alive(key)
+            if item:
+                value, expires = int(item[0]) + amount, item[1]
+            else:
+                value, expires = amount, time.time() + ttl if ttl else None
+            self._data[key] = (value, expires)
+            return value
+
+    def get_int(self, key):
+        value = self.get(key)
+        return int(value) if value is not None else 0
+
+    # sorted sets, see leaderboards.py
+
+    def _zset(self, key):
+        if key not in self._zsets:
+            self._zsets[key] = ({}, [])
+        return self._zsets[key]
+
+    def _zset_score(self, zset, member, score):
+        scores, ordered = zset
+        if member in scores:
+            del ordered[bisect.bisect_left(ordered, (scores[member], member))]
+        scores[member] = score
+        bisect.insort(ordered, (score, member))
+
+    def zadd(self, key, member, score):
+        with self._lock:
+            self._zset_score(self._zset(key), member, float(score))
+
+    def zincrby(self, key, member, amount):
+        with self._lock:
+            zset = self._zset(key)
+            score = zset[0].get(member, 0.0) + amount
+            self._zset_score(zset, member, score)
+            return score
+
+    def zrem(self, key, *members):
+        with self._lock:
+            scores, ordered = self._zset(key)
+            for member in members:
+                if member in scores:
+                    del ordered[bisect.bisect_left(ordered, (scores.pop(member), member))]
+
+    def zreplace(self, key, scores):
+        zset = ({member: float(score) for member, score in scores.items()}, [])
+        zset[1].extend(sorted((score, member) for member, score in zset[0].items()))
+        with self._lock:
+            self._zsets[key] = zset
+
+    def ztop(self, key, count):
+        with self._lock:
+            ordered = self._zsets.get(key, ({}, []))[1]
+            return [(member, score) for score, member in reversed(ordered[-count:])] if count > 0 else []
+
+    def zranks(self, pairs):
+        ranks = []
+        with self._lock:
+            for key, member in pairs:
+                scores, ordered = self._zsets.get(key, ({}, []))
+                if member not in scores:
+                    ranks.append(None)
+                    continue
+                higher = len(ordered) - bisect.bisect_right(ordered, scores[member], key=itemgetter(0))
+                ranks.append((higher + 1, scores[member], len(ordered)))
+        return ranks
+
+
+class SQLiteBackend:
+    ''' Cache backend stored in a SQLite file, shared by every worker of the same host.
+        A stand-in for Redis in development and small single-host deployments: the rank of a member
+        counts the higher scores of its sorted set, it is linear in the size of the leaderboard. '''
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                'key TEXT PRIMARY KEY, value BLOB, expires REAL)'
+            )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS zset ('
+                'key TEXT, member TEXT, score REAL, PRIMARY KEY (key, member))'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS zset_score ON zset (key, score)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connect().execute(
+            'SELECT value FROM cache WHERE key = ? AND (expires IS NULL OR expires >= ?)',
+            (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + ttl if ttl else None
+        conn = self._connect()
+        conn.execute(
+            'INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+            (key, value, expires)
+        )
+        # purge the expired entries from time to time
+        self._writes += 1
+        if self._writes % 1000 == 0:
+            conn.execute('DELETE FROM cache WHERE expires < ?', (time.time(),))
+
+    def delete(self, *keys):
+        conn = self._connect()
+        conn.executemany('DELETE FROM cache WHERE key = ?', [(key,) for key in keys])
+        conn.executemany('DELETE FROM zset WHERE key = ?', [(key,) for key in keys])
+
+    def incr(self, key, amount=1, ttl=None):
+        now = time.time()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # an expired counter starts again from amount, with a new ttl
+            conn.execute(
+                'INSERT INTO cache (key, value, expires) VALUES (?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET '
+                'value = CASE WHEN expires < ? THEN ? ELSE CAST(value AS INTEGER) + ? END, '
+                'expires = CASE WHEN expires < ? THEN excluded.expires ELSE expires END',
+                (key, amount, now + ttl if ttl else None, now, amount, amount, now)
+            )
+            value = conn.execute('SELECT value FROM cache WHERE key = ?', (key,)).fetchone()[0]
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return int(value)
+
+    def get_int(self, key):
+        value = self.get(key)
+        return int(value) if value is not None else 0
+
+    # sorted sets, see leaderboards.py: the (key, score) index serves the top, a rank scans the higher scores
+
+    def zadd(self, key, member, score):
+        self._connect().execute(
+            'INSERT OR REPLACE INTO zset (key, member, score) VALUES (?, ?, ?)', (key, member, score)
+        )
+
+    def zincrby(self, key, member, amount):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'INSERT INTO zset (key, member, score) VALUES (?, ?, ?) '
+                'ON CONFLICT(key, member) DO UPDATE SET score = score + excluded.score',
+                (key, member, amount)
+            )
+            score = conn.execute('SELECT score FROM zset WHERE key = ? AND member = ?', (key, member)).fetchone()[0]
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return score
+
+    def zrem(self, key, *members):
+        self._connect().executemany(
+            'DELETE FROM zset WHERE key = ? AND member = ?', [(key, member) for member in members]
+        )
+
+    def zreplace(self, key, scores):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM zset WHERE key = ?', (key,))
+            conn.executemany(
+                'INSERT INTO zset (key, member, score) VALUES (?, ?, ?)',
+                [(key, member, score) for member, score in scores.items()]
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def ztop(self, key, count):
+        return [tuple(row) for row in self._connect().execute(
+            'SELECT member, score FROM zset WHERE key = ? ORDER BY score DESC, member DESC LIMIT ?', (key, count)
+        )]
+
+    def zranks(self, pairs):
+        conn = self._connect()
+        ranks = []
+        for key, member in pairs:
+            row = conn.execute(
+                'SELECT score, (SELECT COUNT(*) FROM zset WHERE key = z.key AND score > z.score), '
+                '(SELECT COUNT(*) FROM zset WHERE key = z.key) FROM zset AS z WHERE key = ? AND member = ?',
+                (key, member)
+            ).fetchone()
+            ranks.append((row[1] + 1, row[0], row[2]) if row else None)
+        return ranks
+
+
+class RedisBackend:
+    ''' Cache backend speaking the Redis protocol (Redis, Valkey, KeyDB, ...).
+        Needs the redis package, which is only imported when this backend is used. '''
+
+    def __init__(self, url=None, client=None):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError('The redis package is required for CACHE_BACKEND = "redis"')
+            client = redis.Redis.from_url(url)
+        self.client = client
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, value, ex=ttl)
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*keys)
+
+    def incr(self, key, amount=1, ttl=None):
+        if not ttl:
+            return int(self.client.incr(key, amount))
+        pipeline = self.client.pipeline()
+        # creates the counter with its ttl, unless it exists
+        pipeline.set(key, 0, ex=ttl, nx=True)
+        pipeline.incr(key, amount)
+        return int(pipeline.execute()[1])
+
+    def get_int(self, key):
+        value = self.client.get(key)
+        return int(value) if value is not None else 0
+
+    # sorted sets, see leaderboards.py
+
+    def zadd(self, key, member, score):
+        self.client.zadd(key, {member: score})
+
+    def zincrby(self, key, member, amount):
+        return float(self.client.zincrby(key, amount, member))
+
+    def zrem(self, key, *members):
+        if members:
+            self.client.zrem(key, *members)
+
+    def zreplace(self, key, scores):
+        pipeline = self.client.pipeline()
+        pipeline.delete(key)
+        if scores:
+            pipeline.zadd(key, scores)
+        pipeline.execute()
+
+    def ztop(self, key, count):
+        if count <= 0:
+            return []
+        return [(member.decode(), score) for member, score in self.client.zrevrange(key, 0, count - 1, withscores=True)]
+
+    def zranks(self, pairs):
+        # the scores first, then the number of higher scores and the size of each set, in two round trips
+        pipeline = self.client.pipeline(transaction=False)
+        for key, member in pairs:
+            pipeline.zscore(key, member)
+        scores = pipeline.execute()
+        for (key, member), score in zip(pairs, scores):
+            if score is not None:
+                pipeline.zcount(key, f'({score}', '+inf')
+                pipeline.zcard(key)
+        counts = iter(pipeline.execute())
+        return [(next(counts) + 1, score, next(counts)) if score is not None else None for score in scores]
+
+
+def make_backend(config):
+    ''' Build the cache backend named by the CACHE_BACKEND setting. '''
+    name = config.get('CACHE_BACKEND', 'local')
+    if name == 'local':
+        return LocalBackend()
+    if name == 'sqlite':
+        return SQLiteBackend(config.get('CACHE_URL') or 'quiz_app_cache.db')
+    if name == 'redis':
+        return RedisBackend(config.get('CACHE_URL') or 'redis://localhost:6379/0')
+    raise ValueError(f'Unknown cache backend: {name}')
@@ -0,0 +1,116 @@
+import click
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select
+
+from . import db
+from .export import EXPORTS, FORMATS, export_rows
+from .importer import read_questions, import_questions
+from .leaderboards import rebuild_leaderboards
+from .attempts import compact_attempts, pack_responses
+from .duplicates import remove_duplicate_results
+from .models import Quiz
+from .rescoring import rescore_quiz, rescore_pending
+
+
+def register_commands(app):
+    ''' Register the flask commands of the application (run `flask --app manage --help`). '''
+
+    @app.cli.command('export')
+    @click.argument('kind', type=click.Choice(list(EXPORTS)))
+    @click.option('--format', 'fmt', type=click.Choice(list(FORMATS)), default='csv', show_default=True)
+    @click.option('--quiz-id', type=int, help='Only export the rows of this quiz.')
+    @click.option('--category-id', type=int, help='Only export the rows of the quizzes of this category.')
+    @click.option('--min-id', type=int, help='Only export the rows with an id greater or equal (incremental exports).')
+    @click.option('--max-id', type=int, help='Only export the rows with an id lower or equal.')
+    @click.option('--output', '-o', type=click.File('w'), default='-', help='Output file, stdout by default.')
+    def export(kind, fmt, quiz_id, category_id, min_id, max_id, output):
+        ''' Export the quiz results or the responses as CSV or JSON Lines. '''
+        chunks = export_rows(
+            kind, fmt, app.config['EXPORT_BATCH_SIZE'],
+            quiz_id=quiz_id, category_id=category_id, min_id=min_id, max_id=max_id
+        )
+        for chunk in chunks:
+            output.write(chunk)
+
+    @app.cli.command('import-questions')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--dry-run', is_flag=True, help='Only check the file, nothing is imported.')
+    def import_questions_command(path, dry_run):
+        ''' Import questions from a CSV or JSON file. '''
+        with open(path, 'rb') as stream:
+            try:
+                rows = read_questions(stream, path)
+            except ValueError as error:
+                raise click.ClickException(str(error))
+        try:
+            report = import_questions(rows, app.config['IMPORT_BATCH_SIZE'], dry_run=dry_run)
+        except ValueError as error:
+            raise click.ClickException(str(error))
+        for number, error in report.errors:
+            click.echo(f'row {number}: {error}', err=True)
+        action = 'would be imported' if dry_run else 'imported'
+        click.echo(f'{report.imported} questions {action}, {len(report.errors)} rows rejected.')
+
+    @app.cli.command('dedupe-results')
+    @click.option('--report', type=click.File('w'), required=True,
+                  help='File receiving the removed results and responses as JSON Lines.')
+    @click.option('--dry-run', is_flag=True, help='Only write the report, nothing is removed.')
+    def dedupe_results_command(report, dry_run):
+        ''' Keep only the latest result of each user and quiz, needed before the migration which makes them
+            unique (7c3e9a1d54b2). '''
+        with db.engine.begin() as connection:
+            results, responses = remove_duplicate_results(connection, report, dry_run=dry_run)
+        action = 'would be removed' if dry_run else 'removed'
+        click.echo(f'{results} results and {responses} responses {action}, see {report.name}.')
+
+    @app.cli.command('rebuild-leaderboards')
+    @click.option('--quiz-id', 'quiz_ids', type=int, multiple=True, help='Only rebuild the leaderboard of this quiz.')
+    @click.option('--category-id', 'category_ids', type=int, multiple=True,
+                  help='Only rebuild the leaderboard of this category.')
+    def rebuild_leaderboards_command(quiz_ids, category_ids):
+        ''' Rebuild the leaderboards from the quiz results, all of them by default. '''
+        if quiz_ids or category_ids:
+            quizzes, categories = rebuild_leaderboards(quiz_ids, category_ids)
+        else:
+            quizzes, categories = rebuild_leaderboards()
+        click.echo(f'{quizzes} quiz and {categories} category leaderboards rebuilt.')
+
+    @app.cli.command('compact-attempts')
+    @click.option('--archive-days', type=int, help='Archive the attempts finished this many days ago '
+                  '(ATTEMPT_ARCHIVE_DAYS by default).')
+    @click.option('--retention-days', type=int, help='Delete the archived attempts finished this many days ago, '
+                  '0 keeps them (ATTEMPT_RETENTION_DAYS by default).')
+    def compact_attempts_command(archive_days, retention_days):
+        ''' Archive the responses of the previous attempts and delete the oldest attempts, to run periodically. '''
+        archive_days = app.config['ATTEMPT_ARCHIVE_DAYS'] if archive_days is None else archive_days
+        retention_days = app.config['ATTEMPT_RETENTION_DAYS'] if retention_days is None else retention_days
+        now = datetime.now(timezone.utc)
+        archived, deleted = compact_attempts(
+            now - timedelta(days=archive_days),
+            now - timedelta(days=retention_days) if retention_days else None,
+            app.config['COMPACTION_BATCH_SIZE'],
+        )
+        click.echo(f'{archived} attempts archived, {deleted} deleted.')
+
+    @app.cli.command('pack-responses')
+    @click.option('--quiz-id', type=int, help='Only pack the responses of this quiz.')
+    def pack_responses_command(quiz_id):
+        ''' Move the response rows into the packed answers of their attempts, see RESPONSE_STORAGE. '''
+        packed = pack_responses(quiz_id, app.config['COMPACTION_BATCH_SIZE'])
+        click.echo(f'the responses of {packed} attempts packed.')
+
+    @app.cli.command('rescore')
+    @click.option('--quiz-id', 'quiz_ids', type=int, multiple=True, help='Only rescore this quiz.')
+    @click.option('--pending', is_flag=True, help='Only rescore the quizzes whose answer key was changed '
+                  'since their last rescore, to run periodically.')
+    def rescore_command(quiz_ids, pending):
+        ''' Recompute the correctness of the stored answers and the scores against the current answer keys,
+            every quiz by default. '''
+        if pending:
+            rescores = rescore_pending(app.config['RESCORE_BATCH_SIZE'])
+        else:
+            quiz_ids = quiz_ids or db.session.execute(select(Quiz.id).order_by(Quiz.id)).scalars().all()
+            rescores = {quiz_id: rescore_quiz(quiz_id, app.config['RESCORE_BATCH_SIZE']) for quiz_id in quiz_ids}
+        for quiz_id, rescore in rescores.items():
+            click.echo(f'quiz {quiz_id}: {rescore.responses} responses, {rescore.attempts} attempts and '
+                       f'{rescore.results} results rescored.')
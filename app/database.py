@@ -0,0 +1,152 @@
+import time
+from weakref import WeakSet
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+from .metrics import registry
+from .replicas import REPLICA_BIND_PREFIX
+
+
+# the async drivers get the async version of the pool
+ASYNC_DRIVER_NAMES = ('aiosqlite', 'aiomysql', 'asyncpg')
+
+POOL_CHECKOUT_SECONDS = registry.histogram(
+    'db_pool_checkout_seconds', 'Time spent waiting for a connection of the pool.', ['pool']
+)
+POOL_CHECKOUT_TIMEOUTS = registry.counter(
+    'db_pool_checkout_timeouts_total', 'Checkouts which gave up after the pool timeout.', ['pool']
+)
+
+_pools = WeakSet()
+
+
+class InstrumentedPool:
+    ''' Measure the time spent waiting for a connection, which grows when the pool is saturated. '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        _pools.add(self)
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except TimeoutError:
+            POOL_CHECKOUT_TIMEOUTS.inc(pool=self.logging_name)
+            raise
+        finally:
+            POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - start, pool=self.logging_name)
+
+
+class InstrumentedQueuePool(InstrumentedPool, QueuePool):
+    pass
+
+
+class InstrumentedAsyncAdaptedQueuePool(InstrumentedPool, AsyncAdaptedQueuePool):
+    pass
+
+
+def collect_pool_status(field):
+    def collect():
+        for pool in list(_pools):
+            capacity = pool.size() + max(pool._max_overflow, 0)
+            status = {
+                'size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'saturation': pool.checkedout() / capacity if capacity else 0,
+            }
+            yield {'pool': pool.logging_name}, status[field]
+    return collect
+
+
+registry.gauge('db_pool_size', 'Connections kept open by the pool.', ['pool'], collect_pool_status('size'))
+registry.gauge('db_pool_checked_out', 'Connections in use.', ['pool'], collect_pool_status('checked_out'))
+registry.gauge(
+    'db_pool_saturation', 'Connections in use out of pool size + max overflow.', ['pool'],
+    collect_pool_status('saturation')
+)
+
+
+def is_memory_sqlite(url):
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def statement_timeout_args(url, timeout):
+    ''' The connect_args which stop the statements running for more than `timeout` milliseconds. '''
+    backend, driver = url.get_backend_name(), url.get_driver_name()
+    if not timeout:
+        return {}
+    if backend == 'postgresql':
+        if driver == 'asyncpg':
+            return {'server_settings': {'statement_timeout': str(timeout)}}
+        return {'options': f'-c statement_timeout={timeout}'}
+    if backend == 'mysql':
+        # MySQL only stops the SELECT statements
+        return {'init_command': f'SET SESSION max_execution_time={timeout}'}
+    return {}
+
+
+def engine_options(config, uri, name='primary', pool_size=None, max_overflow=None):
+    ''' Build the create_engine options of a database from the DB_* settings of the config.
+        pool_size and max_overflow override DB_POOL_SIZE and DB_MAX_OVERFLOW. '''
+    url = make_url(uri)
+    options = {}
+    # an in-memory sqlite database has a single connection, not a pool
+    if not is_memory_sqlite(url):
+        async_driver = url.get_driver_name() in ASYNC_DRIVER_NAMES
+        options.update(
+            poolclass=InstrumentedAsyncAdaptedQueuePool if async_driver else InstrumentedQueuePool,
+            pool_logging_name=name,
+            pool_size=config['DB_POOL_SIZE'] if pool_size is None else pool_size,
+            max_overflow=config['DB_MAX_OVERFLOW'] if max_overflow is None else max_overflow,
+            pool_timeout=config['DB_POOL_TIMEOUT'],
+            pool_recycle=config['DB_POOL_RECYCLE'],
+            pool_pre_ping=config['DB_POOL_PRE_PING'],
+        )
+    connect_args = statement_timeout_args(url, config['DB_STATEMENT_TIMEOUT'])
+    if url.get_backend_name() == 'sqlite':
+        # how long a connection waits for the lock of the database file
+        connect_args['timeout'] = config['SQLITE_BUSY_TIMEOUT']
+    if connect_args:
+        options['connect_args'] = connect_args
+    return options
+
+
+def configure_engine(app):
+    ''' Set SQLALCHEMY_ENGINE_OPTIONS from the DB_* settings and add the binds of the replicas, before db.init_app.
+        Options set in SQLALCHEMY_ENGINE_OPTIONS by the config take precedence. '''
+    uri = app.config.get('SQLALCHEMY_DATABASE_URI')
+    if uri:
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            **engine_options(app.config, uri), **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+        }
+    binds = replica_binds(app.config)
+    if binds:
+        app.config['SQLALCHEMY_BINDS'] = {**binds, **(app.config.get('SQLALCHEMY_BINDS') or {})}
+
+
+def replica_binds(config):
+    ''' Build the SQLALCHEMY_BINDS of the replicas listed in SQLALCHEMY_REPLICA_URIS (comma separated). '''
+    uris = [uri.strip() for uri in (config.get('SQLALCHEMY_REPLICA_URIS') or '').split(',') if uri.strip()]
+    return {
+        f'{REPLICA_BIND_PREFIX}{number}': {'url': uri, **engine_options(config, uri, f'{REPLICA_BIND_PREFIX}{number}')}
+        for number, uri in enumerate(uris)
+    }
+
+
+def enable_sqlite_wal(engine, config):
+    ''' Put a SQLite database file in WAL mode when SQLITE_WAL is set: readers don't block the writer,
+        and the writer doesn't block the readers. '''
+    url = engine.url
+    if url.get_backend_name() != 'sqlite' or is_memory_sqlite(url) or not config['SQLITE_WAL']:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        # with WAL, NORMAL is safe against corruption and avoids a sync on each commit
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
@@ -0,0 +1,32 @@
+import json
+from sqlalchemy import MetaData, Table, select, delete, func
+
+
+def duplicate_result_ids(quiz_result):
+    ''' Select the ids of the quiz results which are not the latest result of their user and quiz. '''
+    keep = select(func.max(quiz_result.c.id)).group_by(quiz_result.c.user_id, quiz_result.c.quiz_id)
+    return select(quiz_result.c.id).where(quiz_result.c.id.not_in(keep)).order_by(quiz_result.c.id)
+
+
+def remove_duplicate_results(connection, report, dry_run=False):
+    ''' Keep only the latest result of each user and quiz, the cleanup needed before the unique
+        (user_id, quiz_id) constraint of migration 7c3e9a1d54b2 can be added.
+        The tables are reflected, so it runs on the schema before that migration. Every removed result and
+        response is first written to the report, a stream, as JSON Lines ({"table": ..., "row": {...}}).
+        Returns the number of results and responses removed (or which would be, with dry_run). '''
+    metadata = MetaData()
+    quiz_result = Table('quiz_result', metadata, autoload_with=connection)
+    response = Table('response', metadata, autoload_with=connection)
+    result_ids = connection.execute(duplicate_result_ids(quiz_result)).scalars().all()
+    if not result_ids:
+        return 0, 0
+
+    responses = 0
+    for table, column in ((quiz_result, quiz_result.c.id), (response, response.c.quiz_result_id)):
+        for row in connection.execute(select(table).where(column.in_(result_ids)).order_by(table.c.id)).mappings():
+            report.write(json.dumps({'table': table.name, 'row': dict(row)}, default=str) + '\n')
+            responses += table is response
+    if not dry_run:
+        connection.execute(delete(response).where(response.c.quiz_result_id.in_(result_ids)))
+        connection.execute(delete(quiz_result).where(quiz_result.c.id.in_(result_ids)))
+    return len(result_ids), responses
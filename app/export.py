@@ -0,0 +1,101 @@
+import csv
+import io
+import json
+from sqlalchemy import select
+
+from . import db
+from .models import Quiz, QuizResult, QuizAttempt, Response
+from .packing import unpack_answers
+
+
+# What can be exported, and the columns written for each row
+EXPORTS = {
+    'results': (QuizResult, ['id', 'user_id', 'quiz_id', 'score', 'latest_attempt_id', 'best_attempt_id']),
+    'responses': (Response, ['id', 'quiz_result_id', 'attempt_id', 'user_id', 'quiz_id', 'question_id',
+                             'selected_option', 'is_correct']),
+    # the responses packed in the attempts (see packing.py)
+    'answers': (QuizAttempt, ['id', 'quiz_result_id', 'user_id', 'quiz_id', 'packed_answers', 'correct_bitmap']),
+}
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+def decode_answers(batch):
+    ''' Expand a batch of attempts with packed answers into one row per response. '''
+    return [
+        (attempt_id, quiz_result_id, user_id, quiz_id, row['question_id'], row['selected_option'], row['is_correct'])
+        for attempt_id, quiz_result_id, user_id, quiz_id, packed_answers, correct_bitmap in batch
+        for row in unpack_answers(packed_answers, correct_bitmap)
+    ]
+
+
+# the exports whose rows are decoded before they are written, with the columns written
+DECODED = {
+    'answers': (['attempt_id', 'quiz_result_id', 'user_id', 'quiz_id', 'question_id', 'selected_option',
+                 'is_correct'], decode_answers),
+}
+
+
+def export_statement(kind, quiz_id=None, category_id=None, min_id=None, max_id=None):
+    ''' Build the SELECT of an export, ordered by id so that an interrupted export can be resumed
+        with min_id. Raises KeyError for an unknown kind. '''
+    model, columns = EXPORTS[kind]
+    table = model.__table__
+    statement = select(*(table.c[column] for column in columns)).order_by(table.c.id)
+    if kind == 'answers':
+        # the attempts whose responses are rows are left out
+        statement = statement.where(table.c.packed_answers.is_not(None))
+    if quiz_id is not None:
+        statement = statement.where(table.c.quiz_id == quiz_id)
+    if category_id is not None:
+        statement = statement.where(table.c.quiz_id.in_(
+            select(Quiz.id).where(Quiz.category_id == category_id)
+        ))
+    if min_id is not None:
+        statement = statement.where(table.c.id >= min_id)
+    if max_id is not None:
+        statement = statement.where(table.c.id <= max_id)
+    return statement
+
+
+def iter_batches(statement, batch_size=1000):
+    ''' Run the statement with a server-side cursor and yield its rows batch by batch,
+        so that only one batch is held in memory. '''
+    result = db.session.execute(statement.execution_options(yield_per=batch_size))
+    for batch in result.partitions():
+        yield batch
+
+
+def iter_csv(batches, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for batch in batches:
+        writer.writerows([int(value) if isinstance(value, bool) else value for value in row] for row in batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_jsonl(batches, columns):
+    for batch in batches:
+        yield ''.join(json.dumps(dict(zip(columns, row))) + '\n' for row in batch)
+
+
+def export_rows(kind, fmt, batch_size=1000, **filters):
+    ''' Export the rows of `kind` (see EXPORTS) as chunks of text in the given format (see FORMATS).
+        Memory use depends on the batch size only, not on the number of rows. '''
+    if fmt not in FORMATS:
+        raise KeyError(fmt)
+    columns = EXPORTS[kind][1]
+    batches = iter_batches(export_statement(kind, **filters), batch_size)
+    if kind in DECODED:
+        columns, decode = DECODED[kind]
+        batches = (decode(batch) for batch in batches)
+    if fmt == 'csv':
+        return iter_csv(batches, columns)
+    return iter_jsonl(batches, columns)
@@ -1,10 +1,12 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired, FileAllowed
 from wtforms import StringField, PasswordField, SubmitField, BooleanField,  IntegerField, SelectField
 from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationError, NumberRange
 from wtforms.fields import FieldList
  
 
-from .models import User, Category, Quiz
+from .models import User
+from .cache import get_categories, get_quiz_choices
 
 class RegistrationForm(FlaskForm):
     username = StringField('Username', validators=[DataRequired(), Length(min=2, max=20)])
@@ -35,25 +37,49 @@ class CategoryForm(FlaskForm):
     name = StringField('Category Name', validators=[DataRequired(), Length(min=2, max=100)])
     submit = SubmitField('Add Category')
 
+class LazySelectField(SelectField):
+    ''' A SelectField whose choices are loaded by load_choices() when the field is rendered or validated,
+        not when the form is created. '''
+
+    def __init__(self, label=None, validators=None, load_choices=None, **kwargs):
+        super().__init__(label, validators, **kwargs)
+        self.load_choices = load_choices
+
+    @property
+    def choices(self):
+        if self._choices is None and getattr(self, 'load_choices', None) is not None:
+            self._choices = list(self.load_choices())
+        return self._choices
+
+    @choices.setter
+    def choices(self, choices):
+        self._choices = choices
+
+
+def get_category_choices():
+    return [(category.id, category.name) for category in get_categories()]
+
+
 class QuizForm(FlaskForm):
     title = StringField('Quiz Title', validators=[DataRequired(), Length(min=2, max=200)])
     description = StringField('Description', validators=[DataRequired(), Length(min=10, max=500)])
-    category_id = SelectField('Category', coerce=int)
+    # the choices come from the cached list of categories, only when the field is rendered or validated
+    category_id = LazySelectField('Category', coerce=int, load_choices=get_category_choices)
     submit = SubmitField('Add Quiz')
     total_questions = IntegerField('Total Questions', validators=[DataRequired(), NumberRange(min=0, max=100)])
 
-    # Populate the category choices from the database when the form is created(this technique is called lazy loading)
-    def __init__(self, *args, **kwargs):
-        super(QuizForm, self).__init__(*args, **kwargs)
-        self.category_id.choices = [(c.id, c.name) for c in Category.query.all()]
-
 class QuestionForm(FlaskForm):
     text = StringField('Question Text', validators=[DataRequired(), Length(min=5, max=500)])
     options = FieldList(StringField('Option', validators=[DataRequired(), Length(min=1, max=200)]), min_entries=4, max_entries=4)
     correct_option = IntegerField('Correct Option Index', validators=[DataRequired(), NumberRange(min=1, max=4)])
-    quiz_id = SelectField('Quiz', coerce=int)
+    quiz_id = LazySelectField('Quiz', coerce=int, load_choices=get_quiz_choices)
     submit = SubmitField('Add Question')
 
-    def __init__(self, *args, **kwargs):
-        super(QuestionForm, self).__init__(*args, **kwargs)
-        self.quiz_id.choices = [(q.id, q.title) for q in Quiz.query.all()]
\ No newline at end of file
+class QuizTakingForm(FlaskForm):
+    ''' The form of the quiz pages, it only renders and checks the csrf token:
+        the answers are read by submission.parse_answers. '''
+
+class ImportQuestionsForm(FlaskForm):
+    file = FileField('Questions File (CSV or JSON)', validators=[FileRequired(), FileAllowed(['csv', 'json'])])
+    dry_run = BooleanField('Only check the file')
+    submit = SubmitField('Import Questions')
@@ -0,0 +1,225 @@
+import csv
+import io
+import json
+from collections import namedtuple, Counter
+from sqlalchemy import select, insert, update, bindparam, literal_column, true, union_all
+from sqlalchemy.exc import IntegrityError
+
+from . import db
+from .models import Quiz, Question, QuestionStats, QuestionOptionStats
+from .cache import invalidate_quizzes
+
+
+# The outcome of an import: the number of questions imported and the (row number, message) of each rejected row
+ImportReport = namedtuple('ImportReport', ['imported', 'errors'])
+
+CSV_OPTION_COLUMNS = ['option_1', 'option_2', 'option_3', 'option_4']
+NUMBER_OF_OPTIONS = len(CSV_OPTION_COLUMNS)
+
+# the IN lists are split to stay under the bound parameter limits of the databases
+IN_CHUNK_SIZE = 500
+
+
+def read_csv(stream):
+    ''' Read questions from a CSV file with a header:
+        quiz_id or quiz_title, text, option_1, ..., option_4, correct_option. '''
+    for row in csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig')):
+        yield {
+            'quiz_id': row.get('quiz_id'),
+            'quiz_title': row.get('quiz_title'),
+            'text': row.get('text'),
+            'options': [row.get(column) for column in CSV_OPTION_COLUMNS],
+            'correct_option': row.get('correct_option'),
+        }
+
+
+def read_json(stream):
+    ''' Read questions from a JSON list of objects:
+        {"quiz_id" or "quiz_title", "text", "options": [...], "correct_option"}. '''
+    questions = json.load(stream)
+    if not isinstance(questions, list):
+        raise ValueError('the JSON file must hold a list of questions')
+    for question in questions:
+        yield question if isinstance(question, dict) else {}
+
+
+READERS = {
+    'csv': read_csv,
+    'json': read_json,
+}
+
+
+def read_questions(stream, filename):
+    ''' Read a file of questions, its format is given by the extension of its name.
+        Raises ValueError if the file can't be read. '''
+    extension = filename.rsplit('.', 1)[-1].lower()
+    if extension not in READERS:
+        raise ValueError('the file must be a .csv or a .json file')
+    try:
+        return list(READERS[extension](stream))
+    except (UnicodeDecodeError, csv.Error, json.JSONDecodeError) as error:
+        raise ValueError(f'the file can\'t be read: {error}')
+
+
+def parse_number(value):
+    ''' Read a whole number of a CSV cell or a JSON value, None if it is not one (1.5, true, a list...). '''
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value.strip())
+    return None
+
+
+def validate_question(row):
+    ''' Check a row like QuestionForm does, returns an error message or None. '''
+    text_value = row.get('text')
+    if not isinstance(text_value, str) or not 5 <= len(text_value.strip()) <= 500:
+        return 'the text must be between 5 and 500 characters'
+    options = row.get('options')
+    if not isinstance(options, list) or len(options) != NUMBER_OF_OPTIONS:
+        return f'a question must have {NUMBER_OF_OPTIONS} options'
+    if not all(isinstance(option, str) and 1 <= len(option.strip()) <= 200 for option in options):
+        return 'the options must be between 1 and 200 characters'
+    correct_option = parse_number(row.get('correct_option'))
+    if correct_option is None:
+        return 'the correct option must be a number'
+    if not 1 <= correct_option <= NUMBER_OF_OPTIONS:
+        return f'the correct option must be between 1 and {NUMBER_OF_OPTIONS}'
+    if row.get('quiz_id'):
+        if parse_number(row['quiz_id']) is None:
+            return 'the quiz_id must be a number'
+    elif not row.get('quiz_title'):
+        return 'the quiz_id or the quiz_title is required'
+    elif not isinstance(row['quiz_title'], str):
+        return 'the quiz_title must be a text'
+    return None
+
+
+def chunks(values, size=IN_CHUNK_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def load_quiz_ids(rows):
+    ''' Resolve the quizzes referenced by the rows, returns the known ids and a title -> id dict.
+        The rows are not validated yet: the ids which are not numbers and the titles which are not texts are
+        left out, validate_question rejects their rows. '''
+    ids = set()
+    titles = set()
+    for row in rows:
+        if row.get('quiz_id'):
+            if parse_number(row['quiz_id']) is not None:
+                ids.add(parse_number(row['quiz_id']))
+        elif isinstance(row.get('quiz_title'), str):
+            titles.add(row['quiz_title'])
+
+    known_ids = set()
+    for chunk in chunks(ids):
+        known_ids.update(db.session.execute(select(Quiz.id).where(Quiz.id.in_(chunk))).scalars())
+    id_by_title = {}
+    for chunk in chunks(titles):
+        id_by_title.update(db.session.execute(select(Quiz.title, Quiz.id).where(Quiz.title.in_(chunk))).all())
+    return known_ids, id_by_title
+
+
+def load_existing_texts(texts):
+    ''' Find which of the texts are already used by a question, with set based queries. '''
+    existing = set()
+    for chunk in chunks(texts):
+        existing.update(db.session.execute(select(Question.text).where(Question.text.in_(chunk))).scalars())
+    return existing
+
+
+def import_questions(rows, batch_size=1000, dry_run=False):
+    ''' Validate and import questions given as dicts (see read_csv and read_json).
+        Invalid rows and duplicates (in the file or in the database) are reported and skipped,
+        the valid ones are inserted in batches, in a single transaction. Raises ValueError, with nothing
+        imported, if a question of the file was added by someone else meanwhile. '''
+    rows = list(rows)
+    errors = []
+    known_ids, id_by_title = load_quiz_ids(rows)
+    existing_texts = load_existing_texts(
+        row['text'].strip() for row in rows if isinstance(row.get('text'), str)
+    )
+
+    questions = []
+    seen_texts = set()
+    for number, row in enumerate(rows, start=1):
+        error = validate_question(row)
+        if error is None:
+            text_value = row['text'].strip()
+            if row.get('quiz_id'):
+                quiz_id = parse_number(row['quiz_id'])
+                quiz_id = quiz_id if quiz_id in known_ids else None
+            else:
+                quiz_id = id_by_title.get(row['quiz_title'])
+            if quiz_id is None:
+                error = 'the quiz does not exist'
+            elif text_value in existing_texts:
+                error = 'question already exist'
+            elif text_value in seen_texts:
+                error = 'the question is duplicated in the file'
+        if error is not None:
+            errors.append((number, error))
+            continue
+        seen_texts.add(text_value)
+        questions.append({
+            'text': text_value,
+            'options': [option.strip() for option in row['options']],
+            'correct_option': parse_number(row['correct_option']),
+            'quiz_id': quiz_id,
+        })
+
+    # a dry run reports how many questions would be imported
+    if dry_run or not questions:
+        return ImportReport(len(questions), errors)
+
+    added = Counter(question['quiz_id'] for question in questions)
+    try:
+        for batch in chunks(questions, batch_size):
+            db.session.execute(insert(Question), batch)
+        # one update of total_questions per quiz
+        db.session.execute(
+            update(Quiz.__table__)
+            .where(Quiz.id == bindparam('qid'))
+            .values(total_questions=Quiz.total_questions + bindparam('added')),
+            [{'qid': quiz_id, 'added': count} for quiz_id, count in added.items()]
+        )
+        create_missing_question_stats(added)
+        db.session.commit()
+    except IntegrityError:
+        # the unique index on the text, the question was added after the check above
+        db.session.rollback()
+        raise ValueError('a question of the file was added meanwhile, nothing was imported: import it again')
+    except Exception:
+        db.session.rollback()
+        raise
+    invalidate_quizzes(*added)
+    return ImportReport(len(questions), errors)
+
+
+def create_missing_question_stats(quiz_ids):
+    ''' Create the empty stats rows of the new questions of the quizzes, with set based inserts. '''
+    # the questions have four options, like in QuestionForm
+    option_numbers = union_all(*(
+        select(literal_column(str(number)).label('number')) for number in range(1, NUMBER_OF_OPTIONS + 1)
+    )).subquery()
+    for chunk in chunks(quiz_ids):
+        db.session.execute(insert(QuestionStats).from_select(
+            ['question_id', 'answered', 'correct'],
+            select(Question.id, literal_column('0'), literal_column('0')).where(
+                Question.quiz_id.in_(chunk), Question.id.not_in(select(QuestionStats.question_id))
+            )
+        ))
+        db.session.execute(insert(QuestionOptionStats).from_select(
+            ['question_id', 'option_number', 'selected_count'],
+            select(Question.id, option_numbers.c.number, literal_column('0'))
+            .join(option_numbers, true())
+            .where(
+                Question.quiz_id.in_(chunk),
+                Question.id.not_in(select(QuestionOptionStats.question_id))
+            )
+        ))
@@ -0,0 +1,211 @@
+from collections import namedtuple
+from itertools import groupby
+from operator import itemgetter
+from flask import current_app
+from sqlalchemy import func, select
+
+from . import db
+from .cache import get_cache, get_categories
+from .models import Quiz, QuizResult, User
+
+
+# A line of a leaderboard, and the place of a user on a leaderboard of `size` users
+LeaderboardEntry = namedtuple('LeaderboardEntry', ['rank', 'user_id', 'username', 'score'])
+Rank = namedtuple('Rank', ['rank', 'score', 'size'])
+
+QUIZ = 'quiz'
+CATEGORY = 'category'
+
+# rows read at once by the rebuilds
+REBUILD_BATCH_SIZE = 10000
+
+
+def board_key(kind, board_id):
+    ''' The key of the sorted set of a leaderboard, kind is QUIZ or CATEGORY. '''
+    return f'{get_cache().prefix}leaderboard:{kind}:{board_id}'
+
+
+def built_key(kind, board_id):
+    ''' The key marking a leaderboard as built from the results, see ensure_boards. '''
+    return f'{board_key(kind, board_id)}:built'
+
+
+def is_built(backend, kind, board_id):
+    return backend.get(built_key(kind, board_id)) is not None
+
+
+def ensure_boards(boards):
+    ''' Build the leaderboards among boards, (kind, board_id) pairs, which are not in the cache backend yet:
+        a new or flushed backend, or a restarted worker with the local backend. They are rebuilt from the
+        results when they are first read. '''
+    backend = get_cache().backend
+    missing = [(kind, board_id) for kind, board_id in boards if not is_built(backend, kind, board_id)]
+    if missing:
+        rebuild_leaderboards([board_id for kind, board_id in missing if kind == QUIZ],
+                             [board_id for kind, board_id in missing if kind == CATEGORY])
+
+
+def record_score(user_id, quiz_id, category_id, score, previous_score=None):
+    ''' Put the score of a user on the leaderboards of a quiz and of its category, called once the result is
+        committed. previous_score is the score of the result it replaces, None for a first result.
+        A quiz ranks the users on their score, a category on the sum of their scores in its quizzes.
+        A leaderboard which is not built is left alone: it is built with the result when it is read. '''
+    try:
+        backend = get_cache().backend
+        if is_built(backend, QUIZ, quiz_id):
+            backend.zadd(board_key(QUIZ, quiz_id), str(user_id), score)
+        if category_id is not None and is_built(backend, CATEGORY, category_id):
+            backend.zincrby(board_key(CATEGORY, category_id), str(user_id), score - (previous_score or 0))
+    except Exception:
+        # the result is stored, the leaderboards can be rebuilt from the results
+        current_app.logger.exception('the leaderboards could not be updated, run `flask rebuild-leaderboards`')
+
+
+def remove_score(user_id, quiz_id, category_id, score):
+    ''' Take a deleted result off the leaderboards of its quiz and category. '''
+    try:
+        backend = get_cache().backend
+        if is_built(backend, QUIZ, quiz_id):
+            backend.zrem(board_key(QUIZ, quiz_id), str(user_id))
+        if category_id is not None and is_built(backend, CATEGORY, category_id):
+            backend.zincrby(board_key(CATEGORY, category_id), str(user_id), -score)
+    except Exception:
+        current_app.logger.exception('the leaderboards could not be updated, run `flask rebuild-leaderboards`')
+
+
+def quiz_scores(quiz_id):
+    ''' Get the (user_id, score) of the results of a quiz, for move_quiz_scores. '''
+    return db.session.execute(
+        select(QuizResult.user_id, QuizResult.score).where(QuizResult.quiz_id == quiz_id)
+    ).all()
+
+
+def move_quiz_scores(scores, old_category_id, new_category_id):
+    ''' Move the (user_id, score) results of a quiz from the leaderboard of its old category to the one of its
+        new category, None for no category (e.g. a deleted quiz). A zincrby per result of the quiz on the built
+        boards, instead of a rebuild of the two categories; the users left without any result in the old
+        category leave its board. Called once the quiz is committed. '''
+    try:
+        backend = get_cache().backend
+        if old_category_id is not None and is_built(backend, CATEGORY, old_category_id):
+            key = board_key(CATEGORY, old_category_id)
+            for user_id, score in scores:
+                if score:
+                    backend.zincrby(key, str(user_id), -score)
+            user_ids = [user_id for user_id, score in scores]
+            remaining = set(db.session.execute(
+                select(QuizResult.user_id).join(Quiz, Quiz.id == QuizResult.quiz_id)
+                .where(Quiz.category_id == old_category_id, QuizResult.user_id.in_(user_ids))
+            ).scalars())
+            backend.zrem(key, *[str(user_id) for user_id in user_ids if user_id not in remaining])
+        if new_category_id is not None and is_built(backend, CATEGORY, new_category_id):
+            key = board_key(CATEGORY, new_category_id)
+            for user_id, score in scores:
+                backend.zincrby(key, str(user_id), score)
+    except Exception:
+        current_app.logger.exception('the leaderboards could not be updated, run `flask rebuild-leaderboards`')
+
+
+def drop_leaderboards(quiz_ids=(), category_ids=()):
+    ''' Delete the leaderboards of deleted quizzes and categories. '''
+    boards = [(QUIZ, quiz_id) for quiz_id in quiz_ids] + [(CATEGORY, category_id) for category_id in category_ids]
+    keys = [key for kind, board_id in boards for key in (board_key(kind, board_id), built_key(kind, board_id))]
+    if keys:
+        get_cache().backend.delete(*keys)
+
+
+def top(kind, board_id, count):
+    ''' Get the `count` best users of a leaderboard as LeaderboardEntry, users with the same score share a rank. '''
+    ensure_boards([(kind, board_id)])
+    lines = get_cache().backend.ztop(board_key(kind, board_id), count)
+    user_ids = [int(member) for member, score in lines]
+    usernames = {}
+    if user_ids:
+        usernames = dict(db.session.execute(select(User.id, User.username).where(User.id.in_(user_ids))).all())
+    entries = []
+    for position, (user_id, (member, score)) in enumerate(zip(user_ids, lines), start=1):
+        rank = entries[-1].rank if entries and entries[-1].score == score else position
+        entries.append(LeaderboardEntry(rank, user_id, usernames.get(user_id, ''), score))
+    return entries
+
+
+def user_ranks(user_id, boards):
+    ''' Get the Rank of a user on each of the boards, (kind, board_id) pairs, None where the user is not ranked. '''
+    boards = list(boards)
+    ensure_boards(boards)
+    ranks = get_cache().backend.zranks([(board_key(kind, board_id), str(user_id)) for kind, board_id in boards])
+    return {board: Rank(*rank) if rank else None for board, rank in zip(boards, ranks)}
+
+
+def load_profile_ranks(user_id, quiz_results):
+    ''' Get the ranks shown on the profile of a user: a dict of quiz_id -> Rank for the quizzes of the
+        results (loaded with their quiz), and the (CategorySnapshot, Rank) of the categories of those quizzes. '''
+    categories = {category.id: category for category in get_categories()}
+    category_ids = sorted({result.quiz.category_id for result in quiz_results} & set(categories))
+    ranks = user_ranks(user_id, [(QUIZ, result.quiz_id) for result in quiz_results] +
+                       [(CATEGORY, category_id) for category_id in category_ids])
+    quiz_ranks = {quiz_id: rank for (kind, quiz_id), rank in ranks.items() if kind == QUIZ}
+    category_ranks = [(categories[category_id], ranks[CATEGORY, category_id]) for category_id in category_ids
+                      if ranks[CATEGORY, category_id]]
+    return quiz_ranks, category_ranks
+
+
+def replace_boards(kind, board_ids, rows):
+    ''' Replace the leaderboards of the given ids by the (board_id, user_id, score) rows, sorted by board_id. '''
+    backend = get_cache().backend
+    rebuilt = set()
+    for board_id, board_rows in groupby(rows, key=itemgetter(0)):
+        backend.zreplace(board_key(kind, board_id), {str(user_id): score for _, user_id, score in board_rows})
+        rebuilt.add(board_id)
+    # the boards without any result are emptied
+    for board_id in set(board_ids) - rebuilt:
+        backend.zreplace(board_key(kind, board_id), {})
+    return len(set(board_ids) | rebuilt)
+
+
+def rebuild_leaderboards(quiz_ids=None, category_ids=None):
+    ''' Rebuild leaderboards from the quiz results, to recover from a drift (e.g. a cache backend that was
+        flushed, or results changed outside the app). Without ids, every leaderboard is rebuilt.
+        The boards are marked as built before the results are read, so that the submissions committed
+        meanwhile update them too, but a score recorded between the read and the replacement of a board is lost.
+        Returns the number of quiz and category leaderboards rebuilt. '''
+    everything = quiz_ids is None and category_ids is None
+    if everything:
+        quiz_ids = db.session.execute(select(Quiz.id)).scalars().all()
+        category_ids = [category.id for category in get_categories()]
+    quiz_ids, category_ids = list(quiz_ids or ()), list(category_ids or ())
+    markers = [built_key(QUIZ, quiz_id) for quiz_id in quiz_ids]
+    markers += [built_key(CATEGORY, category_id) for category_id in category_ids]
+    backend = get_cache().backend
+    for marker in markers:
+        backend.set(marker, b'1')
+    try:
+        return rebuild_boards(quiz_ids, category_ids, everything)
+    except Exception:
+        # built again on their next read
+        backend.delete(*markers)
+        raise
+
+
+def rebuild_boards(quiz_ids, category_ids, everything):
+    ''' Replace the leaderboards of the quizzes and categories by the ones of the results, all of them
+        with everything. '''
+    quizzes = 0
+    if quiz_ids:
+        query = select(QuizResult.quiz_id, QuizResult.user_id, QuizResult.score).order_by(QuizResult.quiz_id)
+        if not everything:
+            query = query.where(QuizResult.quiz_id.in_(quiz_ids))
+        rows = db.session.execute(query.execution_options(yield_per=REBUILD_BATCH_SIZE))
+        quizzes = replace_boards(QUIZ, quiz_ids, rows)
+
+    categories = 0
+    if category_ids:
+        query = select(Quiz.category_id, QuizResult.user_id, func.sum(QuizResult.score)) \
+            .join(Quiz, Quiz.id == QuizResult.quiz_id) \
+            .group_by(Quiz.category_id, QuizResult.user_id) \
+            .order_by(Quiz.category_id)
+        if not everything:
+            query = query.where(Quiz.category_id.in_(category_ids))
+        rows = db.session.execute(query.execution_options(yield_per=REBUILD_BATCH_SIZE))
+        categories = replace_boards(CATEGORY, category_ids, rows)
+    return quizzes, categories
@@ -0,0 +1,131 @@
+import bisect
+import hmac
+from threading import Lock
+from flask import Blueprint, current_app, request, abort
+
+
+class Metric:
+    ''' A metric with labels, rendered in the Prometheus text format. '''
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = Lock()
+
+    def _labels(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def samples(self):
+        ''' Yield the (suffix, labels, value) of each sample. '''
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in values.items():
+            yield '', dict(zip(self.labelnames, labels)), value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        for suffix, labels, value in self.samples():
+            text = ','.join(f'{name}="{escape(value)}"' for name, value in labels.items())
+            lines.append(f'{self.name}{suffix}{{{text}}} {value}' if text else f'{self.name}{suffix} {value}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    ''' A gauge, either set directly or computed when the metrics are collected
+        by collect(), which returns (labels, value) pairs. '''
+    type = 'gauge'
+
+    def __init__(self, name, help, labelnames=(), collect=None):
+        super().__init__(name, help, labelnames)
+        self.collect = collect
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._labels(labels)] = value
+
+    def samples(self):
+        if self.collect is None:
+            yield from super().samples()
+            return
+        for labels, value in self.collect():
+            yield '', labels, value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+    DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._labels(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in values.items():
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                yield '_bucket', {**labels, 'le': str(bound)}, cumulative
+            yield '_sum', labels, total
+            yield '_count', labels, cumulative
+
+
+class Registry:
+    ''' The metrics of the process. With several workers, each worker reports its own values. '''
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=(), collect=None):
+        return self.register(Gauge(name, help, labelnames, collect))
+
+    def histogram(self, name, help, labelnames=(), buckets=Histogram.DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self.metrics.values()) + '\n'
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
+
+metrics = Blueprint('metrics', __name__)
+
+
+# the metrics of the worker in the Prometheus text format
+@metrics.route('/metrics')
+def export_metrics():
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        abort(401)
+    return current_app.response_class(registry.render(), mimetype='text/plain; version=0.0.4')
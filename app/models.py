@@ -1,5 +1,8 @@
+from datetime import datetime, timezone
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm.base import NO_VALUE, NEVER_SET
 from . import db
 
 
@@ -12,10 +15,20 @@ class User(db.Model, UserMixin):
     password = db.Column(db.String(220), nullable=False)
     quiz_results = db.relationship('QuizResult', backref='user', lazy=True)
     is_admin = db.Column(db.Boolean, default=False)
+    # part of the API tokens of the user, they are revoked when it changes (see api.issue_token)
+    token_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     def __repr__(self):
         return f'<User {self.username}>'
 
+
+@event.listens_for(User.password, 'set', active_history=True)
+def revoke_tokens(user, value, old_value, initiator):
+    ''' A new password revokes the API tokens of the user. The rehashes of passwords.py keep the same password,
+        they are not made through the model. '''
+    if old_value not in (NO_VALUE, NEVER_SET) and value != old_value:
+        user.token_version = (user.token_version or 0) + 1
+
 # Category model
 class Category(db.Model):
     ''' Represents categories for quizzes (e.g., Science, History) '''
@@ -31,31 +44,37 @@ class Category(db.Model):
 class Quiz(db.Model):
     ''' Represents the quizzes. Each quiz has multiple questions and is associated with a category.'''
     id = db.Column(db.Integer, primary_key=True)
-    title = db.Column(db.String(200), nullable=False)
+    title = db.Column(db.String(200), nullable=False, index=True, unique=True)
     description = db.Column(db.String(500), nullable=False)
     total_questions = db.Column(db.Integer, nullable=False, default=0)
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False)
+    # set when its answer key changed, until `flask rescore --pending` rescores its answers
+    rescore_requested_at = db.Column(db.DateTime, index=True)
     questions = db.relationship('Question', backref='quiz', lazy=True, cascade='all, delete-orphan')
 
     quiz_results = db.relationship('QuizResult', backref='quiz', lazy=True, cascade='all, delete-orphan')
+    attempts = db.relationship('QuizAttempt', backref='quiz', lazy=True, cascade='all, delete-orphan')
+    stats = db.relationship('QuizStats', backref='quiz', uselist=False, lazy=True, cascade='all, delete-orphan')
 
     def is_completed_by(self, user):
         ''' Check if the quiz has been completed by the user. '''
-        return QuizResult.query.filter_by(user_id=user.id, quiz_id=self.id).first() is not None and self.total_questions == self.get_user_score(user)
+        from .status import get_quiz_status, COMPLETED
+        return get_quiz_status(self, user).status == COMPLETED
 
     def get_user_score(self, user):
         ''' Get the score of the user for this quiz. '''
-        quiz_result = QuizResult.query.filter_by(user_id=user.id, quiz_id=self.id).first()
-        return quiz_result.score if quiz_result else 0
+        from .status import get_quiz_status
+        return get_quiz_status(self, user).score
     
     def is_started_by(self, user):
-        ''' Check if the quiz has been taken by the user. '''
-        return QuizResult.query.filter_by(user_id=user.id, quiz_id=self.id).first() is not None and self.total_questions != self.get_user_score(user)
+        ''' Check if the user has an open attempt at the quiz. '''
+        from .status import get_quiz_status, IN_PROGRESS
+        return get_quiz_status(self, user).status == IN_PROGRESS
 
     def get_result_id(self, user):
         ''' Get the result id of the user for this quiz. '''
-        quiz_result = QuizResult.query.filter_by(user_id=user.id, quiz_id=self.id).first()
-        return quiz_result.id if quiz_result else 0
+        from .status import get_quiz_status
+        return get_quiz_status(self, user).result_id
 
     def __repr__(self):
         return f'<Quiz {self.title}>'
@@ -65,13 +84,15 @@ class Quiz(db.Model):
 class Question(db.Model):
     ''' Represents the questions for a quiz. Each question has multiple options and one correct option.'''
     id = db.Column(db.Integer, primary_key=True)
-    text = db.Column(db.String(500), nullable=False)
+    text = db.Column(db.String(500), nullable=False, index=True, unique=True)
     options = db.Column(db.JSON, nullable=False)  # Store options as JSON
     correct_option = db.Column(db.Integer, nullable=False)  # Store index of correct option
-    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=False)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=False, index=True)
 
     # delete responses when a question is deleted
     responses = db.relationship('Response', backref='question', lazy=True, cascade='all, delete-orphan')
+    stats = db.relationship('QuestionStats', backref='question', uselist=False, lazy=True, cascade='all, delete-orphan')
+    option_stats = db.relationship('QuestionOptionStats', backref='question', lazy=True, cascade='all, delete-orphan')
     def __repr__(self):
         return f'<Question {self.text}>'
 
@@ -84,9 +105,12 @@ class Response(db.Model):
     question_id = db.Column(db.Integer, db.ForeignKey('question.id'), nullable=False)
     selected_option = db.Column(db.Integer, nullable=False)
     is_correct = db.Column(db.Boolean, nullable=False)
-    quiz_result_id = db.Column(db.Integer, db.ForeignKey('quiz_result.id'), nullable=False)
+    quiz_result_id = db.Column(db.Integer, db.ForeignKey('quiz_result.id'), nullable=False, index=True)
+    # the submission the response was part of, the responses of the older attempts are kept
+    attempt_id = db.Column(db.Integer, db.ForeignKey('quiz_attempt.id'), index=True)
 
     user = db.relationship('User', backref='responses')
+    __table_args__ = (db.Index('ix_response_quiz_id_user_id', 'quiz_id', 'user_id'),)
     quiz = db.relationship('Quiz', backref='responses')
 
 
@@ -95,12 +119,98 @@ class Response(db.Model):
 
 # QuizResult model
 class QuizResult(db.Model):
-    ''' Represents the results of a user taking a quiz. Includes the score and links to the user and quiz. '''
+    ''' Represents the results of a user taking a quiz. Includes the score and links to the user and quiz.
+        Each submission is a new attempt: the result points to the latest one, whose score and responses
+        are the current ones, and to the best one. '''
     id = db.Column(db.Integer, primary_key=True)
     score = db.Column(db.Integer, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=False)
+    # quiz_attempt also references quiz_result, the constraints are added once both tables exist
+    latest_attempt_id = db.Column(db.Integer, db.ForeignKey(
+        'quiz_attempt.id', name='fk_quiz_result_latest_attempt_id', use_alter=True, ondelete='SET NULL'
+    ))
+    best_attempt_id = db.Column(db.Integer, db.ForeignKey(
+        'quiz_attempt.id', name='fk_quiz_result_best_attempt_id', use_alter=True, ondelete='SET NULL'
+    ))
     responses = db.relationship('Response', backref='quiz_result', lazy=True, cascade='all, delete-orphan')
+    # the attempts which made the result are kept when it is deleted
+    attempts = db.relationship('QuizAttempt', backref='quiz_result', lazy=True,
+                               foreign_keys='QuizAttempt.quiz_result_id')
+    # a user has one result per quiz, it also indexes the lookups by user and by (user, quiz)
+    __table_args__ = (db.UniqueConstraint('user_id', 'quiz_id', name='uq_quiz_result_user_id_quiz_id'),)
+
+    def __repr__(self):
+        return f'<QuizResult User:{self.user_id} Quiz:{self.quiz_id} Score:{self.score}>'
+
+
+# QuizAttempt model
+class QuizAttempt(db.Model):
+    ''' An attempt of a user at a quiz, its answers are saved as they are given (see attempts.py).
+        It is open until it is finished: only the saved answers are scored, into the QuizResult of the user.
+        A quiz submitted at once is a finished attempt too. Its responses are Response rows, or the packed
+        answers of the attempt (see packing.py) with RESPONSE_STORAGE = 'packed' and once it is archived. '''
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=False)
+    # question id -> selected option of the answers saved so far, JSON keys are strings
+    answers = db.Column(db.JSON, nullable=False, default=dict)
+    started_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    finished_at = db.Column(db.DateTime)
+    score = db.Column(db.Integer)
+    quiz_result_id = db.Column(db.Integer, db.ForeignKey('quiz_result.id'))
+    archived_at = db.Column(db.DateTime)
+    # the responses of the attempt when they are not stored as rows
+    packed_answers = db.Column(db.LargeBinary)
+    correct_bitmap = db.Column(db.LargeBinary)
+    responses = db.relationship('Response', backref='attempt', lazy=True)
+    # the open attempts of a user and the attempts of a user at a quiz
+    __table_args__ = (db.Index('ix_quiz_attempt_user_id_quiz_id', 'user_id', 'quiz_id'),)
+
+    @property
+    def is_open(self):
+        return self.finished_at is None
+
+    def __repr__(self):
+        return f'<QuizAttempt User:{self.user_id} Quiz:{self.quiz_id} Answers:{len(self.answers)}>'
+
+
+# QuizStats model
+class QuizStats(db.Model):
+    ''' Counters of the results of a quiz, updated incrementally by each submission (see stats.py).
+        attempts is the number of users who have a result, submissions also counts the resubmissions. '''
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), primary_key=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    submissions = db.Column(db.Integer, nullable=False, default=0)
+    total_score = db.Column(db.Integer, nullable=False, default=0)
+
+    @property
+    def average_score(self):
+        return self.total_score / self.attempts if self.attempts else 0
+
+    def __repr__(self):
+        return f'<QuizStats Quiz:{self.quiz_id} Attempts:{self.attempts}>'
+
+# QuestionStats model
+class QuestionStats(db.Model):
+    ''' Counters of the current responses to a question, updated incrementally by each submission. '''
+    question_id = db.Column(db.Integer, db.ForeignKey('question.id'), primary_key=True)
+    answered = db.Column(db.Integer, nullable=False, default=0)
+    correct = db.Column(db.Integer, nullable=False, default=0)
+
+    @property
+    def correct_rate(self):
+        return self.correct / self.answered if self.answered else 0
+
+    def __repr__(self):
+        return f'<QuestionStats Question:{self.question_id} Answered:{self.answered}>'
+
+# QuestionOptionStats model
+class QuestionOptionStats(db.Model):
+    ''' How many current responses selected each option of a question (options are numbered from 1). '''
+    question_id = db.Column(db.Integer, db.ForeignKey('question.id'), primary_key=True)
+    option_number = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    selected_count = db.Column(db.Integer, nullable=False, default=0)
 
     def __repr__(self):
-        return f'<QuizResult User:{self.user_id} Quiz:{self.quiz_id} Score:{self.score}>'
\ No newline at end of file
+        return f'<QuestionOptionStats Question:{self.question_id} Option:{self.option_number} Count:{self.selected_count}>'
@@ -0,0 +1,42 @@
+import struct
+from operator import itemgetter
+
+
+# bytes taken by an answer in packed_answers: a uint32 question id and a uint8 selected option
+ANSWER_SIZE = 5
+# the highest selected option that fits in its byte, the submissions refuse the others (see submission.check_options)
+MAX_OPTION = 255
+
+
+def fits(rows):
+    ''' Tell if the selected options of the responses fit in packed_answers. '''
+    return all(1 <= row['selected_option'] <= MAX_OPTION for row in rows)
+
+
+def pack_answers(rows):
+    ''' Pack the responses of an attempt, dicts with question_id, selected_option and is_correct, into its
+        (packed_answers, correct_bitmap). The answers are sorted by question id: packed_answers holds the
+        little-endian uint32 question ids followed by one byte per selected option, and bit i of the bitmap
+        (least significant bit first) tells if answer i is correct. 50 answers take 257 bytes.
+        Raises ValueError if a selected option is not between 1 and MAX_OPTION. '''
+    if not fits(rows):
+        raise ValueError(f'the selected options must be between 1 and {MAX_OPTION} to be packed')
+    rows = sorted(rows, key=itemgetter('question_id'))
+    count = len(rows)
+    packed = struct.pack(
+        f'<{count}I{count}B', *(row['question_id'] for row in rows), *(row['selected_option'] for row in rows)
+    )
+    bits = sum(1 << index for index, row in enumerate(rows) if row['is_correct'])
+    return packed, bits.to_bytes((count + 7) // 8, 'little')
+
+
+def unpack_answers(packed, bitmap):
+    ''' Decode the packed answers of an attempt into dicts with question_id, selected_option and is_correct,
+        like the response rows (see submission.load_response_rows), sorted by question id. '''
+    count = len(packed) // ANSWER_SIZE
+    values = struct.unpack(f'<{count}I{count}B', packed)
+    bits = int.from_bytes(bitmap, 'little')
+    return [
+        {'question_id': values[index], 'selected_option': values[count + index], 'is_correct': bool(bits >> index & 1)}
+        for index in range(count)
+    ]
@@ -0,0 +1,78 @@
+from sqlalchemy import tuple_
+
+
+class KeysetPage:
+    ''' A page of a keyset (cursor based) pagination.
+        The cursors are the sort key of the last/first item of the page, encoded as "1.42". '''
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+def encode_cursor(values):
+    return '.'.join(str(value) for value in values)
+
+
+# the cursors come from the query string, their values must fit in the BIGINT of the databases
+MAX_CURSOR_VALUE = 2 ** 63 - 1
+
+
+def decode_cursor(cursor, size):
+    ''' Decode a cursor made of `size` integers, None if it is missing or invalid. '''
+    if not cursor:
+        return None
+    try:
+        values = tuple(int(value) for value in cursor.split('.'))
+    except ValueError:
+        return None
+    if len(values) != size or any(abs(value) > MAX_CURSOR_VALUE for value in values):
+        return None
+    return values
+
+
+def keyset_paginate(query, columns, per_page, after=None, before=None):
+    ''' Paginate a query on a unique, stable sort key made of integer columns (e.g. [Quiz.id]).
+        `after` and `before` are cursors from a previous page, the first page is returned without them.
+        Unlike OFFSET, every page costs the same no matter how deep it is. '''
+    def key(item):
+        return tuple(getattr(item, column.key) for column in columns)
+
+    def compare(values, op):
+        if len(columns) == 1:
+            return op(columns[0], values[0])
+        return op(tuple_(*columns), tuple_(*values))
+
+    before_key = decode_cursor(before, len(columns))
+    after_key = decode_cursor(after, len(columns))
+
+    if before_key is not None:
+        # walk backwards from the cursor, then put the page back in order
+        items = query.filter(compare(before_key, lambda a, b: a < b)) \
+            .order_by(*(column.desc() for column in columns)).limit(per_page + 1).all()
+        has_prev = len(items) > per_page
+        items = list(reversed(items[:per_page]))
+        has_next = True
+    else:
+        if after_key is not None:
+            query = query.filter(compare(after_key, lambda a, b: a > b))
+        items = query.order_by(*columns).limit(per_page + 1).all()
+        has_next = len(items) > per_page
+        items = items[:per_page]
+        has_prev = after_key is not None
+
+    next_cursor = encode_cursor(key(items[-1])) if has_next and items else None
+    prev_cursor = encode_cursor(key(items[0])) if has_prev and items else None
+    return KeysetPage(items, next_cursor, prev_cursor)
@@ -0,0 +1,120 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from threading import BoundedSemaphore, Lock
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from .metrics import registry
+
+
+REFUSED_HASHES = registry.counter(
+    'password_hashes_refused_total', 'Password hashes refused because the pool of hashing processes was full.'
+)
+
+
+class HashingBusy(Exception):
+    ''' Raised when PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE hashes are already running or waiting. '''
+
+
+# the pool of the current process, the workers of a server each get their own
+_pool = None
+_pool_pid = None
+_slots = None
+_lock = Lock()
+
+
+def get_pool():
+    ''' Get the pool of hashing processes and the semaphore bounding the hashes it accepts. '''
+    global _pool, _pool_pid, _slots
+    config = current_app.config
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(max_workers=config['PASSWORD_HASH_WORKERS'])
+            _slots = BoundedSemaphore(config['PASSWORD_HASH_WORKERS'] + config['PASSWORD_HASH_QUEUE'])
+            _pool_pid = os.getpid()
+        return _pool, _slots
+
+
+def run_hash(function, *args):
+    ''' Run a hash function of werkzeug in the pool of hashing processes and wait for its result,
+        so that a burst of logins uses at most PASSWORD_HASH_WORKERS cores of the host.
+        Raises HashingBusy when the pool and its queue are full. Without workers, it runs here. '''
+    if not current_app.config['PASSWORD_HASH_WORKERS']:
+        return function(*args)
+    pool, slots = get_pool()
+    if not slots.acquire(blocking=False):
+        REFUSED_HASHES.inc()
+        raise HashingBusy()
+    try:
+        return pool.submit(function, *args).result()
+    finally:
+        slots.release()
+
+
+def hash_password(password):
+    ''' Hash a password with the PASSWORD_HASH_METHOD. '''
+    return run_hash(generate_password_hash, password, current_app.config['PASSWORD_HASH_METHOD'])
+
+
+def check_password(password_hash, password):
+    return run_hash(check_password_hash, password_hash, password)
+
+
+@lru_cache
+def dummy_hash(method):
+    ''' A hash of the method that no password of a user matches. '''
+    return generate_password_hash(os.urandom(16).hex(), method)
+
+
+def check_user_password(user, password):
+    ''' Check the password of a login, `user` being None when no account has its email. The unknown emails
+        are checked against a dummy hash, so the time of the answer doesn't tell which emails have an account. '''
+    if user is None:
+        check_password(dummy_hash(current_app.config['PASSWORD_HASH_METHOD']), password)
+        return False
+    return check_password(user.password, password)
+
+
+@lru_cache
+def method_parameters(method):
+    ''' The method and parameters that werkzeug writes in a hash, e.g. 'scrypt' gives 'scrypt:32768:8:1'. '''
+    return generate_password_hash('', method).split('$', 1)[0]
+
+
+def needs_rehash(password_hash):
+    ''' Tell if a hash was made with other parameters than the PASSWORD_HASH_METHOD. '''
+    return password_hash.split('$', 1)[0] != method_parameters(current_app.config['PASSWORD_HASH_METHOD'])
+
+
+def rehash_in_background(user_id, password_hash, password):
+    ''' Hash the password of a user who just logged in with the PASSWORD_HASH_METHOD, and store it
+        when the hash is ready. Skipped when the pool is busy, the next login will do it. '''
+    app = current_app._get_current_object()
+    method = app.config['PASSWORD_HASH_METHOD']
+    if not app.config['PASSWORD_HASH_WORKERS']:
+        store_rehash(app, user_id, password_hash, generate_password_hash(password, method))
+        return
+    pool, slots = get_pool()
+    if not slots.acquire(blocking=False):
+        return
+
+    def done(future):
+        slots.release()
+        try:
+            store_rehash(app, user_id, password_hash, future.result())
+        except Exception:
+            app.logger.exception('the password of user %s could not be rehashed', user_id)
+
+    pool.submit(generate_password_hash, password, method).add_done_callback(done)
+
+
+def store_rehash(app, user_id, password_hash, new_hash):
+    from . import db
+    from .models import User
+    with app.app_context():
+        # unless the password was changed in the meantime
+        db.session.query(User).filter_by(id=user_id, password=password_hash).update(
+            {'password': new_hash}, synchronize_session=False
+        )
+        db.session.commit()
@@ -0,0 +1,127 @@
+import random
+import time
+from collections import Counter
+from flask import g, request, current_app, has_app_context
+from flask import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .metrics import registry
+
+
+REQUEST_SECONDS = registry.histogram(
+    'http_request_duration_seconds', 'Wall time of the requests.', ['endpoint', 'method']
+)
+SQL_STATEMENTS = registry.histogram(
+    'http_request_sql_statements', 'SQL statements run by a request.', ['endpoint'],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100)
+)
+SQL_SECONDS = registry.histogram('http_request_sql_seconds', 'Time spent in SQL by a request.', ['endpoint'])
+TEMPLATE_SECONDS = registry.histogram(
+    'http_request_template_seconds', 'Time spent rendering the templates of a request.', ['endpoint']
+)
+DUPLICATE_QUERY_REQUESTS = registry.counter(
+    'http_requests_with_duplicate_queries_total',
+    'Requests which ran the same SQL statement PROFILING_DUPLICATE_THRESHOLD times or more (N+1 queries).',
+    ['endpoint']
+)
+
+# endpoints which are not profiled
+IGNORED_ENDPOINTS = {'static', 'metrics.export_metrics'}
+
+
+class RequestProfile:
+    ''' What a request spent its time on. '''
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.template_start = None
+        # SQL statement -> number of times it was run, the parameters are left out
+        self.statements = Counter()
+
+    def duplicates(self, threshold):
+        return {statement: count for statement, count in self.statements.most_common() if count >= threshold}
+
+
+def current_profile():
+    return g.get('profile') if has_app_context() else None
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info['query_start'].pop()
+    profile = current_profile()
+    if profile is not None:
+        profile.sql_count += 1
+        profile.sql_time += time.perf_counter() - start
+        profile.statements[statement] += 1
+
+
+def handle_error(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('query_start'):
+        connection.info['query_start'].pop()
+
+
+def start_template(sender, template, context, **extra):
+    profile = current_profile()
+    if profile is not None:
+        profile.template_start = time.perf_counter()
+
+
+def end_template(sender, template, context, **extra):
+    profile = current_profile()
+    if profile is not None and profile.template_start is not None:
+        profile.template_time += time.perf_counter() - profile.template_start
+        profile.template_start = None
+
+
+def start_request():
+    if request.endpoint not in IGNORED_ENDPOINTS:
+        g.profile = RequestProfile()
+
+
+def finish_request(response):
+    ''' Record the profile of the request in the metrics, and log it if the request is slow (sampled). '''
+    profile = g.pop('profile', None)
+    if profile is None:
+        return response
+    config = current_app.config
+    wall_time = time.perf_counter() - profile.start
+    endpoint = request.endpoint or 'unknown'
+    REQUEST_SECONDS.observe(wall_time, endpoint=endpoint, method=request.method)
+    SQL_STATEMENTS.observe(profile.sql_count, endpoint=endpoint)
+    SQL_SECONDS.observe(profile.sql_time, endpoint=endpoint)
+    TEMPLATE_SECONDS.observe(profile.template_time, endpoint=endpoint)
+    duplicates = profile.duplicates(config['PROFILING_DUPLICATE_THRESHOLD'])
+    if duplicates:
+        DUPLICATE_QUERY_REQUESTS.inc(endpoint=endpoint)
+
+    if wall_time >= config['PROFILING_SLOW_REQUEST'] and random.random() < config['PROFILING_SLOW_SAMPLE_RATE']:
+        current_app.logger.warning(
+            'slow request %s %s (%s, %s): %.3fs, %d SQL statements in %.3fs, templates in %.3fs%s',
+            request.method, request.full_path.rstrip('?'), endpoint, response.status_code, wall_time,
+            profile.sql_count, profile.sql_time, profile.template_time,
+            ''.join(f'\n  repeated {count} times: {statement[:200]}' for statement, count in duplicates.items())
+        )
+    return response
+
+
+def init_profiling(app):
+    ''' Profile every request of the app (PROFILING_ENABLED): wall time, SQL statements and their time,
+        template rendering time and repeated statements, see the http_request_* metrics. '''
+    # the engine events are shared by all the engines of the process, they only record inside a profiled request
+    if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+        event.listen(Engine, 'handle_error', handle_error)
+    before_render_template.connect(start_template, app)
+    template_rendered.connect(end_template, app)
+    app.before_request(start_request)
+    app.after_request(finish_request)
@@ -0,0 +1,68 @@
+import random
+import time
+from contextlib import contextmanager
+from flask import g, session, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+
+REPLICA_BIND_PREFIX = 'replica_'
+
+
+class RoutingSession(Session):
+    ''' Session sending the queries of read-only requests (see utils.read_only) to a read replica.
+        Writes, and every query after the first write of the session, go to the primary,
+        and so do the requests of a user for REPLICA_LAG_WINDOW seconds after they wrote (read-after-write).
+        Without replica binds (SQLALCHEMY_REPLICA_URIS), everything goes to the primary. '''
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is not None or engine is not self._db.engines.get(None) or not self.use_replica():
+            return engine
+        if 'replica' not in self.info:
+            replicas = [engine for key, engine in self._db.engines.items()
+                        if key and key.startswith(REPLICA_BIND_PREFIX)]
+            # one replica per session, so that a request sees a single state of the database
+            self.info['replica'] = random.choice(replicas) if replicas else None
+        return self.info['replica'] or engine
+
+    def use_replica(self):
+        return (not self.info.get('wrote') and has_request_context()
+                and g.get('read_only', False) and not g.get('use_primary', False))
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def detect_write(orm_execute_state):
+    if not orm_execute_state.is_select:
+        orm_execute_state.session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'before_flush')
+def detect_flush(db_session, flush_context, instances):
+    db_session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def remember_write(db_session):
+    # the next requests of the user read from the primary until the replicas caught up
+    if db_session.info.get('wrote') and has_request_context():
+        session['_last_write'] = time.time()
+
+
+def recently_wrote(window):
+    ''' Tell if the current user wrote less than `window` seconds ago. '''
+    return time.time() - session.get('_last_write', 0) < window
+
+
+@contextmanager
+def use_primary():
+    ''' Read from the primary inside the block, e.g. to load what is cached for every request. '''
+    if not has_request_context():
+        yield
+        return
+    previous = g.get('use_primary', False)
+    g.use_primary = True
+    try:
+        yield
+    finally:
+        g.use_primary = previous
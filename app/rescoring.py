@@ -0,0 +1,296 @@
+from collections import Counter, defaultdict, namedtuple
+from datetime import datetime, timezone
+from itertools import chain
+import numpy as np
+from sqlalchemy import select, update, bindparam
+
+from . import db
+from .models import Quiz, Question, QuizAttempt, QuizResult, QuizStats, QuestionStats, Response
+from .leaderboards import record_score
+from .packing import ANSWER_SIZE
+
+
+# What a rescore changed: responses (rows and packed answers), attempt scores and result scores
+Rescore = namedtuple('Rescore', ['responses', 'attempts', 'results'])
+
+# response ids in the IN list of an update, below the 999 variables of the older SQLite builds
+IDS_PER_UPDATE = 900
+
+
+def load_answer_key(quiz_id, session):
+    ''' Get the question ids of a quiz, sorted, and their correct options as two arrays. '''
+    rows = session.execute(
+        select(Question.id, Question.correct_option).where(Question.quiz_id == quiz_id).order_by(Question.id)
+    ).all()
+    key = np.array(rows, dtype=np.int64).reshape(-1, 2)
+    return key[:, 0], key[:, 1]
+
+
+def check_answers(answer_key, question_ids, selected_options, is_correct):
+    ''' Recompute the correctness of answers against the answer key, for all of them at once.
+        The answers to questions which are not in the key (moved or deleted since) keep their correctness. '''
+    key_ids, key_options = answer_key
+    if not len(key_ids):
+        return is_correct.copy()
+    positions = np.minimum(np.searchsorted(key_ids, question_ids), len(key_ids) - 1)
+    known = key_ids[positions] == question_ids
+    return np.where(known, selected_options == key_options[positions], is_correct)
+
+
+def add_scores(scores, attempt_ids, correct):
+    ''' Add the correct answers of each attempt to its score in `scores`. '''
+    attempts, inverse = np.unique(attempt_ids, return_inverse=True)
+    for attempt_id, score in zip(attempts.tolist(), np.bincount(inverse, weights=correct).tolist()):
+        scores[attempt_id] += int(score)
+
+
+def add_correct_deltas(correct_deltas, latest_attempt_ids, attempt_ids, question_ids, was_correct, is_correct):
+    ''' Count the changes of the correct counters of the questions: only the answers of the latest attempts
+        count in the stats (see stats.record_result_delta). '''
+    changed = (was_correct != is_correct) & np.isin(attempt_ids, latest_attempt_ids)
+    if changed.any():
+        questions, inverse = np.unique(question_ids[changed], return_inverse=True)
+        deltas = np.bincount(inverse, weights=np.where(is_correct[changed], 1, -1))
+        for question_id, delta in zip(questions.tolist(), deltas.tolist()):
+            correct_deltas[question_id] += int(delta)
+
+
+def check_rows(session, quiz_id, answer_key, latest_attempt_ids, scores, correct_deltas, batch_size):
+    ''' Check the response rows of a quiz, read batch_size rows at a time with a server-side cursor.
+        Returns the ids of the rows which became correct and of the rows which became wrong. '''
+    became_correct = [np.zeros(0, np.int64)]
+    became_wrong = [np.zeros(0, np.int64)]
+    # read from the connection of the session: plain rows, without the ORM result layer
+    result = session.connection().execute(
+        select(Response.id, Response.attempt_id, Response.question_id, Response.selected_option, Response.is_correct)
+        .where(Response.quiz_id == quiz_id, Response.attempt_id.is_not(None))
+        .execution_options(yield_per=batch_size)
+    )
+    for batch in result.partitions():
+        values = np.fromiter(chain.from_iterable(batch), dtype=np.int64, count=5 * len(batch))
+        ids, attempt_ids, question_ids, selected_options, was_correct = values.reshape(-1, 5).T
+        was_correct = was_correct.astype(bool)
+        is_correct = check_answers(answer_key, question_ids, selected_options, was_correct)
+        add_scores(scores, attempt_ids, is_correct)
+        add_correct_deltas(correct_deltas, latest_attempt_ids, attempt_ids, question_ids, was_correct, is_correct)
+        changed = was_correct != is_correct
+        became_correct.append(ids[changed & is_correct])
+        became_wrong.append(ids[changed & ~is_correct])
+    return np.concatenate(became_correct), np.concatenate(became_wrong)
+
+
+def existing_questions(session, question_ids):
+    ''' Keep the question ids which still exist, as an array. '''
+    ids = np.unique(question_ids).tolist()
+    existing = []
+    for start in range(0, len(ids), IDS_PER_UPDATE):
+        existing += session.execute(
+            select(Question.id).where(Question.id.in_(ids[start:start + IDS_PER_UPDATE]))
+        ).scalars().all()
+    return np.array(existing, dtype=np.int64)
+
+
+def check_packed(session, quiz_id, answer_key, latest_attempt_ids, scores, correct_deltas, batch_size):
+    ''' Check the packed answers of the attempts of a quiz (see packing.py), read batch_size attempts at a time.
+        The answers of a batch are decoded into one set of arrays and checked at once. The answers to the
+        questions deleted since are dropped, like the response rows deleted with their question.
+        Returns the number of answers changed and the new packed_answers and correct_bitmap of the attempts
+        which changed. '''
+    changed_answers = 0
+    repacked = []
+    result = session.connection().execute(
+        select(QuizAttempt.id, QuizAttempt.packed_answers, QuizAttempt.correct_bitmap)
+        .where(QuizAttempt.quiz_id == quiz_id, QuizAttempt.packed_answers.is_not(None))
+        .execution_options(yield_per=batch_size)
+    )
+    for batch in result.partitions():
+        counts = [len(packed_answers) // ANSWER_SIZE for _, packed_answers, _ in batch]
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1])).tolist()
+        attempt_ids = np.repeat(np.array([attempt_id for attempt_id, _, _ in batch], dtype=np.int64), counts)
+        question_ids = np.concatenate([np.zeros(0, np.int64)] + [
+            np.frombuffer(packed_answers, '<u4', count).astype(np.int64)
+            for (_, packed_answers, _), count in zip(batch, counts)
+        ])
+        selected_options = np.concatenate([np.zeros(0, np.int64)] + [
+            np.frombuffer(packed_answers, np.uint8, count, offset=4 * count).astype(np.int64)
+            for (_, packed_answers, _), count in zip(batch, counts)
+        ])
+        was_correct = np.concatenate([np.zeros(0, bool)] + [
+            np.unpackbits(np.frombuffer(correct_bitmap, np.uint8), count=count, bitorder='little').astype(bool)
+            for (_, _, correct_bitmap), count in zip(batch, counts)
+        ])
+        is_correct = check_answers(answer_key, question_ids, selected_options, was_correct)
+        kept = np.isin(question_ids, existing_questions(session, question_ids))
+        add_scores(scores, attempt_ids[kept], is_correct[kept])
+        add_correct_deltas(correct_deltas, latest_attempt_ids, attempt_ids[kept], question_ids[kept],
+                           was_correct[kept], is_correct[kept])
+
+        changed = (was_correct != is_correct) & kept
+        changed_answers += int(changed.sum())
+        for (attempt_id, _, _), start, count in zip(batch, starts, counts):
+            answers = slice(start, start + count)
+            if changed[answers].any() or not kept[answers].all():
+                attempt_kept = kept[answers]
+                packed_answers = question_ids[answers][attempt_kept].astype('<u4').tobytes() + \
+                    selected_options[answers][attempt_kept].astype(np.uint8).tobytes()
+                bitmap = np.packbits(is_correct[answers][attempt_kept], bitorder='little').tobytes()
+                repacked.append({'attempt_id': attempt_id, 'packed': packed_answers, 'bitmap': bitmap})
+    return changed_answers, repacked
+
+
+def rescore_attempts(session, quiz_id, scores):
+    ''' In the current transaction, store the new scores of the attempts of a quiz, then move the results to the score of their latest
+        attempt and to their best attempt, and the total score of the quiz stats.
+        Returns the number of attempts whose score changed and the (user id, previous score, new score) of the
+        results whose score changed. '''
+    attempts = session.execute(
+        select(QuizAttempt.id, QuizAttempt.score, QuizAttempt.quiz_result_id)
+        .where(QuizAttempt.quiz_id == quiz_id, QuizAttempt.finished_at.is_not(None))
+    ).all()
+    # the attempts without any response keep their score
+    changed = {attempt_id: scores[attempt_id] for attempt_id, score, _ in attempts
+               if attempt_id in scores and scores[attempt_id] != score}
+    if not changed:
+        return 0, []
+    attempts_of_result = defaultdict(list)
+    for attempt_id, score, result_id in attempts:
+        if result_id is not None:
+            attempts_of_result[result_id].append((attempt_id, changed.get(attempt_id, score)))
+    result_ids = {result_id for attempt_id, _, result_id in attempts if attempt_id in changed and result_id}
+
+    results = []
+    changed_results = []
+    total_delta = 0
+    for result_id, user_id, score, latest_attempt_id in session.execute(
+        select(QuizResult.id, QuizResult.user_id, QuizResult.score, QuizResult.latest_attempt_id)
+        .where(QuizResult.quiz_id == quiz_id)
+    ):
+        if result_id not in result_ids:
+            continue
+        latest_score = changed.get(latest_attempt_id, score)
+        # like the submissions, the first attempt with the highest score is the best one
+        best_attempt_id = min(
+            attempts_of_result[result_id], key=lambda attempt: (-(attempt[1] or 0), attempt[0])
+        )[0]
+        results.append({'result_id': result_id, 'new_score': latest_score, 'best_id': best_attempt_id})
+        if latest_score != score:
+            changed_results.append((user_id, score, latest_score))
+        total_delta += latest_score - score
+
+    session.execute(
+        update(QuizAttempt.__table__).where(QuizAttempt.id == bindparam('attempt_id'))
+        .values(score=bindparam('new_score')),
+        [{'attempt_id': attempt_id, 'new_score': score} for attempt_id, score in changed.items()]
+    )
+    if results:
+        session.execute(
+            update(QuizResult.__table__).where(QuizResult.id == bindparam('result_id'))
+            .values(score=bindparam('new_score'), best_attempt_id=bindparam('best_id')),
+            results
+        )
+    session.execute(
+        update(QuizStats).where(QuizStats.quiz_id == quiz_id)
+        .values(total_score=QuizStats.total_score + total_delta)
+    )
+    return len(changed), changed_results
+
+
+def has_answers(question_id, quiz_id, batch_size=1000):
+    ''' Tell if answers to a question of a quiz are stored: counted in its stats, in response rows or in the
+        packed answers of the attempts of the quiz, read batch_size attempts at a time. '''
+    session = db.session
+    if session.execute(select(QuestionStats.answered).where(QuestionStats.question_id == question_id)).scalar():
+        return True
+    if session.execute(select(Response.id).where(Response.question_id == question_id).limit(1)).first():
+        return True
+    result = session.connection().execute(
+        select(QuizAttempt.packed_answers)
+        .where(QuizAttempt.quiz_id == quiz_id, QuizAttempt.packed_answers.is_not(None))
+        .execution_options(yield_per=batch_size)
+    )
+    return any(
+        question_id in np.frombuffer(packed_answers, '<u4', len(packed_answers) // ANSWER_SIZE)
+        for batch in result.partitions() for (packed_answers,) in batch
+    )
+
+
+def request_rescore(quiz):
+    ''' Mark a quiz to be rescored by `flask rescore --pending`, committed with the change of its answer key. '''
+    quiz.rescore_requested_at = datetime.now(timezone.utc)
+
+
+def rescore_pending(batch_size=50000):
+    ''' Rescore the quizzes marked by request_rescore, then clear their mark unless they were marked again
+        meanwhile. Returns the Rescore of each quiz id. '''
+    session = db.session
+    requests = session.execute(
+        select(Quiz.id, Quiz.rescore_requested_at).where(Quiz.rescore_requested_at.is_not(None)).order_by(Quiz.id)
+    ).all()
+    rescores = {}
+    for quiz_id, requested_at in requests:
+        rescores[quiz_id] = rescore_quiz(quiz_id, batch_size)
+        session.execute(
+            update(Quiz).where(Quiz.id == quiz_id, Quiz.rescore_requested_at == requested_at)
+            .values(rescore_requested_at=None)
+        )
+        session.commit()
+    return rescores
+
+
+def rescore_quiz(quiz_id, batch_size=50000):
+    ''' Recompute the correctness of every stored answer to a quiz against its current answer key (e.g. after
+        the correct option of a question was fixed), then the scores of its attempts and results, the stats
+        and the leaderboards (the scores which changed are moved on them). The responses are streamed in batches of batch_size rows (or attempts with as many
+        packed answers) and checked as arrays, then only what changed is written back with bulk updates,
+        in one transaction. Returns a Rescore of the number of responses, attempts and results changed. '''
+    session = db.session
+    quiz = session.get(Quiz, quiz_id)
+    if quiz is None:
+        return Rescore(0, 0, 0)
+    answer_key = load_answer_key(quiz_id, session)
+    # the submissions lock the result of their user (see submission.find_result): until the commit, they
+    # can't change the latest attempts and the scores read by the rescore
+    latest_attempt_ids = np.array([latest_attempt_id for latest_attempt_id in session.execute(
+        select(QuizResult.latest_attempt_id).where(QuizResult.quiz_id == quiz_id).with_for_update()
+    ).scalars() if latest_attempt_id is not None], dtype=np.int64)
+
+    scores = Counter()
+    correct_deltas = Counter()
+    became_correct, became_wrong = check_rows(
+        session, quiz_id, answer_key, latest_attempt_ids, scores, correct_deltas, batch_size
+    )
+    attempts_per_batch = max(1, batch_size // max(1, len(answer_key[0])))
+    changed_answers, repacked = check_packed(
+        session, quiz_id, answer_key, latest_attempt_ids, scores, correct_deltas, attempts_per_batch
+    )
+
+    try:
+        for value, response_ids in ((True, became_correct), (False, became_wrong)):
+            for start in range(0, len(response_ids), IDS_PER_UPDATE):
+                session.execute(
+                    update(Response).where(Response.id.in_(response_ids[start:start + IDS_PER_UPDATE].tolist()))
+                    .values(is_correct=value)
+                )
+        if repacked:
+            session.execute(
+                update(QuizAttempt.__table__).where(QuizAttempt.id == bindparam('attempt_id'))
+                .values(packed_answers=bindparam('packed'), correct_bitmap=bindparam('bitmap')),
+                repacked
+            )
+        question_deltas = [{'qid': question_id, 'correct_delta': delta}
+                           for question_id, delta in correct_deltas.items() if delta]
+        if question_deltas:
+            session.execute(
+                update(QuestionStats.__table__)
+                .where(QuestionStats.question_id == bindparam('qid'))
+                .values(correct=QuestionStats.correct + bindparam('correct_delta')),
+                question_deltas
+            )
+        attempts, results = rescore_attempts(session, quiz_id, scores)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    for user_id, previous_score, score in results:
+        record_score(user_id, quiz_id, quiz.category_id, score, previous_score)
+    return Rescore(len(became_correct) + len(became_wrong) + changed_answers, attempts, len(results))
@@ -0,0 +1,89 @@
+from collections import namedtuple
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+
+from . import db
+from .models import QuizResult, QuizAttempt, Question, Response
+from .packing import unpack_answers
+
+
+# What quiz_result.html shows, built from one load of result -> quiz, responses -> questions, attempts
+ResponseView = namedtuple('ResponseView', ['question', 'selected_answer', 'correct_answer', 'is_correct'])
+AttemptView = namedtuple('AttemptView', ['id', 'score', 'finished_at', 'is_latest', 'is_best'])
+ResultView = namedtuple(
+    'ResultView', ['id', 'quiz_id', 'quiz_title', 'score', 'total_questions', 'responses', 'attempts']
+)
+
+# finished attempts listed with a result, the most recent first
+HISTORY_SIZE = 20
+
+
+def option_text(options, number):
+    ''' Get the text of an option from its number, options are numbered from 1 like in the quiz form. '''
+    if 1 <= number <= len(options):
+        return options[number - 1]
+    return ''
+
+
+def load_latest_responses(attempt_id, packed, session):
+    ''' Get the (selected_option, is_correct, Question) of the responses of an attempt, in question order,
+        decoded from its packed answers (a (packed_answers, correct_bitmap) pair) or read from its rows.
+        The answers to questions deleted since then are left out. '''
+    if packed is not None:
+        rows = unpack_answers(*packed)
+        questions = {question.id: question for question in session.query(Question).filter(
+            Question.id.in_([row['question_id'] for row in rows])
+        )}
+        return [(row['selected_option'], row['is_correct'], questions[row['question_id']])
+                for row in rows if row['question_id'] in questions]
+    responses = session.query(Response).options(joinedload(Response.question)) \
+        .filter_by(attempt_id=attempt_id).order_by(Response.question_id)
+    return [(response.selected_option, response.is_correct, response.question) for response in responses]
+
+
+def load_result_view(quiz_result_id, user_id, session=None):
+    ''' Load a quiz result of a user with its quiz, the responses and questions of its latest attempt and
+        the history of its attempts in a fixed number of queries.
+        Returns a ResultView, None if the result does not exist or belongs to another user. '''
+    session = session or db.session
+    row = session.query(QuizResult, QuizAttempt.packed_answers, QuizAttempt.correct_bitmap) \
+        .options(joinedload(QuizResult.quiz)) \
+        .outerjoin(QuizAttempt, QuizAttempt.id == QuizResult.latest_attempt_id) \
+        .filter(QuizResult.id == quiz_result_id, QuizResult.user_id == user_id).first()
+    if row is None:
+        return None
+    quiz_result, packed_answers, correct_bitmap = row
+
+    packed = (packed_answers, correct_bitmap) if packed_answers is not None else None
+    responses = []
+    for selected_option, is_correct, question in load_latest_responses(quiz_result.latest_attempt_id, packed, session):
+        responses.append(ResponseView(
+            question=question.text,
+            selected_answer=option_text(question.options, selected_option),
+            correct_answer=option_text(question.options, question.correct_option),
+            is_correct=is_correct,
+        ))
+    attempts = [
+        AttemptView(attempt_id, score, finished_at, attempt_id == quiz_result.latest_attempt_id,
+                    attempt_id == quiz_result.best_attempt_id)
+        for attempt_id, score, finished_at in session.execute(
+            select(QuizAttempt.id, QuizAttempt.score, QuizAttempt.finished_at)
+            .where(QuizAttempt.quiz_result_id == quiz_result.id, QuizAttempt.finished_at.is_not(None))
+            .order_by(QuizAttempt.id.desc()).limit(HISTORY_SIZE)
+        )
+    ]
+    return ResultView(
+        id=quiz_result.id,
+        quiz_id=quiz_result.quiz_id,
+        quiz_title=quiz_result.quiz.title,
+        score=quiz_result.score,
+        total_questions=quiz_result.quiz.total_questions,
+        responses=responses,
+        attempts=attempts,
+    )
+
+
+def load_user_results(user_id):
+    ''' Load the quiz results of a user together with their quizzes in one query. '''
+    return QuizResult.query.options(joinedload(QuizResult.quiz)) \
+        .filter_by(user_id=user_id).order_by(QuizResult.id).all()
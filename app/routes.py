@@ -1,14 +1,30 @@
-from flask import render_template, url_for, flash, redirect, request, Blueprint
-from werkzeug.security import generate_password_hash
-from werkzeug.security import check_password_hash
+from flask import render_template, url_for, flash, redirect, request, Blueprint, abort, current_app
+from flask import stream_with_context
 from flask_login import login_user
 from flask_login import logout_user
 from flask_login import current_user, login_required
 from flask import jsonify
-from .utils import admin_required
-
+from .utils import admin_required, read_only
+from .passwords import HashingBusy, hash_password, check_user_password, needs_rehash, rehash_in_background
+from .throttle import auth_throttled, record_login
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, selectinload
+from .status import load_quiz_statuses, NO_STATUS
+from .submission import parse_answers, submit_quiz, remove_result
+from .attempts import parse_saved_answers, page_answers, load_attempt, start_attempt, save_answers, finish_attempt
+from .stats import init_quiz_stats, init_question_stats, sync_option_stats
+from .export import EXPORTS, FORMATS, export_rows
+from .importer import read_questions, import_questions
+from .pagination import keyset_paginate
+from .results import load_result_view, load_user_results
+from .leaderboards import QUIZ, CATEGORY, top, user_ranks, load_profile_ranks
+from .leaderboards import drop_leaderboards, move_quiz_scores, quiz_scores
+from .rescoring import has_answers, request_rescore
+
+from .cache import get_quiz_snapshot, get_cached_html, get_categories, invalidate_quizzes, invalidate_categories
 from .models import db, Quiz, Question, Response, QuizResult, User, Category
-from .forms import LoginForm, QuizForm, RegistrationForm, CategoryForm, QuestionForm
+from .forms import LoginForm, QuizForm, RegistrationForm, CategoryForm, QuestionForm, ImportQuestionsForm
+from .forms import QuizTakingForm
 
 main = Blueprint('main', __name__)
 
@@ -17,7 +33,14 @@ main = Blueprint('main', __name__)
 def register():
     form = RegistrationForm()
     if form.validate_on_submit():
-        hashed_password = generate_password_hash(form.password.data)
+        if auth_throttled():
+            flash('Too many attempts, please try again later.', 'danger')
+            return render_template('auth/register.html', form=form), 429
+        try:
+            hashed_password = hash_password(form.password.data)
+        except HashingBusy:
+            flash('The server is busy, please try again in a moment.', 'danger')
+            return render_template('auth/register.html', form=form), 503
         user = User(username=form.username.data, email=form.email.data, password=hashed_password)
         db.session.add(user)
         db.session.commit()
@@ -30,8 +53,21 @@ def register():
 def login():
     form = LoginForm()
     if form.validate_on_submit():
+        # the attempts are counted before any password is hashed
+        if auth_throttled(form.email.data):
+            flash('Too many attempts, please try again later.', 'danger')
+            return render_template('auth/login.html', form=form), 429
         user = User.query.filter_by(email=form.email.data).first()
-        if user and check_password_hash(user.password, form.password.data):
+        try:
+            valid = check_user_password(user, form.password.data)
+        except HashingBusy:
+            flash('The server is busy, please try again in a moment.', 'danger')
+            return render_template('auth/login.html', form=form), 503
+        record_login(form.email.data, valid)
+        if valid:
+            # the hash method changed since the password was hashed
+            if needs_rehash(user.password):
+                rehash_in_background(user.id, user.password, form.password.data)
             login_user(user, remember=form.remember.data)
             flash('You have been logged in!', 'success')
             next_page = request.args.get('next')
@@ -52,23 +88,110 @@ def logout():
 @main.route('/dashboard')
 @login_required
 @admin_required
+@read_only
 def dashboard():
-    return render_template('admin/dashboard.html')
+    # the stats are kept up to date by the submissions, nothing is aggregated here
+    quizzes = keyset_paginate(
+        Quiz.query.options(joinedload(Quiz.stats)), [Quiz.id], current_app.config['QUIZZES_PER_PAGE'],
+        after=request.args.get('after'), before=request.args.get('before')
+    )
+    return render_template('admin/dashboard.html', quizzes=quizzes)
+
+# statistics of the questions of a quiz
+@main.route('/admin/quiz_stats/<int:quiz_id>')
+@login_required
+@admin_required
+@read_only
+def quiz_stats(quiz_id):
+    quiz = Quiz.query.options(joinedload(Quiz.stats)).get_or_404(quiz_id)
+    questions = Question.query.filter_by(quiz_id=quiz.id).options(
+        joinedload(Question.stats), selectinload(Question.option_stats)
+    ).order_by(Question.id).all()
+    return render_template('admin/quiz_stats.html', quiz=quiz, questions=questions)
 
 # Profile
 @main.route('/profile')
 @login_required
+@read_only
 def profile():
-    user = User.query.get_or_404(current_user.id)
-    quiz_results = QuizResult.query.filter_by(user_id=current_user.id).all()
-    return render_template('profile.html', user=user, quiz_results=quiz_results)
+    quiz_results = load_user_results(current_user.id)
+    quiz_ranks, category_ranks = load_profile_ranks(current_user.id, quiz_results)
+    return render_template(
+        'profile.html', user=current_user, quiz_results=quiz_results,
+        quiz_ranks=quiz_ranks, category_ranks=category_ranks
+    )
+
+
+# leaderboard of a quiz
+@main.route('/leaderboard/quiz/<int:quiz_id>')
+@login_required
+@read_only
+def quiz_leaderboard(quiz_id):
+    quiz = get_quiz_snapshot(quiz_id)
+    if quiz is None:
+        abort(404)
+    return render_template(
+        'leaderboard.html', title=quiz.title, entries=top(QUIZ, quiz_id, current_app.config['LEADERBOARD_SIZE']),
+        rank=user_ranks(current_user.id, [(QUIZ, quiz_id)])[QUIZ, quiz_id]
+    )
+
+
+# leaderboard of a category, on the total score of the users in its quizzes
+@main.route('/leaderboard/category/<int:category_id>')
+@login_required
+@read_only
+def category_leaderboard(category_id):
+    category = next((category for category in get_categories() if category.id == category_id), None)
+    if category is None:
+        abort(404)
+    return render_template(
+        'leaderboard.html', title=category.name,
+        entries=top(CATEGORY, category_id, current_app.config['LEADERBOARD_SIZE']),
+        rank=user_ranks(current_user.id, [(CATEGORY, category_id)])[CATEGORY, category_id]
+    )
 
 
 # home page (list all quizzes)
 @main.route('/')
+@read_only
 def home():
-    quizzes = Quiz.query.all()
-    return render_template('home.html', quizzes=quizzes)
+    after, before = request.args.get('after'), request.args.get('before')
+    if not current_user.is_authenticated and not after and not before:
+        # the first page is the same for every visitor, it is rendered once per version of the quizzes
+        return get_cached_html('quizzes', 'home', lambda: render_template(
+            'home.html', quizzes=keyset_paginate(Quiz.query, [Quiz.id], current_app.config['QUIZZES_PER_PAGE']),
+            statuses={}, no_status=NO_STATUS
+        ))
+    quizzes = keyset_paginate(
+        Quiz.query, [Quiz.id], current_app.config['QUIZZES_PER_PAGE'], after=after, before=before
+    )
+    # load the status of the quizzes of the page for the current user in one query
+    statuses = {}
+    if current_user.is_authenticated:
+        statuses = load_quiz_statuses(current_user, [quiz.id for quiz in quizzes])
+    return render_template('home.html', quizzes=quizzes, statuses=statuses, no_status=NO_STATUS)
+
+
+# export the quiz results, the responses or the packed answers
+@main.route('/admin/export/<kind>')
+@login_required
+@admin_required
+@read_only
+def export(kind):
+    fmt = request.args.get('format', 'csv')
+    if kind not in EXPORTS or fmt not in FORMATS:
+        abort(404)
+    chunks = export_rows(
+        kind, fmt, current_app.config['EXPORT_BATCH_SIZE'],
+        quiz_id=request.args.get('quiz_id', type=int),
+        category_id=request.args.get('category_id', type=int),
+        min_id=request.args.get('min_id', type=int),
+        max_id=request.args.get('max_id', type=int),
+    )
+    # the rows are streamed as they are read, the export is never held in memory
+    response = current_app.response_class(stream_with_context(chunks), mimetype=FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename={kind}.{fmt}'
+    return response
 
 
 # create a new category
@@ -78,13 +201,15 @@ def home():
 def add_category():
     form = CategoryForm()
     if form.validate_on_submit():
-        # check if category already exist
-        if Category.query.filter_by(name=form.name.data).first():
-            return jsonify({ "message": "category already exist"})
-        
         category = Category(name=form.name.data)
         db.session.add(category)
-        db.session.commit()
+        # the unique constraint on the name tells if the category already exist
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({ "message": "category already exist"})
+        invalidate_categories()
         flash('Category added successfully.', 'success')
         return redirect(url_for('main.categories'))
     return render_template('admin/add_category.html', form=form)
@@ -99,7 +224,12 @@ def update_category(category_id):
     form = CategoryForm(obj=category)
     if form.validate_on_submit():
         category.name = form.name.data
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({ "message": "category already exist"})
+        invalidate_categories()
         flash('Category updated successfully.', 'success')
         return redirect(url_for('main.categories'))
     return render_template('admin/update_category.html', form=form)
@@ -110,8 +240,12 @@ def update_category(category_id):
 @admin_required
 def delete_category(category_id):
     category = Category.query.get_or_404(category_id)
+    quiz_ids = [quiz.id for quiz in category.quizzes]
     db.session.delete(category)
     db.session.commit()
+    invalidate_quizzes(*quiz_ids)
+    invalidate_categories()
+    drop_leaderboards(quiz_ids, [category_id])
     flash('Category deleted successfully.', 'success')
     return redirect(url_for('main.categories'))
 
@@ -119,8 +253,12 @@ def delete_category(category_id):
 @main.route('/admin/categories')
 @login_required
 @admin_required
+@read_only
 def categories():
-    categories = Category.query.all()
+    categories = keyset_paginate(
+        Category.query, [Category.id], current_app.config['CATEGORIES_PER_PAGE'],
+        after=request.args.get('after'), before=request.args.get('before')
+    )
     return render_template('admin/categories.html', categories=categories)
 
 
@@ -131,17 +269,20 @@ def categories():
 def add_quiz():
     form = QuizForm()
     if form.validate_on_submit():
-        # check if quiz already exist
-        if Quiz.query.filter_by(title=form.title.data).first():
-            return jsonify({ "message": "quiz already exist"})
-        
         quiz = Quiz(
             title=form.title.data,
             description=form.description.data,
             category_id=form.category_id.data
         )
+        init_quiz_stats(quiz)
         db.session.add(quiz)
-        db.session.commit()
+        # the unique index on the title tells if the quiz already exist
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({ "message": "quiz already exist"})
+        invalidate_quizzes(quiz.id)
         flash('Quiz added successfully.', 'success')
         return redirect(url_for('main.quizzes'))
     return render_template('admin/add_quiz.html', form=form)
@@ -154,11 +295,20 @@ def update_quiz(quiz_id):
     quiz = Quiz.query.get_or_404(quiz_id)
     form = QuizForm(obj=quiz)
     if form.validate_on_submit():
+        old_category_id = quiz.category_id
         quiz.title = form.title.data
         quiz.description = form.description.data
         quiz.category_id = form.category_id.data
         quiz.total_questions = form.total_questions.data
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({ "message": "quiz already exist"})
+        invalidate_quizzes(quiz.id)
+        if quiz.category_id != old_category_id:
+            # the scores of the quiz move to the leaderboard of its new category
+            move_quiz_scores(quiz_scores(quiz.id), old_category_id, quiz.category_id)
         flash('Quiz updated successfully.', 'success')
         return redirect(url_for('main.quizzes'))
     return render_template('admin/update_quiz.html', form=form)
@@ -169,8 +319,14 @@ def update_quiz(quiz_id):
 @admin_required
 def delete_quiz(quiz_id):
     quiz = Quiz.query.get_or_404(quiz_id)
+    category_id = quiz.category_id
+    # the results are deleted with the quiz, their scores leave the leaderboard of its category
+    scores = quiz_scores(quiz_id)
     db.session.delete(quiz)
     db.session.commit()
+    invalidate_quizzes(quiz_id)
+    drop_leaderboards([quiz_id])
+    move_quiz_scores(scores, category_id, None)
     flash('Quiz deleted successfully.', 'success')
     return redirect(url_for('main.quizzes'))
 
@@ -178,81 +334,107 @@ def delete_quiz(quiz_id):
 @main.route('/admin/quizzes')
 @login_required
 @admin_required
+@read_only
 def quizzes():
-    quizzes = Quiz.query.all()
+    quizzes = keyset_paginate(
+        Quiz.query, [Quiz.id], current_app.config['QUIZZES_PER_PAGE'],
+        after=request.args.get('after'), before=request.args.get('before')
+    )
     return render_template('admin/quizzes.html', quizzes=quizzes)
 
 # get or submit a quiz
 @main.route('/quiz/<int:quiz_id>', methods=['GET', 'POST'])
 @login_required
+@read_only
 def quiz(quiz_id):
-    form = QuestionForm()
-    quiz = Quiz.query.get_or_404(quiz_id)
-    questions = Question.query.filter_by(quiz_id=quiz.id).all()
+    form = QuizTakingForm()
+    # the quiz, its questions and its answer key come from the cache
+    quiz = get_quiz_snapshot(quiz_id)
+    if quiz is None:
+        abort(404)
 
     if request.method == 'POST':
+        if not form.validate():
+            flash('The page expired, please submit the quiz again.', 'danger')
+            return redirect(url_for('main.quiz', quiz_id=quiz.id))
         if quiz.total_questions == 0:
             flash('No questions available for this quiz.', 'danger')
             return redirect(url_for('main.quiz', quiz_id=quiz.id))
-        # check if quiz_result for the quiz already exists to update it
-        quiz_result = QuizResult.query.filter_by(quiz_id=quiz.id, user_id=current_user.id).first()
-        if quiz_result:
-            print('quiz_result', quiz_result)
-            quiz_result_id = quiz_result.id
-        else:
-            # get the last quiz_result_id and increment it by 1 to get the new quiz_result_id
-            # QuizResult.query.delete() # delete all quiz results (if you want to reset the quiz results)
-            quiz_result_id = QuizResult.query.count() + 1
+        try:
+            answers = parse_answers(request.form, quiz.answer_key)
+        except ValueError:
+            flash('Please answer every question.', 'danger')
+            return redirect(url_for('main.quiz', quiz_id=quiz.id))
+
+        # score the answers and store the result and the responses in one transaction
+        submission = submit_quiz(
+            current_user.id, quiz.id, answers, quiz.answer_key, category_id=quiz.category_id
+        )
+
+        flash(f'Your score: {submission.score}/{submission.total}', 'success')
+        return redirect(url_for('main.quiz_result', quiz_result_id=submission.result_id))
+
+    # the questions are rendered once per version of the quiz, the csrf token is rendered outside
+    questions_html = get_cached_html(
+        f'quiz:{quiz.id}', 'questions', lambda: render_template('quiz_questions.html', questions=quiz.questions)
+    )
+    return render_template('quiz.html', quiz=quiz, questions_html=questions_html, form=form)
 
-        score = 0
-        responses = [] 
 
-        # delete existing responses
+# start an attempt at a quiz, or resume the open one
+@main.route('/quiz/<int:quiz_id>/attempt')
+@login_required
+def start_quiz_attempt(quiz_id):
+    if get_quiz_snapshot(quiz_id) is None:
+        abort(404)
+    attempt = start_attempt(current_user.id, quiz_id)
+    return redirect(url_for('main.quiz_attempt', attempt_id=attempt.id))
+
+
+# answer the questions of an attempt one page at a time, each page is saved on its own
+@main.route('/attempt/<int:attempt_id>', methods=['GET', 'POST'])
+@login_required
+def quiz_attempt(attempt_id):
+    attempt = load_attempt(attempt_id, current_user.id)
+    if attempt is None:
+        flash('Quiz attempt not found.', 'danger')
+        return redirect(url_for('main.home'))
+    if not attempt.is_open:
+        return redirect(url_for('main.quiz_result', quiz_result_id=attempt.quiz_result_id)
+                        if attempt.quiz_result_id else url_for('main.home'))
+    quiz = get_quiz_snapshot(attempt.quiz_id)
+    if quiz is None:
+        abort(404)
+    # only the questions of the page are rendered, from the cached snapshot
+    page_size = current_app.config['ATTEMPT_PAGE_SIZE']
+    pages = max(1, -(-len(quiz.questions) // page_size))
+    page = min(max(request.args.get('page', 1, type=int), 1), pages)
+    questions = quiz.questions[(page - 1) * page_size:page * page_size]
+    form = QuizTakingForm()
+
+    if request.method == 'POST':
+        if not form.validate():
+            flash('The page expired, please try again.', 'danger')
+            return redirect(url_for('main.quiz_attempt', attempt_id=attempt_id, page=page))
         try:
-            resps = Response.query.filter_by(quiz_id=quiz.id, user_id=current_user.id).delete()
-            db.session.commit()
-        except:
-            pass
-
-        for question in questions:
-            selected_option = int(request.form.get(f'question_{question.id}'))
-            is_correct = selected_option == question.correct_option
-
-            # Track response
-            response = Response(
-                user_id=current_user.id,
-                quiz_id=quiz.id,
-                question_id=question.id,
-                selected_option=selected_option,
-                is_correct=is_correct,
-                quiz_result_id=quiz_result_id
-            )
-            responses.append(response)
-            db.session.add(response)
-
-            # Update score
-            if is_correct:
-                score += 1
-
-        if quiz_result:
-            quiz_result.score=score
-            quiz_result.user_id=current_user.id
-            quiz_result.quiz_id=quiz.id
-        else:
-            print('quiz_result_id', quiz_result_id)
-            # Store quiz result
-            quiz_result = QuizResult(
-                id=quiz_result_id,
-                score=score,
-                user_id=current_user.id,
-                quiz_id=quiz.id
-            )
-            db.session.add(quiz_result)
-        db.session.commit()
+            answers = parse_saved_answers(page_answers(request.form, questions), quiz.answer_key)
+        except ValueError:
+            flash('Invalid answers.', 'danger')
+            return redirect(url_for('main.quiz_attempt', attempt_id=attempt_id, page=page))
+        if answers and save_answers(attempt_id, current_user.id, answers) is None:
+            return redirect(url_for('main.quiz_attempt', attempt_id=attempt_id))
+        if request.form.get('action') == 'finish':
+            submission = finish_attempt(attempt_id, current_user.id, quiz)
+            if submission is None:
+                return redirect(url_for('main.quiz_attempt', attempt_id=attempt_id))
+            flash(f'Your score: {submission.score}/{submission.total}', 'success')
+            return redirect(url_for('main.quiz_result', quiz_result_id=submission.result_id))
+        return redirect(url_for('main.quiz_attempt', attempt_id=attempt_id, page=min(page + 1, pages)))
 
-        flash(f'Your score: {score}/{len(questions)}', 'success')
-        return redirect(url_for('main.quiz_result', quiz_result_id=quiz_result.id))
-    return render_template('quiz.html', quiz=quiz, questions=questions, form=form)
+    return render_template(
+        'quiz_attempt.html', quiz=quiz, attempt=attempt, questions=questions, form=form, page=page, pages=pages,
+        saved={int(question_id): option for question_id, option in attempt.answers.items()}
+    )
 
 
 
@@ -265,8 +447,6 @@ def add_question():
     form = QuestionForm()
     if form.validate_on_submit():
         quiz = Quiz.query.get_or_404(form.quiz_id.data)
-        if Question.query.filter_by(text=form.text.data).first():
-            return jsonify({ "message": "question already exist"})
         question = Question(
             text=form.text.data,
             options=form.options.data,
@@ -275,10 +455,15 @@ def add_question():
         )
         # Update quiz total questions
         quiz.total_questions += 1
-        db.session.commit()
-
+        init_question_stats(question)
         db.session.add(question)
-        db.session.commit()
+        # the unique index on the text tells if the question already exist
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({ "message": "question already exist"})
+        invalidate_quizzes(quiz.id)
         flash('Question added successfully.', 'success')
         return redirect(url_for('main.questions'))
     return render_template('admin/add_question.html', form=form)
@@ -291,12 +476,35 @@ def update_question(question_id):
     question = Question.query.get_or_404(question_id)
     form = QuestionForm(obj=question)
     if form.validate_on_submit():
+        old_quiz_id = question.quiz_id
+        old_correct_option = question.correct_option
+        # the answers to a question belong to the attempts of its quiz, they would count in neither quiz
+        if form.quiz_id.data != old_quiz_id and has_answers(question.id, old_quiz_id):
+            flash("An answered question can't be moved to another quiz, add a new question instead.", 'danger')
+            return render_template('admin/update_question.html', form=form), 409
         question.text = form.text.data
         question.options = form.options.data
         question.correct_option = form.correct_option.data
         question.quiz_id = form.quiz_id.data
-        db.session.commit()
+        # the stored answers to the question were checked against the previous correct option,
+        # they are rescored out of the request by `flask rescore --pending`
+        rescore = question.correct_option != old_correct_option
+        # the queries below flush the question, the unique index on its text can fail there
+        try:
+            sync_option_stats(question)
+            if question.quiz_id != old_quiz_id:
+                db.session.get(Quiz, old_quiz_id).total_questions -= 1
+                db.session.get(Quiz, question.quiz_id).total_questions += 1
+            if rescore:
+                request_rescore(db.session.get(Quiz, question.quiz_id))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({ "message": "question already exist"})
+        invalidate_quizzes(old_quiz_id, question.quiz_id)
         flash('Question updated successfully.', 'success')
+        if rescore:
+            flash('Rescore scheduled.', 'info')
         return redirect(url_for('main.questions'))
     return render_template('admin/update_question.html', form=form)
 
@@ -311,25 +519,53 @@ def delete_question(question_id):
     quiz.total_questions -= 1
     db.session.delete(question)
     db.session.commit()
+    invalidate_quizzes(quiz.id)
     flash('Question deleted successfully.', 'success')
     return redirect(url_for('main.questions'))
 
+# import questions from a CSV or JSON file
+@main.route('/admin/import_questions', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def import_questions_file():
+    form = ImportQuestionsForm()
+    report = None
+    if form.validate_on_submit():
+        try:
+            rows = read_questions(form.file.data.stream, form.file.data.filename)
+        except ValueError as error:
+            flash(str(error), 'danger')
+            return redirect(url_for('main.import_questions_file'))
+        try:
+            report = import_questions(rows, current_app.config['IMPORT_BATCH_SIZE'], dry_run=form.dry_run.data)
+        except ValueError as error:
+            flash(str(error), 'danger')
+            return redirect(url_for('main.import_questions_file'))
+    return render_template('admin/import_questions.html', form=form, report=report)
+
 # view all questions
 @main.route('/admin/questions')
 @login_required
 @admin_required
+@read_only
 def questions():
-    quizzes = Quiz.query.all()
-    return render_template('admin/questions.html', quizzes=quizzes)
+    # questions are listed quiz by quiz, the quiz of each question is loaded in the same query
+    questions = keyset_paginate(
+        Question.query.options(joinedload(Question.quiz)), [Question.quiz_id, Question.id],
+        current_app.config['QUESTIONS_PER_PAGE'],
+        after=request.args.get('after'), before=request.args.get('before')
+    )
+    return render_template('admin/questions.html', questions=questions)
 
 
 
 # get quiz results
 @main.route('/quiz_result/<int:quiz_result_id>')
 @login_required
+@read_only
 def quiz_result(quiz_result_id):
-    # get the quiz_result of the current user
-    quiz_result = QuizResult.query.filter_by(id=quiz_result_id, user_id=current_user.id).first()
+    # get the quiz_result of the current user with its responses and questions
+    quiz_result = load_result_view(quiz_result_id, current_user.id)
     if not quiz_result:
         flash('Quiz result not found.', 'danger')
         return redirect(url_for('main.home'))
@@ -343,7 +579,6 @@ def delete_quiz_result(quiz_result_id):
     if not quiz_result:
         flash('Quiz result not found.', 'danger')
         return redirect(url_for('main.home'))
-    db.session.delete(quiz_result)
-    db.session.commit()
+    remove_result(quiz_result)
     flash('Quiz result deleted successfully.', 'success')
     return redirect(url_for('main.profile'))
\ No newline at end of file
@@ -0,0 +1,86 @@
+from collections import Counter
+from sqlalchemy import update, bindparam
+
+from . import db
+from .models import QuizStats, QuestionStats, QuestionOptionStats
+
+
+def init_quiz_stats(quiz):
+    ''' Create the (empty) stats of a new quiz, to be committed with it. '''
+    quiz.stats = QuizStats(attempts=0, submissions=0, total_score=0)
+
+
+def init_question_stats(question):
+    ''' Create the (empty) stats of a new question and of each of its options. '''
+    question.stats = QuestionStats(answered=0, correct=0)
+    question.option_stats = [
+        QuestionOptionStats(option_number=option, selected_count=0) for option in range(1, len(question.options) + 1)
+    ]
+
+
+def sync_option_stats(question):
+    ''' Add the stats of the options added to a question, to be committed with the new options.
+        The stats of the removed options are deleted unless current responses still select them. '''
+    numbers = range(1, len(question.options) + 1)
+    existing = {option.option_number: option for option in question.option_stats}
+    for number, option in existing.items():
+        if number not in numbers and not option.selected_count:
+            question.option_stats.remove(option)
+    question.option_stats.extend(
+        QuestionOptionStats(option_number=number, selected_count=0) for number in numbers if number not in existing
+    )
+
+
+def record_result_delta(quiz_id, attempts, submissions, score, added_rows=(), removed_rows=(), session=None):
+    ''' Apply the change made by a submission (or a deletion) to the stats, as deltas.
+        added_rows and removed_rows are the responses which appeared and disappeared, as
+        dicts with question_id, selected_option and is_correct.
+        Only UPDATE ... SET x = x + delta are used, so concurrent submissions don't lose counts.
+        Must be called inside the transaction of the submission. '''
+    session = session or db.session
+    session.execute(
+        update(QuizStats).where(QuizStats.quiz_id == quiz_id).values(
+            attempts=QuizStats.attempts + attempts,
+            submissions=QuizStats.submissions + submissions,
+            total_score=QuizStats.total_score + score,
+        )
+    )
+
+    answered = Counter()
+    correct = Counter()
+    options = Counter()
+    for rows, sign in ((added_rows, 1), (removed_rows, -1)):
+        for row in rows:
+            answered[row['question_id']] += sign
+            correct[row['question_id']] += sign if row['is_correct'] else 0
+            options[row['question_id'], row['selected_option']] += sign
+
+    question_deltas = [
+        {'qid': question_id, 'answered_delta': answered[question_id], 'correct_delta': correct[question_id]}
+        for question_id in answered if answered[question_id] or correct[question_id]
+    ]
+    if question_deltas:
+        session.execute(
+            update(QuestionStats.__table__)
+            .where(QuestionStats.question_id == bindparam('qid'))
+            .values(
+                answered=QuestionStats.answered + bindparam('answered_delta'),
+                correct=QuestionStats.correct + bindparam('correct_delta'),
+            ),
+            question_deltas
+        )
+
+    option_deltas = [
+        {'qid': question_id, 'opt': option, 'delta': delta}
+        for (question_id, option), delta in options.items() if delta
+    ]
+    if option_deltas:
+        session.execute(
+            update(QuestionOptionStats.__table__)
+            .where(
+                QuestionOptionStats.question_id == bindparam('qid'),
+                QuestionOptionStats.option_number == bindparam('opt'),
+            )
+            .values(selected_count=QuestionOptionStats.selected_count + bindparam('delta')),
+            option_deltas
+        )
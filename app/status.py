@@ -0,0 +1,51 @@
+from collections import namedtuple
+from flask import g, has_request_context
+
+from . import db
+from .models import QuizAttempt, QuizResult
+
+
+NOT_STARTED = 'not_started'
+IN_PROGRESS = 'in_progress'
+COMPLETED = 'completed'
+
+# The status of a single quiz for a single user, as shown on the home page:
+# in progress while the user has an open attempt, completed once the user has a result
+QuizStatus = namedtuple('QuizStatus', ['status', 'score', 'result_id'])
+
+NO_STATUS = QuizStatus(NOT_STARTED, 0, 0)
+
+
+def load_quiz_statuses(user, quiz_ids=None, session=None):
+    ''' Load the status of every quiz taken by the user with two queries, one for the results and one for
+        the open attempts. Returns a dict of quiz_id -> QuizStatus, quizzes never taken are left out. '''
+    session = session or db.session
+    results = session.query(QuizResult.quiz_id, QuizResult.score, QuizResult.id) \
+        .filter(QuizResult.user_id == user.id)
+    attempts = session.query(QuizAttempt.quiz_id) \
+        .filter(QuizAttempt.user_id == user.id, QuizAttempt.finished_at.is_(None))
+    if quiz_ids is not None:
+        results = results.filter(QuizResult.quiz_id.in_(quiz_ids))
+        attempts = attempts.filter(QuizAttempt.quiz_id.in_(quiz_ids))
+
+    statuses = {quiz_id: QuizStatus(COMPLETED, score, result_id) for quiz_id, score, result_id in results}
+    for quiz_id, in attempts.distinct():
+        score, result_id = statuses[quiz_id][1:] if quiz_id in statuses else (0, 0)
+        statuses[quiz_id] = QuizStatus(IN_PROGRESS, score, result_id)
+    return statuses
+
+
+def get_quiz_statuses(user):
+    ''' Same as load_quiz_statuses, but loaded once per request and user. '''
+    if not has_request_context():
+        return load_quiz_statuses(user)
+    cache = g.setdefault('quiz_statuses', {})
+    if user.id not in cache:
+        cache[user.id] = load_quiz_statuses(user)
+    return cache[user.id]
+
+
+def get_quiz_status(quiz, user):
+    ''' Get the QuizStatus of a quiz for a user. '''
+    return get_quiz_statuses(user).get(quiz.id, NO_STATUS)
+
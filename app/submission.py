@@ -0,0 +1,199 @@
+from collections import namedtuple
+from datetime import datetime, timezone
+from flask import current_app
+from sqlalchemy import select, insert, update
+from sqlalchemy.exc import IntegrityError
+
+from . import db
+from .models import Response, QuizResult, QuizAttempt
+from .packing import MAX_OPTION, pack_answers, unpack_answers
+from .stats import record_result_delta
+from .leaderboards import record_score, remove_score
+
+
+# The outcome of a quiz submission
+Submission = namedtuple('Submission', ['result_id', 'score', 'total'])
+
+
+def check_options(answers):
+    ''' Raise ValueError if a selected option of the answers is not between 1 and MAX_OPTION, which no
+        question has and which would not fit in the packed answers. '''
+    wrong = sorted(question_id for question_id, option in answers.items() if not 1 <= option <= MAX_OPTION)
+    if wrong:
+        raise ValueError(f'the selected options of questions {wrong} must be between 1 and {MAX_OPTION}')
+
+
+def parse_answers(form, answer_key):
+    ''' Read the selected option of every question of the answer key from the submitted form.
+        Raises ValueError if a question is not answered or the answer is not an option number. '''
+    answers = {}
+    for question_id in answer_key:
+        value = form.get(f'question_{question_id}')
+        if value is None:
+            raise ValueError(f'question {question_id} is not answered')
+        answers[question_id] = int(value)
+    check_options(answers)
+    return answers
+
+
+def parse_json_answers(answers, answer_key):
+    ''' Read the answers of a JSON submission, an object of question id -> selected option.
+        Raises ValueError if a question is not answered, is not part of the quiz or the answer is not an
+        option number. '''
+    if not isinstance(answers, dict):
+        raise ValueError('answers must be an object of question id -> selected option')
+    try:
+        answers = {int(question_id): int(option) for question_id, option in answers.items()}
+    except (TypeError, ValueError):
+        raise ValueError('question ids and selected options must be numbers')
+    if set(answers) != set(answer_key):
+        raise ValueError('every question of the quiz, and only them, must be answered')
+    check_options(answers)
+    return answers
+
+
+def score_answers(answers, answer_key):
+    ''' Score the answers against the answer key.
+        Returns the rows to insert in the response table (without the result id) and the score. '''
+    rows = []
+    score = 0
+    for question_id, selected_option in answers.items():
+        is_correct = selected_option == answer_key[question_id]
+        rows.append({
+            'question_id': question_id,
+            'selected_option': selected_option,
+            'is_correct': is_correct,
+        })
+        if is_correct:
+            score += 1
+    return rows, score
+
+
+def find_result(user_id, quiz_id, session=None):
+    ''' Get the (id, score, latest_attempt_id, best_score) of the result of a user for a quiz, None if there
+        is none. The row stays locked until the end of the transaction. '''
+    return (session or db.session).execute(
+        select(QuizResult.id, QuizResult.score, QuizResult.latest_attempt_id, QuizAttempt.score)
+        .outerjoin(QuizAttempt, QuizAttempt.id == QuizResult.best_attempt_id)
+        .where(QuizResult.user_id == user_id, QuizResult.quiz_id == quiz_id)
+        .with_for_update(of=QuizResult)
+    ).first()
+
+
+def load_response_rows(attempt_id, session=None):
+    ''' Load the responses of an attempt as dicts with question_id, selected_option and is_correct,
+        from its packed answers or from its response rows. '''
+    session = session or db.session
+    packed = session.execute(
+        select(QuizAttempt.packed_answers, QuizAttempt.correct_bitmap).where(QuizAttempt.id == attempt_id)
+    ).first()
+    if packed is not None and packed.packed_answers is not None:
+        return unpack_answers(*packed)
+    rows = session.execute(
+        select(Response.question_id, Response.selected_option, Response.is_correct)
+        .where(Response.attempt_id == attempt_id)
+    )
+    return [row._asdict() for row in rows]
+
+
+def create_attempt(user_id, quiz_id, session=None):
+    ''' Insert the attempt of a quiz submitted at once, it is finished as soon as it is created.
+        Its answers are the responses of the submission, they are not copied in the attempt. '''
+    session = session or db.session
+    now = datetime.now(timezone.utc)
+    attempt = QuizAttempt(user_id=user_id, quiz_id=quiz_id, answers={}, started_at=now, finished_at=now)
+    session.add(attempt)
+    session.flush()
+    return attempt.id
+
+
+def create_result(user_id, quiz_id, score, attempt_id, session=None):
+    ''' Insert the first result of a user for a quiz, the database generates its id.
+        Returns None if a concurrent submission created it first (the unique constraint on
+        user_id and quiz_id makes the second insert fail). '''
+    session = session or db.session
+    quiz_result = QuizResult(
+        score=score, user_id=user_id, quiz_id=quiz_id, latest_attempt_id=attempt_id, best_attempt_id=attempt_id
+    )
+    try:
+        with session.begin_nested():
+            session.add(quiz_result)
+    except IntegrityError:
+        return None
+    return quiz_result.id
+
+
+def submit_quiz(user_id, quiz_id, answers, answer_key, session=None, category_id=None, attempt_id=None):
+    ''' Score and store a quiz submission (see store_submission), then put the score on the leaderboards
+        of the quiz and of its category_id. Returns the Submission. '''
+    submission, previous_score = store_submission(user_id, quiz_id, answers, answer_key, session, attempt_id)
+    record_score(user_id, quiz_id, category_id, submission.score, previous_score)
+    return submission
+
+
+def store_submission(user_id, quiz_id, answers, answer_key, session=None, attempt_id=None):
+    ''' Score and store a quiz submission in a single transaction, as a new attempt (or the finished
+        attempt_id): its responses are written with one bulk insert, the QuizResult is created or moved to
+        the attempt, and the stats are updated. With RESPONSE_STORAGE = 'packed', the responses are packed in
+        the attempt row instead of inserted. The responses of the previous attempts are kept, only their
+        contribution to the stats is replaced (see compact_attempts for their retention).
+        Only the database is written: returns the Submission and the score of the result it replaced (None
+        for a first result), for the leaderboards. session defaults to db.session, the async views pass the
+        session of their async engine. '''
+    session = session or db.session
+    rows, score = score_answers(answers, answer_key)
+    previous_score = None
+    try:
+        if attempt_id is None:
+            attempt_id = create_attempt(user_id, quiz_id, session)
+        previous = find_result(user_id, quiz_id, session)
+        if previous is None:
+            result_id = create_result(user_id, quiz_id, score, attempt_id, session)
+            if result_id is None:
+                previous = find_result(user_id, quiz_id, session)
+
+        if previous is None:
+            record_result_delta(quiz_id, 1, 1, score, added_rows=rows, session=session)
+        else:
+            # the previous attempt stops being the current one
+            result_id, previous_score, latest_attempt_id, best_score = previous
+            previous_rows = load_response_rows(latest_attempt_id, session) if latest_attempt_id else []
+            record_result_delta(
+                quiz_id, 0, 1, score - previous_score, added_rows=rows, removed_rows=previous_rows,
+                session=session
+            )
+            values = {'score': score, 'latest_attempt_id': attempt_id}
+            if best_score is None or score > best_score:
+                values['best_attempt_id'] = attempt_id
+            session.execute(update(QuizResult).where(QuizResult.id == result_id).values(**values))
+
+        attempt_values = {'score': score, 'quiz_result_id': result_id}
+        if current_app.config['RESPONSE_STORAGE'] == 'packed':
+            attempt_values['packed_answers'], attempt_values['correct_bitmap'] = pack_answers(rows)
+            rows = []
+        session.execute(update(QuizAttempt).where(QuizAttempt.id == attempt_id).values(**attempt_values))
+        if rows:
+            for row in rows:
+                row.update(user_id=user_id, quiz_id=quiz_id, quiz_result_id=result_id, attempt_id=attempt_id)
+            session.execute(insert(Response), rows)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    return Submission(result_id, score, len(answer_key)), previous_score
+
+
+def remove_result(quiz_result):
+    ''' Delete a quiz result with the responses of all its attempts, and remove its contribution to the
+        stats and leaderboards. The attempts are kept, without their responses. '''
+    user_id, quiz_id, score = quiz_result.user_id, quiz_result.quiz_id, quiz_result.score
+    category_id = quiz_result.quiz.category_id
+    try:
+        removed_rows = load_response_rows(quiz_result.latest_attempt_id) if quiz_result.latest_attempt_id else []
+        record_result_delta(quiz_result.quiz_id, -1, 0, -quiz_result.score, removed_rows=removed_rows)
+        db.session.delete(quiz_result)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    remove_score(user_id, quiz_id, category_id, score)
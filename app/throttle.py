@@ -0,0 +1,42 @@
+from flask import current_app, request
+
+from .cache import get_cache
+from .metrics import registry
+
+
+THROTTLED_REQUESTS = registry.counter(
+    'auth_throttled_requests_total', 'Logins and sign ups refused before hashing a password.', ['reason']
+)
+
+
+def client_key():
+    # behind a proxy, remote_addr is the address of the proxy unless the app is wrapped in werkzeug's ProxyFix
+    return f'auth:ip:{request.remote_addr}'
+
+
+def account_key(email):
+    return f'auth:account:{email.strip().lower()}'
+
+
+def auth_throttled(email=None):
+    ''' Count an attempt to log in or sign up from the client, and tell if the client, or the account
+        of `email` (its failed logins), went over its limit for the current AUTH_THROTTLE_WINDOW.
+        Checked before hashing anything, so a burst of attempts costs a counter each. '''
+    config = current_app.config
+    cache = get_cache()
+    if cache.incr(client_key(), config['AUTH_THROTTLE_WINDOW']) > config['AUTH_ATTEMPTS_PER_IP']:
+        THROTTLED_REQUESTS.inc(reason='ip')
+        return True
+    if email and cache.get_counter(account_key(email)) >= config['AUTH_FAILURES_PER_ACCOUNT']:
+        THROTTLED_REQUESTS.inc(reason='account')
+        return True
+    return False
+
+
+def record_login(email, success):
+    ''' Count a failed login of an account, a successful one clears its failures. '''
+    cache = get_cache()
+    if success:
+        cache.reset_counter(account_key(email))
+    else:
+        cache.incr(account_key(email), current_app.config['AUTH_THROTTLE_WINDOW'])
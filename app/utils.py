@@ -1,7 +1,9 @@
 from functools import wraps
-from flask import abort
+from flask import abort, current_app, g, request
 from flask_login import current_user
 
+from .replicas import recently_wrote
+
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -9,3 +11,14 @@ def admin_required(f):
             abort(403)  # Forbidden
         return f(*args, **kwargs)
     return decorated_function
+
+
+def read_only(f):
+    ''' Let the GET requests of a view read from a replica (see replicas.RoutingSession),
+        unless the user wrote something less than REPLICA_LAG_WINDOW seconds ago. '''
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if request.method in ('GET', 'HEAD'):
+            g.read_only = not recently_wrote(current_app.config['REPLICA_LAG_WINDOW'])
+        return f(*args, **kwargs)
+    return decorated_function
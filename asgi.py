@@ -0,0 +1,6 @@
+from app.asgi import create_asgi_app
+from config import get_config
+
+
+# Serve the app with an ASGI server, e.g. uvicorn asgi:app --workers 4
+app = create_asgi_app(get_config())
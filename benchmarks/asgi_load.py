@@ -0,0 +1,180 @@
+''' Load test of the WSGI (gunicorn) and ASGI (uvicorn) modes with the same number of workers.
+
+    Both servers are started from the root of the repository with the configuration of the
+    environment (.env), one after the other, and the same mix of requests is sent to each:
+    the home page, a quiz page, a quiz result and, optionally, quiz submissions.
+
+    Usage: python -m benchmarks.asgi_load --email user@example.com --password secret --quiz-id 1 \
+               --workers 4 --concurrency 64 --duration 20 [--submit-ratio 0.1]
+'''
+import argparse
+import http.client
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+from http.cookies import SimpleCookie
+from pathlib import Path
+from urllib.parse import urlencode
+
+ROOT = Path(__file__).resolve().parent.parent
+
+SERVERS = {
+    'wsgi': lambda workers, port: [
+        sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--bind', f'127.0.0.1:{port}',
+        '--log-level', 'warning', 'manage:app'
+    ],
+    'asgi': lambda workers, port: [
+        sys.executable, '-m', 'uvicorn', '--workers', str(workers), '--host', '127.0.0.1', '--port', str(port),
+        '--log-level', 'warning', '--no-access-log', 'asgi:app'
+    ],
+}
+
+CSRF_TOKEN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+QUESTION = re.compile(r'name="question_(\d+)"')
+
+
+class Client:
+    ''' A keep-alive HTTP connection with its cookies. '''
+
+    def __init__(self, port, cookies=None):
+        self.connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        self.cookies = dict(cookies or {})
+
+    def request(self, method, path, data=None):
+        headers = {'Cookie': '; '.join(f'{name}={value}' for name, value in self.cookies.items())}
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        try:
+            self.connection.request(method, path, body, headers)
+            response = self.connection.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            # sync workers close the connection after each response
+            self.connection.close()
+            self.connection.request(method, path, body, headers)
+            response = self.connection.getresponse()
+        text = response.read().decode()
+        for header in response.headers.get_all('Set-Cookie') or []:
+            for name, morsel in SimpleCookie(header).items():
+                self.cookies[name] = morsel.value
+        return response.status, response.headers, text
+
+
+def wait_for(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'the server did not start on port {port}')
+
+
+def prepare(port, args):
+    ''' Log in, submit the quiz once so that a result exists, and collect what the load needs. '''
+    client = Client(port)
+    status, headers, text = client.request('GET', '/login')
+    data = {'email': args.email, 'password': args.password}
+    token = CSRF_TOKEN.search(text)
+    if token:
+        data['csrf_token'] = token.group(1)
+    client.request('POST', '/login', data)
+    if 'session' not in client.cookies:
+        raise RuntimeError('login failed')
+
+    status, headers, text = client.request('GET', f'/quiz/{args.quiz_id}')
+    answers = {f'question_{question_id}': '1' for question_id in set(QUESTION.findall(text))}
+    token = CSRF_TOKEN.search(text)
+    if token:
+        answers['csrf_token'] = token.group(1)
+    status, headers, text = client.request('POST', f'/quiz/{args.quiz_id}', answers)
+    result_path = headers.get('Location', '/').replace(f'http://127.0.0.1:{port}', '')
+    return client.cookies, answers, ['/', f'/quiz/{args.quiz_id}', result_path]
+
+
+def run_load(port, args):
+    cookies, answers, paths = prepare(port, args)
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    deadline = time.time() + args.duration
+
+    def worker():
+        client = Client(port, cookies)
+        local_latencies = []
+        local_errors = 0
+        while time.time() < deadline:
+            start = time.perf_counter()
+            try:
+                if random.random() < args.submit_ratio:
+                    status, _, _ = client.request('POST', f'/quiz/{args.quiz_id}', answers)
+                else:
+                    status, _, _ = client.request('GET', random.choice(paths))
+                if status >= 400:
+                    local_errors += 1
+            except (OSError, http.client.HTTPException):
+                local_errors += 1
+                client = Client(port, client.cookies)
+            local_latencies.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local_latencies)
+            errors.append(local_errors)
+
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0
+
+    return {
+        'requests': len(latencies),
+        'errors': sum(errors),
+        'rps': len(latencies) / elapsed,
+        'p50': percentile(0.50),
+        'p95': percentile(0.95),
+        'p99': percentile(0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the requests/sec of the WSGI and ASGI modes.')
+    parser.add_argument('--email', required=True)
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--quiz-id', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--submit-ratio', type=float, default=0.0)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--mode', choices=['both', *SERVERS], default='both')
+    args = parser.parse_args()
+
+    modes = list(SERVERS) if args.mode == 'both' else [args.mode]
+    print(f'{"mode":<6}{"requests":>10}{"errors":>8}{"req/s":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}')
+    for mode in modes:
+        server = subprocess.Popen(SERVERS[mode](args.workers, args.port), cwd=ROOT)
+        try:
+            wait_for(args.port)
+            report = run_load(args.port, args)
+        finally:
+            server.terminate()
+            server.wait()
+        print(f'{mode:<6}{report["requests"]:>10}{report["errors"]:>8}{report["rps"]:>10.1f}'
+              f'{report["p50"]:>10.1f}{report["p95"]:>10.1f}{report["p99"]:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+''' Benchmark the main routes with the Flask test client on a synthetic dataset (see benchmarks/seed.py).
+
+    Usage: python -m benchmarks.run [--database-uri URI] [--seed --users N ...] [--requests 200]
+               [--save baseline.json] [--compare baseline.json [--tolerance 0.2]]
+
+    For each scenario, reports the latency percentiles, the SQL statements per request and the throughput
+    of a single client. --save stores the results as a JSON baseline, --compare compares them with a
+    baseline and exits with 1 if a scenario got slower than the tolerance or runs more statements.
+'''
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+from sqlalchemy import event, select
+
+from app import create_app, db
+from app.cache import get_quiz_snapshot
+from app.leaderboards import rebuild_leaderboards
+from app.models import QuizResult, User
+from benchmarks.seed import ADMIN_EMAIL, PASSWORD, add_arguments, benchmark_config, seed, user_email
+
+
+class StatementCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+def login(client, email):
+    response = client.post('/login', data={'email': email, 'password': PASSWORD})
+    if response.status_code != 302:
+        raise SystemExit(f'cannot log in as {email}, is the database seeded?')
+
+
+def scenarios(app):
+    ''' The (name, client, method, path, data) of each scenario. '''
+    with app.app_context():
+        user_id = db.session.execute(select(User.id).where(User.email == user_email(1))).scalar()
+        result = db.session.execute(
+            select(QuizResult.id, QuizResult.quiz_id).where(QuizResult.user_id == user_id).limit(1)
+        ).first()
+        quiz_id = result.quiz_id if result else 1
+        answers = {f'question_{question_id}': str(option)
+                   for question_id, option in get_quiz_snapshot(quiz_id).answer_key.items()}
+
+    anonymous = app.test_client()
+    user = app.test_client()
+    login(user, user_email(1))
+    admin = app.test_client()
+    login(admin, ADMIN_EMAIL)
+
+    yield 'home (anonymous)', anonymous, 'GET', '/', None
+    yield 'home', user, 'GET', '/', None
+    yield 'quiz', user, 'GET', f'/quiz/{quiz_id}', None
+    yield 'submit quiz', user, 'POST', f'/quiz/{quiz_id}', answers
+    if result:
+        yield 'quiz result', user, 'GET', f'/quiz_result/{result.id}', None
+    yield 'profile', user, 'GET', '/profile', None
+    yield 'quiz leaderboard', user, 'GET', f'/leaderboard/quiz/{quiz_id}', None
+    yield 'api quizzes', anonymous, 'GET', '/api/v1/quizzes', None
+    yield 'admin dashboard', admin, 'GET', '/dashboard', None
+    yield 'admin questions', admin, 'GET', '/admin/questions', None
+    yield 'admin quiz stats', admin, 'GET', f'/admin/quiz_stats/{quiz_id}', None
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(app, requests, warmup):
+    counter = StatementCounter()
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', counter)
+    results = {}
+    for name, client, method, path, data in scenarios(app):
+        for _ in range(warmup):
+            client.open(path, method=method, data=data)
+        latencies = []
+        statements = []
+        started = time.perf_counter()
+        for _ in range(requests):
+            counter.count = 0
+            start = time.perf_counter()
+            response = client.open(path, method=method, data=data)
+            latencies.append((time.perf_counter() - start) * 1000)
+            statements.append(counter.count)
+            if response.status_code >= 400:
+                raise SystemExit(f'{name}: {method} {path} answered {response.status_code}')
+        elapsed = time.perf_counter() - started
+        results[name] = {
+            'p50_ms': round(percentile(latencies, 0.50), 3),
+            'p95_ms': round(percentile(latencies, 0.95), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+            'mean_ms': round(statistics.fmean(latencies), 3),
+            'queries': round(statistics.fmean(statements), 2),
+            'throughput_rps': round(requests / elapsed, 1),
+        }
+    return results
+
+
+def print_results(results, baseline=None):
+    print(f'{"scenario":<20}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"queries":>9}{"req/s":>10}')
+    for name, result in results.items():
+        line = (f'{name:<20}{result["p50_ms"]:>10.2f}{result["p95_ms"]:>10.2f}{result["p99_ms"]:>10.2f}'
+                f'{result["queries"]:>9.1f}{result["throughput_rps"]:>10.1f}')
+        if baseline and name in baseline:
+            before = baseline[name]
+            change = (result['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0
+            line += f'   p95 {change:+.0f}%, queries {result["queries"] - before["queries"]:+.1f}'
+        print(line)
+
+
+def regressions(results, baseline, tolerance):
+    ''' The scenarios slower than the baseline by more than the tolerance, or running more statements. '''
+    found = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if result['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            found.append(f'{name}: p95 {before["p95_ms"]}ms -> {result["p95_ms"]}ms')
+        if result['queries'] > before['queries']:
+            found.append(f'{name}: {before["queries"]} -> {result["queries"]} queries per request')
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the main routes.')
+    add_arguments(parser)
+    parser.add_argument('--seed', action='store_true', help='(re)create the synthetic dataset first')
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--warmup', type=int, default=10, help='requests per scenario before measuring')
+    parser.add_argument('--save', help='store the results as a JSON baseline in this file')
+    parser.add_argument('--compare', help='compare the results with the JSON baseline of this file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p95 slowdown (0.2 is 20%%)')
+    args = parser.parse_args()
+
+    app = create_app(benchmark_config(args.database_uri))
+    if args.seed:
+        seed(app, args.users, args.categories, args.quizzes, args.questions, args.results, reset=True)
+    else:
+        # the local cache backend starts empty in every process
+        with app.app_context():
+            rebuild_leaderboards()
+    results = run(app, args.requests, args.warmup)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)['results']
+    print_results(results, baseline)
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump({
+                'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'database': app.config['SQLALCHEMY_DATABASE_URI'].split(':', 1)[0],
+                'dataset': {name: getattr(args, name) for name in ('users', 'categories', 'quizzes', 'questions', 'results')},
+                'requests': args.requests,
+                'results': results,
+            }, file, indent=2)
+        print(f'baseline saved to {args.save}')
+
+    if baseline is not None:
+        found = regressions(results, baseline, args.tolerance)
+        for regression in found:
+            print(f'regression: {regression}')
+        sys.exit(1 if found else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+''' Seed a database with a synthetic dataset of a given size, for the benchmarks.
+
+    Usage: python -m benchmarks.seed --database-uri sqlite:////tmp/quiz_bench.db \
+               [--users 1000] [--categories 10] [--quizzes 200] [--questions 20] [--results 5000] [--reset]
+
+    The rows are generated from a fixed random seed, so two runs with the same sizes give the same data.
+    Every user has the password "password", admin@example.com is an admin.
+'''
+import argparse
+import random
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import insert, update, text
+from werkzeug.security import generate_password_hash
+
+from app import create_app, db
+from app.models import (
+    User, Category, Quiz, Question, QuizResult, QuizAttempt, Response, QuizStats, QuestionStats,
+    QuestionOptionStats
+)
+from app.leaderboards import rebuild_leaderboards
+from config import TestingConfig
+
+
+PASSWORD = 'password'
+ADMIN_EMAIL = 'admin@example.com'
+NUMBER_OF_OPTIONS = 4
+BATCH_SIZE = 5000
+SUBMITTED_AT = datetime(2024, 1, 1)
+
+
+def benchmark_config(database_uri):
+    class BenchmarkConfig(TestingConfig):
+        SECRET_KEY = 'benchmark'
+        SQLALCHEMY_DATABASE_URI = database_uri
+        METRICS_ENABLED = False
+        PROFILING_ENABLED = False
+        SQLALCHEMY_REPLICA_URIS = None
+    return BenchmarkConfig
+
+
+def user_email(number):
+    return f'user{number}@example.com'
+
+
+def insert_rows(model, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(insert(model), rows[start:start + BATCH_SIZE])
+
+
+def generate(users, categories, quizzes, questions, results, seed=0, password_method='scrypt'):
+    ''' Generate the rows of every table, as dicts with their ids, with stats matching the results. '''
+    rng = random.Random(seed)
+    # hashing is slow on purpose, every user gets the same hash
+    password = generate_password_hash(PASSWORD, password_method)
+    rows = {model: [] for model in (
+        User, Category, Quiz, Question, QuizResult, QuizAttempt, Response, QuizStats, QuestionStats,
+        QuestionOptionStats
+    )}
+
+    rows[User].append({'id': 1, 'username': 'admin', 'email': ADMIN_EMAIL, 'password': password, 'is_admin': True})
+    for number in range(1, users + 1):
+        rows[User].append({
+            'id': number + 1, 'username': f'user{number}', 'email': user_email(number),
+            'password': password, 'is_admin': False,
+        })
+    for number in range(1, categories + 1):
+        rows[Category].append({'id': number, 'name': f'Category {number}'})
+
+    answer_keys = {}
+    for quiz_id in range(1, quizzes + 1):
+        rows[Quiz].append({
+            'id': quiz_id, 'title': f'Quiz {quiz_id}', 'description': f'Synthetic quiz number {quiz_id}.',
+            'category_id': rng.randint(1, categories), 'total_questions': questions,
+        })
+        answer_keys[quiz_id] = {}
+        for number in range(questions):
+            question_id = (quiz_id - 1) * questions + number + 1
+            correct_option = rng.randint(1, NUMBER_OF_OPTIONS)
+            answer_keys[quiz_id][question_id] = correct_option
+            rows[Question].append({
+                'id': question_id, 'text': f'Question {number + 1} of quiz {quiz_id}?',
+                'options': [f'Option {option}' for option in range(1, NUMBER_OF_OPTIONS + 1)],
+                'correct_option': correct_option, 'quiz_id': quiz_id,
+            })
+
+    # one result per (user, quiz), like the unique constraint of quiz_result
+    pairs = rng.sample(range(users * quizzes), min(results, users * quizzes)) if users and quizzes else []
+    submissions = Counter()
+    total_score = Counter()
+    answered = Counter()
+    correct = Counter()
+    selected = Counter()
+    response_id = 0
+    for result_id, pair in enumerate(sorted(pairs), start=1):
+        user_id, quiz_id = pair // quizzes + 2, pair % quizzes + 1
+        score = 0
+        for question_id, correct_option in answer_keys[quiz_id].items():
+            selected_option = rng.randint(1, NUMBER_OF_OPTIONS)
+            is_correct = selected_option == correct_option
+            score += is_correct
+            response_id += 1
+            rows[Response].append({
+                'id': response_id, 'user_id': user_id, 'quiz_id': quiz_id, 'question_id': question_id,
+                'quiz_result_id': result_id, 'attempt_id': result_id, 'selected_option': selected_option,
+                'is_correct': is_correct,
+            })
+            answered[question_id] += 1
+            correct[question_id] += is_correct
+            selected[question_id, selected_option] += 1
+        # each result has a single attempt, with the same id; seed() points the result to it
+        rows[QuizResult].append({'id': result_id, 'user_id': user_id, 'quiz_id': quiz_id, 'score': score})
+        rows[QuizAttempt].append({
+            'id': result_id, 'user_id': user_id, 'quiz_id': quiz_id, 'answers': {}, 'started_at': SUBMITTED_AT,
+            'finished_at': SUBMITTED_AT, 'score': score, 'quiz_result_id': result_id,
+        })
+        submissions[quiz_id] += 1
+        total_score[quiz_id] += score
+
+    for quiz_id in answer_keys:
+        rows[QuizStats].append({
+            'quiz_id': quiz_id, 'attempts': submissions[quiz_id], 'submissions': submissions[quiz_id],
+            'total_score': total_score[quiz_id],
+        })
+        for question_id in answer_keys[quiz_id]:
+            rows[QuestionStats].append({
+                'question_id': question_id, 'answered': answered[question_id], 'correct': correct[question_id],
+            })
+            for option in range(1, NUMBER_OF_OPTIONS + 1):
+                rows[QuestionOptionStats].append({
+                    'question_id': question_id, 'option_number': option,
+                    'selected_count': selected[question_id, option],
+                })
+    return rows
+
+
+def seed(app, users=1000, categories=10, quizzes=200, questions=20, results=5000, reset=False, random_seed=0):
+    ''' Create the tables and insert the synthetic dataset, the database must be empty unless reset is set. '''
+    with app.app_context():
+        if reset:
+            db.drop_all()
+        db.create_all()
+        if db.session.query(User.id).first() is not None:
+            raise SystemExit('the database is not empty, use --reset to replace its content')
+        rows = generate(
+            users, categories, quizzes, questions, results, random_seed, app.config['PASSWORD_HASH_METHOD']
+        )
+        for model, model_rows in rows.items():
+            insert_rows(model, model_rows)
+        # the results and attempts reference each other, the results are inserted first
+        db.session.execute(update(QuizResult).values(
+            latest_attempt_id=QuizResult.id, best_attempt_id=QuizResult.id
+        ))
+        if db.engine.dialect.name == 'postgresql':
+            # the ids were given explicitly, move the sequences after them
+            for model in (User, Category, Quiz, Question, QuizResult, QuizAttempt, Response):
+                table = db.engine.dialect.identifier_preparer.quote(model.__tablename__)
+                db.session.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE(MAX(id), 1)) FROM {table}"
+                ))
+        db.session.commit()
+        rebuild_leaderboards()
+        return {model.__tablename__: len(model_rows) for model, model_rows in rows.items()}
+
+
+def add_arguments(parser):
+    parser.add_argument('--database-uri', default='sqlite:////tmp/quiz_bench.db')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--categories', type=int, default=10)
+    parser.add_argument('--quizzes', type=int, default=200)
+    parser.add_argument('--questions', type=int, default=20)
+    parser.add_argument('--results', type=int, default=5000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Seed a database with a synthetic dataset.')
+    add_arguments(parser)
+    parser.add_argument('--reset', action='store_true', help='drop the tables first')
+    args = parser.parse_args()
+    app = create_app(benchmark_config(args.database_uri))
+    counts = seed(app, args.users, args.categories, args.quizzes, args.questions, args.results, args.reset)
+    for table, count in counts.items():
+        print(f'{table:<24}{count:>10}')
+
+
+if __name__ == '__main__':
+    main()
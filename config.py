@@ -7,3 +7,127 @@ class Config:
     SECRET_KEY = getenv('SECRET_KEY')
     SQLALCHEMY_DATABASE_URI = getenv('SQLALCHEMY_DATABASE_URI')
     DEBUG = getenv('DEBUG') == 'True'
+    # cache shared by the workers: 'local' (per process), 'sqlite' (CACHE_URL is a file path) or 'redis' (CACHE_URL is a redis:// url)
+    CACHE_BACKEND = getenv('CACHE_BACKEND', 'local')
+    CACHE_URL = getenv('CACHE_URL')
+    CACHE_DEFAULT_TTL = int(getenv('CACHE_DEFAULT_TTL', 86400))
+    CACHE_LOCAL_SIZE = int(getenv('CACHE_LOCAL_SIZE', 1024))
+    # seconds the user of a session is cached, the cache is also cleared when the user changes
+    SESSION_USER_TTL = int(getenv('SESSION_USER_TTL', 300))
+    # werkzeug method hashing the passwords, the users are rehashed on their next login when it changes
+    PASSWORD_HASH_METHOD = getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    # processes of each worker hashing the passwords (0 hashes in the request), and hashes waiting for them
+    # beyond which the logins are refused with a 503
+    PASSWORD_HASH_WORKERS = int(getenv('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_QUEUE = int(getenv('PASSWORD_HASH_QUEUE', 8))
+    # logins and sign ups allowed per ip address, and failed logins per account, every AUTH_THROTTLE_WINDOW seconds
+    AUTH_ATTEMPTS_PER_IP = int(getenv('AUTH_ATTEMPTS_PER_IP', 30))
+    AUTH_FAILURES_PER_ACCOUNT = int(getenv('AUTH_FAILURES_PER_ACCOUNT', 10))
+    AUTH_THROTTLE_WINDOW = int(getenv('AUTH_THROTTLE_WINDOW', 300))
+    # seconds an API token (POST /api/v1/tokens) is valid
+    API_TOKEN_TTL = int(getenv('API_TOKEN_TTL', 7 * 86400))
+    # questions on each page of a quiz attempt, the longer quizzes are answered page by page
+    ATTEMPT_PAGE_SIZE = int(getenv('ATTEMPT_PAGE_SIZE', 10))
+    # users shown on the leaderboards
+    LEADERBOARD_SIZE = int(getenv('LEADERBOARD_SIZE', 10))
+    # page sizes of the list views
+    QUIZZES_PER_PAGE = int(getenv('QUIZZES_PER_PAGE', 20))
+    CATEGORIES_PER_PAGE = int(getenv('CATEGORIES_PER_PAGE', 50))
+    QUESTIONS_PER_PAGE = int(getenv('QUESTIONS_PER_PAGE', 50))
+    # number of rows fetched at once by the exports
+    EXPORT_BATCH_SIZE = int(getenv('EXPORT_BATCH_SIZE', 1000))
+    # number of questions inserted at once by the imports
+    IMPORT_BATCH_SIZE = int(getenv('IMPORT_BATCH_SIZE', 1000))
+    # 'rows' stores a response row per answer, 'packed' the answers of a submission in its attempt row
+    RESPONSE_STORAGE = getenv('RESPONSE_STORAGE', 'rows')
+    # days after which the responses of the previous attempts are archived, and the archived attempts
+    # deleted (0 keeps them), by `flask compact-attempts`; attempts archived or deleted at once
+    ATTEMPT_ARCHIVE_DAYS = int(getenv('ATTEMPT_ARCHIVE_DAYS', 30))
+    ATTEMPT_RETENTION_DAYS = int(getenv('ATTEMPT_RETENTION_DAYS', 0))
+    COMPACTION_BATCH_SIZE = int(getenv('COMPACTION_BATCH_SIZE', 1000))
+    # number of responses checked at once when a quiz is rescored
+    RESCORE_BATCH_SIZE = int(getenv('RESCORE_BATCH_SIZE', 50000))
+    # async (ASGI) mode, see asgi.py: the database uri defaults to SQLALCHEMY_DATABASE_URI with an async driver
+    ASYNC_DATABASE_URI = getenv('ASYNC_DATABASE_URI')
+    ASYNC_POOL_SIZE = int(getenv('ASYNC_POOL_SIZE', 10))
+    ASYNC_MAX_OVERFLOW = int(getenv('ASYNC_MAX_OVERFLOW', 20))
+    # threads serving the routes without an async view
+    ASYNC_WSGI_THREADS = int(getenv('ASYNC_WSGI_THREADS', 10))
+    # database engine, see app/database.py: the defaults are the ones of SQLAlchemy
+    DB_POOL_SIZE = int(getenv('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(getenv('DB_MAX_OVERFLOW', 10))
+    # seconds to wait for a connection when the pool is saturated
+    DB_POOL_TIMEOUT = int(getenv('DB_POOL_TIMEOUT', 30))
+    # seconds after which a connection is replaced, -1 to keep them
+    DB_POOL_RECYCLE = int(getenv('DB_POOL_RECYCLE', -1))
+    DB_POOL_PRE_PING = getenv('DB_POOL_PRE_PING', 'False') == 'True'
+    # milliseconds after which the database stops a statement (PostgreSQL, and SELECT on MySQL), 0 for no limit
+    DB_STATEMENT_TIMEOUT = int(getenv('DB_STATEMENT_TIMEOUT', 0))
+    SQLITE_WAL = getenv('SQLITE_WAL', 'True') == 'True'
+    # seconds a SQLite connection waits for the lock of the database file
+    SQLITE_BUSY_TIMEOUT = float(getenv('SQLITE_BUSY_TIMEOUT', 5))
+    # serve the metrics at /metrics, with a bearer token if METRICS_TOKEN is set
+    METRICS_ENABLED = getenv('METRICS_ENABLED', 'False') == 'True'
+    METRICS_TOKEN = getenv('METRICS_TOKEN')
+    # profile every request (see app/profiling.py), the results are in the metrics
+    PROFILING_ENABLED = getenv('PROFILING_ENABLED', 'False') == 'True'
+    # requests slower than PROFILING_SLOW_REQUEST seconds are logged, PROFILING_SLOW_SAMPLE_RATE of them
+    PROFILING_SLOW_REQUEST = float(getenv('PROFILING_SLOW_REQUEST', 0.5))
+    PROFILING_SLOW_SAMPLE_RATE = float(getenv('PROFILING_SLOW_SAMPLE_RATE', 0.1))
+    # a statement run this many times by a request is reported as a N+1 query
+    PROFILING_DUPLICATE_THRESHOLD = int(getenv('PROFILING_DUPLICATE_THRESHOLD', 3))
+    # read replicas (comma separated uris) serving the read-only views, see app/replicas.py
+    SQLALCHEMY_REPLICA_URIS = getenv('SQLALCHEMY_REPLICA_URIS')
+    # seconds during which a user who wrote reads from the primary, above the replication lag
+    REPLICA_LAG_WINDOW = float(getenv('REPLICA_LAG_WINDOW', 5))
+
+
+# Configuration profiles, chosen with the APP_ENV environment variable (see get_config)
+# the environment variables still override their defaults
+
+class DevelopmentConfig(Config):
+    DEBUG = getenv('DEBUG', 'True') == 'True'
+    DB_POOL_SIZE = int(getenv('DB_POOL_SIZE', 2))
+    DB_MAX_OVERFLOW = int(getenv('DB_MAX_OVERFLOW', 5))
+    METRICS_ENABLED = getenv('METRICS_ENABLED', 'True') == 'True'
+    PROFILING_ENABLED = getenv('PROFILING_ENABLED', 'True') == 'True'
+    PROFILING_SLOW_SAMPLE_RATE = float(getenv('PROFILING_SLOW_SAMPLE_RATE', 1))
+
+
+class TestingConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    SQLALCHEMY_DATABASE_URI = getenv('TEST_DATABASE_URI', 'sqlite://')
+    CACHE_BACKEND = 'local'
+    # fast hashes, in the request
+    PASSWORD_HASH_METHOD = getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:1000')
+    PASSWORD_HASH_WORKERS = int(getenv('PASSWORD_HASH_WORKERS', 0))
+
+
+class ProductionConfig(Config):
+    # the workers share the cache, a file of the host by default (redis for several hosts), 'local' is refused
+    CACHE_BACKEND = getenv('CACHE_BACKEND', 'sqlite')
+    CACHE_REQUIRE_SHARED = True
+    # sized for the workers of one host: workers * (pool size + overflow) must stay under the server's max connections
+    DB_POOL_SIZE = int(getenv('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(getenv('DB_MAX_OVERFLOW', 10))
+    # fail fast instead of piling up requests when the pool is exhausted
+    DB_POOL_TIMEOUT = int(getenv('DB_POOL_TIMEOUT', 10))
+    # below the idle timeouts of the servers and proxies
+    DB_POOL_RECYCLE = int(getenv('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = getenv('DB_POOL_PRE_PING', 'True') == 'True'
+    DB_STATEMENT_TIMEOUT = int(getenv('DB_STATEMENT_TIMEOUT', 30000))
+    METRICS_ENABLED = getenv('METRICS_ENABLED', 'True') == 'True'
+
+
+configs = {
+    'default': Config,
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+    'production': ProductionConfig,
+}
+
+
+def get_config(name=None):
+    ''' Get a configuration profile, by default the one named by APP_ENV ('default' if it is not set). '''
+    return configs[name or getenv('APP_ENV', 'default')]
@@ -1,5 +1,5 @@
 from app import create_app
-from config import Config
+from config import get_config
 
 
 # # Config example: in config.py file create a class Config: and add the following code with your secret key and database URI
@@ -9,7 +9,8 @@ from config import Config
 #     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
 
-app = create_app(Config)
+# the configuration profile is chosen with APP_ENV: development, testing or production
+app = create_app(get_config())
 
 if __name__ == '__main__':
     app.run()
@@ -0,0 +1,62 @@
+"""Add indexes for the hot lookups and a unique quiz_result per user and quiz
+
+Revision ID: 7c3e9a1d54b2
+Revises: 5f2d027cd8bc
+Create Date: 2026-10-18 10:12:41.218734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c3e9a1d54b2'
+down_revision = '5f2d027cd8bc'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # a user may have several results for a quiz in an older database: they are not deleted here, the
+    # cleanup (`flask dedupe-results`, see the README) reports the results it removes
+    duplicates = op.get_bind().execute(sa.text(
+        'SELECT COUNT(*) FROM quiz_result WHERE id NOT IN ('
+        ' SELECT MAX(id) FROM quiz_result GROUP BY user_id, quiz_id)'
+    )).scalar()
+    if duplicates:
+        raise RuntimeError(
+            f'{duplicates} quiz results are not the latest result of their user and quiz, run '
+            '`flask --app manage dedupe-results --report FILE` before upgrading'
+        )
+
+    with op.batch_alter_table('quiz_result', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_quiz_result_user_id_quiz_id', ['user_id', 'quiz_id'])
+
+    with op.batch_alter_table('response', schema=None) as batch_op:
+        batch_op.create_index('ix_response_quiz_id_user_id', ['quiz_id', 'user_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_response_quiz_result_id'), ['quiz_result_id'], unique=False)
+
+    with op.batch_alter_table('question', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_question_quiz_id'), ['quiz_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_question_text'), ['text'], unique=False)
+
+    with op.batch_alter_table('quiz', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_quiz_title'), ['title'], unique=False)
+
+    # user.email is already indexed by its unique constraint
+
+
+def downgrade():
+    with op.batch_alter_table('quiz', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_quiz_title'))
+
+    with op.batch_alter_table('question', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_question_text'))
+        batch_op.drop_index(batch_op.f('ix_question_quiz_id'))
+
+    with op.batch_alter_table('response', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_response_quiz_result_id'))
+        batch_op.drop_index('ix_response_quiz_id_user_id')
+
+    with op.batch_alter_table('quiz_result', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_quiz_result_user_id_quiz_id', type_='unique')
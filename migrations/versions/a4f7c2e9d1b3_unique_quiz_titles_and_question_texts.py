@@ -0,0 +1,54 @@
+"""Make the quiz titles and the question texts unique
+
+Revision ID: a4f7c2e9d1b3
+Revises: c8e3f1b6a2d7
+Create Date: 2026-10-19 09:26:51.604117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4f7c2e9d1b3'
+down_revision = 'c8e3f1b6a2d7'
+branch_labels = None
+depends_on = None
+
+# repeated values shown in the error
+SHOWN_DUPLICATES = 5
+
+
+def repeated(table, column):
+    return op.get_bind().execute(sa.text(
+        f'SELECT {column}, COUNT(*) FROM {table} GROUP BY {column} HAVING COUNT(*) > 1 ORDER BY {column}'
+    )).all()
+
+
+def upgrade():
+    # the repeated titles and texts of an older database are not renamed here, the admins choose the new names
+    duplicates = [('quiz titles', repeated('quiz', 'title')), ('question texts', repeated('question', 'text'))]
+    if any(values for _, values in duplicates):
+        raise RuntimeError('rename the repeated ' + ' and '.join(
+            f'{name} ({", ".join(f"{value!r} x{count}" for value, count in values[:SHOWN_DUPLICATES])}'
+            f'{", ..." if len(values) > SHOWN_DUPLICATES else ""})'
+            for name, values in duplicates if values
+        ) + ' before upgrading')
+
+    with op.batch_alter_table('question', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_question_text'))
+        batch_op.create_index(batch_op.f('ix_question_text'), ['text'], unique=True)
+
+    with op.batch_alter_table('quiz', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_quiz_title'))
+        batch_op.create_index(batch_op.f('ix_quiz_title'), ['title'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('quiz', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_quiz_title'))
+        batch_op.create_index(batch_op.f('ix_quiz_title'), ['title'], unique=False)
+
+    with op.batch_alter_table('question', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_question_text'))
+        batch_op.create_index(batch_op.f('ix_question_text'), ['text'], unique=False)
@@ -0,0 +1,26 @@
+"""Add the token version of the users
+
+Revision ID: b6d1e8f3a5c2
+Revises: a4f7c2e9d1b3
+Create Date: 2026-10-18 11:02:14.873395
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6d1e8f3a5c2'
+down_revision = 'a4f7c2e9d1b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('token_version', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('token_version')
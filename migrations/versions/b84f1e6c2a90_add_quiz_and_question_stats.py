@@ -0,0 +1,85 @@
+"""Add the quiz and question stats tables
+
+Revision ID: b84f1e6c2a90
+Revises: 7c3e9a1d54b2
+Create Date: 2026-10-18 11:03:27.540196
+
+"""
+import json
+from collections import defaultdict
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b84f1e6c2a90'
+down_revision = '7c3e9a1d54b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('quiz_stats',
+    sa.Column('quiz_id', sa.Integer(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('submissions', sa.Integer(), nullable=False),
+    sa.Column('total_score', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['quiz_id'], ['quiz.id'], ),
+    sa.PrimaryKeyConstraint('quiz_id')
+    )
+    op.create_table('question_stats',
+    sa.Column('question_id', sa.Integer(), nullable=False),
+    sa.Column('answered', sa.Integer(), nullable=False),
+    sa.Column('correct', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['question_id'], ['question.id'], ),
+    sa.PrimaryKeyConstraint('question_id')
+    )
+    op.create_table('question_option_stats',
+    sa.Column('question_id', sa.Integer(), nullable=False),
+    sa.Column('option_number', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('selected_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['question_id'], ['question.id'], ),
+    sa.PrimaryKeyConstraint('question_id', 'option_number')
+    )
+
+    # compute the stats of the existing results once, the submissions keep them up to date afterwards
+    op.execute(
+        'INSERT INTO quiz_stats (quiz_id, attempts, submissions, total_score) '
+        'SELECT quiz.id, COUNT(quiz_result.id), COUNT(quiz_result.id), COALESCE(SUM(quiz_result.score), 0) '
+        'FROM quiz LEFT JOIN quiz_result ON quiz_result.quiz_id = quiz.id GROUP BY quiz.id'
+    )
+    op.execute(
+        'INSERT INTO question_stats (question_id, answered, correct) '
+        'SELECT question.id, COUNT(response.id), '
+        'COALESCE(SUM(CASE WHEN response.is_correct THEN 1 ELSE 0 END), 0) '
+        'FROM question LEFT JOIN response ON response.question_id = question.id GROUP BY question.id'
+    )
+    # a row per stored option of each question, and per other option selected by a response
+    connection = op.get_bind()
+    selected = {
+        (question_id, option): count for question_id, option, count in connection.execute(sa.text(
+            'SELECT question_id, selected_option, COUNT(*) FROM response GROUP BY question_id, selected_option'
+        ))
+    }
+    numbers = defaultdict(set)
+    for question_id, option in selected:
+        numbers[question_id].add(option)
+    option_numbers = {}
+    for question_id, options in connection.execute(sa.text('SELECT id, options FROM question')):
+        options = json.loads(options) if isinstance(options, str) else options
+        option_numbers[question_id] = numbers[question_id] | set(range(1, len(options or ()) + 1))
+    option_stats = sa.table(
+        'question_option_stats', sa.column('question_id'), sa.column('option_number'), sa.column('selected_count')
+    )
+    rows = [
+        {'question_id': question_id, 'option_number': option, 'selected_count': selected.get((question_id, option), 0)}
+        for question_id, options in option_numbers.items() for option in sorted(options)
+    ]
+    if rows:
+        op.bulk_insert(option_stats, rows)
+
+
+def downgrade():
+    op.drop_table('question_option_stats')
+    op.drop_table('question_stats')
+    op.drop_table('quiz_stats')
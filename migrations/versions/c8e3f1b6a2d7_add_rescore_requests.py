@@ -0,0 +1,28 @@
+"""Add the rescore requests of the quizzes
+
+Revision ID: c8e3f1b6a2d7
+Revises: f1a4c8e2b937
+Create Date: 2026-10-18 21:40:37.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c8e3f1b6a2d7'
+down_revision = 'f1a4c8e2b937'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('quiz', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('rescore_requested_at', sa.DateTime(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_quiz_rescore_requested_at'), ['rescore_requested_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('quiz', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_quiz_rescore_requested_at'))
+        batch_op.drop_column('rescore_requested_at')
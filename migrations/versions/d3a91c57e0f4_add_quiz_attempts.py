@@ -0,0 +1,42 @@
+"""Add the quiz attempts, answered incrementally
+
+Revision ID: d3a91c57e0f4
+Revises: b84f1e6c2a90
+Create Date: 2026-10-18 15:21:09.361452
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3a91c57e0f4'
+down_revision = 'b84f1e6c2a90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('quiz_attempt',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('quiz_id', sa.Integer(), nullable=False),
+    sa.Column('answers', sa.JSON(), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=False),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.Column('score', sa.Integer(), nullable=True),
+    sa.Column('quiz_result_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['quiz_id'], ['quiz.id'], ),
+    sa.ForeignKeyConstraint(['quiz_result_id'], ['quiz_result.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('quiz_attempt', schema=None) as batch_op:
+        batch_op.create_index('ix_quiz_attempt_user_id_quiz_id', ['user_id', 'quiz_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('quiz_attempt', schema=None) as batch_op:
+        batch_op.drop_index('ix_quiz_attempt_user_id_quiz_id')
+
+    op.drop_table('quiz_attempt')
@@ -0,0 +1,74 @@
+"""Keep the attempt history, the results point to their latest and best attempts
+
+Revision ID: e5b7c2d8f316
+Revises: d3a91c57e0f4
+Create Date: 2026-10-18 16:02:44.918203
+
+"""
+from datetime import datetime, timezone
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b7c2d8f316'
+down_revision = 'd3a91c57e0f4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('quiz_attempt', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('archived_at', sa.DateTime(), nullable=True))
+
+    with op.batch_alter_table('response', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('attempt_id', sa.Integer(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_response_attempt_id'), ['attempt_id'], unique=False)
+        batch_op.create_foreign_key('fk_response_attempt_id', 'quiz_attempt', ['attempt_id'], ['id'])
+
+    with op.batch_alter_table('quiz_result', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('latest_attempt_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('best_attempt_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_quiz_result_latest_attempt_id', 'quiz_attempt',
+                                    ['latest_attempt_id'], ['id'], ondelete='SET NULL')
+        batch_op.create_foreign_key('fk_quiz_result_best_attempt_id', 'quiz_attempt',
+                                    ['best_attempt_id'], ['id'], ondelete='SET NULL')
+
+    # the current responses of each result become its first attempt
+    connection = op.get_bind()
+    now = datetime.now(timezone.utc)
+    connection.execute(sa.text(
+        "INSERT INTO quiz_attempt (user_id, quiz_id, answers, started_at, finished_at, score, quiz_result_id) "
+        "SELECT user_id, quiz_id, '{}', :now, :now, score, id FROM quiz_result"
+    ).bindparams(sa.bindparam('now', now, type_=sa.DateTime())))
+    connection.execute(sa.text(
+        "UPDATE quiz_result SET latest_attempt_id = (SELECT MAX(quiz_attempt.id) FROM quiz_attempt "
+        "WHERE quiz_attempt.quiz_result_id = quiz_result.id)"
+    ))
+    connection.execute(sa.text("UPDATE quiz_result SET best_attempt_id = latest_attempt_id"))
+    connection.execute(sa.text(
+        "UPDATE response SET attempt_id = (SELECT quiz_result.latest_attempt_id FROM quiz_result "
+        "WHERE quiz_result.id = response.quiz_result_id)"
+    ))
+
+
+def downgrade():
+    # only the responses of the latest attempts are kept
+    op.get_bind().execute(sa.text(
+        "DELETE FROM response WHERE attempt_id IS NULL OR attempt_id NOT IN "
+        "(SELECT latest_attempt_id FROM quiz_result WHERE latest_attempt_id IS NOT NULL)"
+    ))
+
+    with op.batch_alter_table('quiz_result', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_quiz_result_best_attempt_id', type_='foreignkey')
+        batch_op.drop_constraint('fk_quiz_result_latest_attempt_id', type_='foreignkey')
+        batch_op.drop_column('best_attempt_id')
+        batch_op.drop_column('latest_attempt_id')
+
+    with op.batch_alter_table('response', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_response_attempt_id', type_='foreignkey')
+        batch_op.drop_index(batch_op.f('ix_response_attempt_id'))
+        batch_op.drop_column('attempt_id')
+
+    with op.batch_alter_table('quiz_attempt', schema=None) as batch_op:
+        batch_op.drop_column('archived_at')
@@ -0,0 +1,55 @@
+"""Add the packed answers of the attempts
+
+Revision ID: f1a4c8e2b937
+Revises: e5b7c2d8f316
+Create Date: 2026-10-18 17:12:05.274618
+
+"""
+import struct
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1a4c8e2b937'
+down_revision = 'e5b7c2d8f316'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the response rows are moved into them by `flask pack-responses`
+    with op.batch_alter_table('quiz_attempt', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('packed_answers', sa.LargeBinary(), nullable=True))
+        batch_op.add_column(sa.Column('correct_bitmap', sa.LargeBinary(), nullable=True))
+
+
+def downgrade():
+    # the packed answers go back to response rows, see app/packing.py for their format
+    connection = op.get_bind()
+    response = sa.table(
+        'response', sa.column('user_id'), sa.column('quiz_id'), sa.column('question_id'),
+        sa.column('selected_option'), sa.column('is_correct'), sa.column('quiz_result_id'), sa.column('attempt_id')
+    )
+    attempts = connection.execute(sa.text(
+        "SELECT id, user_id, quiz_id, quiz_result_id, packed_answers, correct_bitmap FROM quiz_attempt "
+        "WHERE packed_answers IS NOT NULL AND quiz_result_id IS NOT NULL"
+    )).all()
+    # the answers to the questions deleted since then are left out
+    question_ids = set(connection.execute(sa.text("SELECT id FROM question")).scalars())
+    for attempt_id, user_id, quiz_id, quiz_result_id, packed_answers, correct_bitmap in attempts:
+        count = len(packed_answers) // 5
+        values = struct.unpack(f'<{count}I{count}B', packed_answers)
+        bits = int.from_bytes(correct_bitmap, 'little')
+        rows = [
+            {'user_id': user_id, 'quiz_id': quiz_id, 'question_id': values[index],
+             'selected_option': values[count + index], 'is_correct': bool(bits >> index & 1),
+             'quiz_result_id': quiz_result_id, 'attempt_id': attempt_id}
+            for index in range(count) if values[index] in question_ids
+        ]
+        if rows:
+            connection.execute(response.insert(), rows)
+
+    with op.batch_alter_table('quiz_attempt', schema=None) as batch_op:
+        batch_op.drop_column('correct_bitmap')
+        batch_op.drop_column('packed_answers')
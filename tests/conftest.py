@@ -0,0 +1,67 @@
+import pytest
+from werkzeug.security import generate_password_hash
+
+from app import create_app, db
+from app.models import User, Category, Quiz, Question
+from app.stats import init_quiz_stats, init_question_stats
+from config import TestingConfig
+
+
+class Config(TestingConfig):
+    SECRET_KEY = 'test'
+
+
+@pytest.fixture
+def app():
+    ''' An application on an in-memory database, created empty for each test. '''
+    app = create_app(Config)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def make_user(username='user', is_admin=False, password='password'):
+    user = User(
+        username=username, email=f'{username}@example.com', is_admin=is_admin,
+        password=generate_password_hash(password, 'pbkdf2:sha256:1000'),
+    )
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def make_quiz(title='Quiz', correct_options=(1, 2, 3, 4), category=None):
+    ''' Create a quiz with a question per correct option, each with 4 options. '''
+    if category is None:
+        category = Category.query.filter_by(name='Category').first() or Category(name='Category')
+    quiz = Quiz(title=title, description='A quiz for the tests', category=category,
+                total_questions=len(correct_options))
+    init_quiz_stats(quiz)
+    for number, correct_option in enumerate(correct_options, start=1):
+        question = Question(text=f'{title} question {number}', options=['a', 'b', 'c', 'd'],
+                            correct_option=correct_option, quiz=quiz)
+        init_question_stats(question)
+    db.session.add(quiz)
+    db.session.commit()
+    return quiz
+
+
+def answer_key(quiz):
+    return {question.id: question.correct_option for question in quiz.questions}
+
+
+def answers_with_score(quiz, score):
+    ''' Answers to a quiz with the first `score` questions right and the others wrong. '''
+    return {question.id: question.correct_option if number < score else question.correct_option % 4 + 1
+            for number, question in enumerate(sorted(quiz.questions, key=lambda question: question.id))}
+
+
+def login(client, username='user', password='password'):
+    return client.post('/login', data={'email': f'{username}@example.com', 'password': password})
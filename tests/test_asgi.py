@@ -0,0 +1,90 @@
+import asyncio
+import re
+import threading
+import pytest
+
+from app import db
+from app.asgi import AsyncApp
+from app.cache import get_cache
+from app.leaderboards import top, QUIZ
+from conftest import make_user, make_quiz
+
+
+@pytest.fixture
+def asgi_app(app, tmp_path):
+    ''' The ASGI app on a database file, shared by the sync and the async engines, with the cache in a SQLite file. '''
+    db.session.remove()
+    db.drop_all()
+    app.config['CACHE_BACKEND'] = 'sqlite'
+    app.config['CACHE_URL'] = str(tmp_path / 'cache.db')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{tmp_path / "quiz_app.db"}'
+    app.extensions.pop('sqlalchemy')
+    db.init_app(app)
+    get_cache().init_app(app)
+    db.create_all()
+    yield AsyncApp(app)
+    db.session.remove()
+    db.engine.dispose()
+
+
+class BackendThreads:
+    ''' Record the threads calling the methods of the cache backend. '''
+
+    def __init__(self, backend, monkeypatch):
+        self.threads = []
+        for name in ('get', 'set', 'incr', 'get_int', 'zadd', 'zincrby', 'zranks', 'ztop'):
+            method = getattr(backend, name)
+            monkeypatch.setattr(backend, name, self.record(method))
+
+    def record(self, method):
+        def recorded(*args, **kwargs):
+            self.threads.append(threading.current_thread())
+            return method(*args, **kwargs)
+        return recorded
+
+
+async def request(app, method, path, body=b'', cookie=None):
+    ''' Send a request to the ASGI app, returns the status, the headers and the body of the response. '''
+    headers = [(b'host', b'localhost')]
+    if body:
+        headers.append((b'content-type', b'application/x-www-form-urlencoded'))
+        headers.append((b'content-length', str(len(body)).encode()))
+    if cookie:
+        headers.append((b'cookie', cookie.encode()))
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': b'', 'headers': headers,
+             'http_version': '1.1', 'scheme': 'http', 'root_path': '', 'server': ('localhost', 80)}
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+    await app(scope, receive, send)
+    headers = {key.decode(): value.decode() for key, value in sent[0]['headers']}
+    return sent[0]['status'], headers, sent[1]['body']
+
+
+def test_async_views_call_the_cache_backend_out_of_the_event_loop(asgi_app, client, monkeypatch):
+    make_user()
+    quiz = make_quiz()
+    answers = '&'.join(f'question_{question.id}={question.correct_option}' for question in quiz.questions)
+    client.post('/login', data={'email': 'user@example.com', 'password': 'password'})
+    cookie = f'session={client.get_cookie("session").value}'
+    threads = BackendThreads(get_cache().backend, monkeypatch)
+
+    async def run():
+        loop_thread = threading.current_thread()
+        status, headers, body = await request(asgi_app, 'GET', f'/quiz/{quiz.id}', cookie=cookie)
+        assert status == 200 and b'question_' in body
+        status, headers, body = await request(asgi_app, 'POST', f'/quiz/{quiz.id}', answers.encode(), cookie)
+        assert status == 302 and re.search(r'/quiz_result/\d+', headers['location'])
+        return loop_thread
+    loop_thread = asyncio.run(run())
+
+    assert threads.threads
+    assert loop_thread not in threads.threads
+    # the score of the submission is on the leaderboard
+    with asgi_app.app.test_request_context():
+        assert [(entry.username, entry.score) for entry in top(QUIZ, quiz.id, 10)] == [('user', 4)]
@@ -0,0 +1,200 @@
+from datetime import timedelta
+from email.utils import format_datetime, parsedate_to_datetime
+import pytest
+from flask import current_app
+from werkzeug.security import generate_password_hash
+
+from app import db, passwords
+from app.api import token_serializer
+from app.cache import invalidate_quizzes
+from app.models import QuizResult, User
+from app.passwords import method_parameters, store_rehash
+from conftest import make_user, make_quiz, login
+
+
+@pytest.fixture
+def quiz(app):
+    make_user()
+    return make_quiz()
+
+
+def answers(quiz):
+    return {'answers': {str(question.id): question.correct_option for question in quiz.questions}}
+
+
+def get_token(client, password='password'):
+    return client.post('/api/v1/tokens', json={'email': 'user@example.com', 'password': password})
+
+
+def test_token_authenticates_the_api_writes(client, quiz):
+    response = get_token(client)
+    assert response.status_code == 201
+    token = response.get_json()['token']
+
+    # no cookie of the site is needed
+    client.delete_cookie('session')
+    response = client.post(f'/api/v1/quizzes/{quiz.id}/submit', json=answers(quiz),
+                           headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 201
+    assert response.get_json()['score'] == 4
+    response = client.get('/api/v1/results', headers={'Authorization': f'Bearer {token}'})
+    assert [result['score'] for result in response.get_json()] == [4]
+
+
+def test_invalid_credentials_and_tokens_are_refused(client, quiz):
+    assert get_token(client, password='wrong').status_code == 401
+    assert client.post('/api/v1/tokens', json={'email': 'user@example.com'}).status_code == 400
+    response = client.post(f'/api/v1/quizzes/{quiz.id}/submit', json=answers(quiz),
+                           headers={'Authorization': 'Bearer forged'})
+    assert response.status_code == 401
+    assert QuizResult.query.count() == 0
+
+
+def test_expired_token_is_refused(app, client, quiz):
+    token = get_token(client).get_json()['token']
+    app.config['API_TOKEN_TTL'] = -1
+    response = client.get('/api/v1/results', headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 401
+
+
+def test_cookie_writes_need_the_csrf_token(app, client, quiz):
+    login(client)
+    app.config['WTF_CSRF_ENABLED'] = True
+
+    response = client.post(f'/api/v1/quizzes/{quiz.id}/submit', json=answers(quiz))
+    assert response.status_code == 400
+    assert QuizResult.query.count() == 0
+
+    csrf_token = client.get('/api/v1/csrf-token').get_json()['csrf_token']
+    response = client.post(f'/api/v1/quizzes/{quiz.id}/submit', json=answers(quiz),
+                           headers={'X-CSRFToken': csrf_token})
+    assert response.status_code == 201
+    # the reads don't need it
+    assert client.get('/api/v1/results').status_code == 200
+
+
+def bearer(token):
+    return {'Authorization': f'Bearer {token}'}
+
+
+def test_a_new_password_revokes_the_tokens(client, quiz):
+    token = get_token(client).get_json()['token']
+    user = User.query.filter_by(username='user').one()
+
+    # a rehash keeps the password, and the tokens
+    store_rehash(current_app._get_current_object(), user.id, user.password, user.password + 'rehashed')
+    assert client.get('/api/v1/results', headers=bearer(token)).status_code == 200
+
+    user = db.session.get(User, user.id)
+    user.password = generate_password_hash('new password', 'pbkdf2:sha256:1000')
+    db.session.commit()
+    assert client.get('/api/v1/results', headers=bearer(token)).status_code == 401
+    token = get_token(client, 'new password').get_json()['token']
+    assert client.get('/api/v1/results', headers=bearer(token)).status_code == 200
+
+    db.session.delete(db.session.get(User, user.id))
+    db.session.commit()
+    assert client.get('/api/v1/results', headers=bearer(token)).status_code == 401
+
+
+def test_tokens_of_the_older_format_are_refused(app, client, quiz):
+    with app.test_request_context():
+        token = token_serializer().dumps(1)
+    assert client.get('/api/v1/results', headers=bearer(token)).status_code == 401
+
+
+def test_conditional_gets_are_answered_without_the_content(client, quiz):
+    response = client.get(f'/api/v1/quizzes/{quiz.id}')
+    assert response.status_code == 200 and response.get_json()['title'] == 'Quiz'
+    etag, last_modified = response.headers['ETag'], response.headers.get('Last-Modified')
+    assert response.headers['Cache-Control'] == 'no-cache'
+
+    response = client.get(f'/api/v1/quizzes/{quiz.id}', headers={'If-None-Match': etag})
+    assert response.status_code == 304 and response.data == b''
+    assert response.headers['ETag'] == etag
+    # another url has another etag
+    assert client.get('/api/v1/quizzes', headers={'If-None-Match': etag}).status_code == 200
+
+    quiz.title = 'Renamed'
+    db.session.commit()
+    invalidate_quizzes(quiz.id)
+    response = client.get(f'/api/v1/quizzes/{quiz.id}', headers={'If-None-Match': etag})
+    assert response.status_code == 200 and response.get_json()['title'] == 'Renamed'
+    assert response.headers['ETag'] != etag and response.headers['Last-Modified']
+    if last_modified:
+        assert parsedate_to_datetime(response.headers['Last-Modified']) >= parsedate_to_datetime(last_modified)
+
+    last_modified = response.headers['Last-Modified']
+    response = client.get(f'/api/v1/quizzes/{quiz.id}', headers={'If-Modified-Since': last_modified})
+    assert response.status_code == 304
+    response = client.get(f'/api/v1/quizzes/{quiz.id}', headers={
+        'If-Modified-Since': format_datetime(parsedate_to_datetime(last_modified) - timedelta(seconds=1), usegmt=True)
+    })
+    assert response.status_code == 200
+
+
+def test_missing_content_is_not_cached(client, quiz):
+    response = client.get('/api/v1/quizzes/12345')
+    assert response.status_code == 404 and 'ETag' not in response.headers
+
+
+def test_failed_logins_lock_the_account(app, client, quiz):
+    app.config['AUTH_FAILURES_PER_ACCOUNT'] = 3
+    for attempt in range(3):
+        assert get_token(client, password='wrong').status_code == 401
+    # even with the right password, and the login page shares the counter
+    assert get_token(client).status_code == 429
+    assert login(client).status_code == 429
+    # the other accounts are not locked
+    make_user('other')
+    response = client.post('/api/v1/tokens', json={'email': 'other@example.com', 'password': 'password'})
+    assert response.status_code == 201
+
+
+def test_a_successful_login_resets_the_failures(app, client, quiz):
+    app.config['AUTH_FAILURES_PER_ACCOUNT'] = 3
+    for attempt in range(2):
+        assert get_token(client, password='wrong').status_code == 401
+    assert login(client).status_code == 302
+    for attempt in range(2):
+        assert login(client, password='wrong').status_code == 200
+    assert get_token(client).status_code == 201
+
+
+def test_the_attempts_of_a_client_are_limited(app, client, quiz):
+    app.config['AUTH_ATTEMPTS_PER_IP'] = 2
+    assert get_token(client).status_code == 201
+    assert login(client, 'nobody').status_code == 200
+    assert get_token(client).status_code == 429
+
+
+def test_unknown_emails_are_checked_against_a_hash(client, quiz, monkeypatch):
+    checked = []
+
+    def check_password_hash(password_hash, password):
+        checked.append(password_hash)
+        return False
+    monkeypatch.setattr(passwords, 'check_password_hash', check_password_hash)
+    assert login(client, 'nobody').status_code == 200
+    assert client.post('/api/v1/tokens', json={'email': 'nobody@example.com', 'password': 'x'}).status_code == 401
+    assert len(checked) == 2 and checked[0] == checked[1]
+    assert checked[0].startswith(method_parameters(current_app.config['PASSWORD_HASH_METHOD']) + '$')
+
+
+def test_a_login_rehashes_a_password_of_other_parameters(app, client, quiz):
+    token = get_token(client).get_json()['token']
+    password_hash = User.query.filter_by(username='user').one().password
+    assert login(client).status_code == 302
+    # the parameters didn't change
+    db.session.expire_all()
+    assert User.query.filter_by(username='user').one().password == password_hash
+
+    app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:2000'
+    assert login(client).status_code == 302
+    db.session.expire_all()
+    user = User.query.filter_by(username='user').one()
+    assert user.password.startswith('pbkdf2:sha256:2000$')
+    assert user.token_version == 0
+    assert client.get('/api/v1/results', headers=bearer(token)).status_code == 200
+    client.get('/logout')
+    assert login(client).status_code == 302
@@ -0,0 +1,102 @@
+import io
+import json
+import pytest
+
+from app import db
+from app.importer import read_questions, import_questions
+from app.models import Quiz, Question, QuestionStats, QuestionOptionStats
+from conftest import make_user, make_quiz, login
+
+
+@pytest.fixture
+def quiz(app):
+    return make_quiz()
+
+
+def question(text, **quiz):
+    return {'text': text, 'options': ['a', 'b', 'c', 'd'], 'correct_option': 2, **quiz}
+
+
+def read(rows):
+    return read_questions(io.BytesIO(json.dumps(rows).encode()), 'questions.json')
+
+
+def test_a_valid_file_is_imported_with_its_stats(quiz):
+    stream = io.BytesIO(
+        'quiz_id,quiz_title,text,option_1,option_2,option_3,option_4,correct_option\n'
+        f'{quiz.id},,First imported question,a,b,c,d,1\n'
+        ',Quiz,Second imported question,a,b,c,d,4\n'.encode()
+    )
+    assert import_questions(read_questions(stream, 'questions.CSV'), batch_size=1) == (2, [])
+
+    imported = Question.query.filter(Question.text.like('%imported%')).order_by(Question.id).all()
+    assert [(question.quiz_id, question.correct_option) for question in imported] == [(quiz.id, 1), (quiz.id, 4)]
+    assert db.session.get(Quiz, quiz.id).total_questions == 6
+    for question_row in imported:
+        assert db.session.get(QuestionStats, question_row.id).answered == 0
+        assert QuestionOptionStats.query.filter_by(question_id=question_row.id).count() == 4
+
+
+def test_invalid_rows_are_rejected_one_by_one(quiz):
+    rows = read([
+        question('A valid question', quiz_id=quiz.id),
+        question('Unhashable title', quiz_title=['Quiz']),
+        question('Unhashable id', quiz_id={'id': quiz.id}),
+        question('Fractional id', quiz_id=1.5),
+        question('Unknown quiz', quiz_title='Nope'),
+        question('Repeated in the file', quiz_id=str(quiz.id)),
+        question('Repeated in the file', quiz_id=quiz.id),
+        question(quiz.questions[0].text, quiz_id=quiz.id),
+        {**question('Wrong option', quiz_id=quiz.id), 'correct_option': 5},
+        {**question('Boolean option', quiz_id=quiz.id), 'correct_option': True},
+        {**question('Three options', quiz_id=quiz.id), 'options': ['a', 'b', 'c']},
+        question('No quiz'),
+        'not an object',
+    ])
+    report = import_questions(rows)
+
+    assert report.imported == 2
+    assert report.errors == [
+        (2, 'the quiz_title must be a text'),
+        (3, 'the quiz_id must be a number'),
+        (4, 'the quiz_id must be a number'),
+        (5, 'the quiz does not exist'),
+        (7, 'the question is duplicated in the file'),
+        (8, 'question already exist'),
+        (9, 'the correct option must be between 1 and 4'),
+        (10, 'the correct option must be a number'),
+        (11, 'a question must have 4 options'),
+        (12, 'the quiz_id or the quiz_title is required'),
+        (13, 'the text must be between 5 and 500 characters'),
+    ]
+    assert {question.text for question in Question.query.filter_by(quiz_id=quiz.id)} >= \
+        {'A valid question', 'Repeated in the file'}
+
+
+def test_a_dry_run_imports_nothing(quiz):
+    rows = read([question('Checked only', quiz_title='Quiz'), question('No quiz given')])
+    report = import_questions(rows, dry_run=True)
+    assert report == (1, [(2, 'the quiz_id or the quiz_title is required')])
+    assert Question.query.filter_by(text='Checked only').count() == 0
+    assert db.session.get(Quiz, quiz.id).total_questions == 4
+
+
+def test_unreadable_files_are_refused():
+    with pytest.raises(ValueError, match='.csv or a .json'):
+        read_questions(io.BytesIO(b''), 'questions.txt')
+    with pytest.raises(ValueError, match='list of questions'):
+        read_questions(io.BytesIO(b'{}'), 'questions.json')
+    with pytest.raises(ValueError, match="can't be read"):
+        read_questions(io.BytesIO(b'[{'), 'questions.json')
+
+
+def test_the_import_route_reports_the_rejected_rows(client, quiz):
+    make_user('admin', is_admin=True)
+    login(client, 'admin')
+    rows = [question('Imported from the route', quiz_title='Quiz'), question('Bad title', quiz_title=['x'])]
+    response = client.post('/admin/import_questions', content_type='multipart/form-data', data={
+        'file': (io.BytesIO(json.dumps(rows).encode()), 'questions.json'),
+    })
+    assert response.status_code == 200
+    assert b'1 questions imported, 1 rows rejected.' in response.data
+    assert b'Row 2: the quiz_title must be a text' in response.data
@@ -0,0 +1,142 @@
+import pytest
+
+from app import create_app, db, leaderboards
+from app.cache import get_cache
+from app.leaderboards import QUIZ, CATEGORY, top, user_ranks, rebuild_leaderboards, board_key
+from app.models import Category, QuizResult
+from app.submission import submit_quiz, remove_result
+from config import ProductionConfig
+from conftest import make_user, make_quiz, answer_key, answers_with_score, login
+
+
+@pytest.fixture(params=['local', 'sqlite'])
+def backend(request, app, tmp_path):
+    app.config['CACHE_BACKEND'] = request.param
+    app.config['CACHE_URL'] = str(tmp_path / 'cache.db')
+    get_cache().init_app(app)
+    return get_cache().backend
+
+
+@pytest.fixture
+def quizzes(backend):
+    first = make_quiz('First')
+    return first, make_quiz('Second', category=first.category)
+
+
+def submit(user, quiz, score):
+    return submit_quiz(user.id, quiz.id, answers_with_score(quiz, score), answer_key(quiz),
+                       category_id=quiz.category_id)
+
+
+def board(kind, board_id):
+    return [(entry.rank, entry.username, entry.score) for entry in top(kind, board_id, 10)]
+
+
+def flush(app, tmp_path):
+    ''' Lose every leaderboard, like a restarted worker with the local backend or a flushed server. '''
+    app.config['CACHE_URL'] = str(tmp_path / 'flushed.db')
+    get_cache().init_app(app)
+
+
+def test_scores_are_recorded_and_ties_share_a_rank(quizzes):
+    first, second = quizzes
+    ann, bob, eve = make_user('ann'), make_user('bob'), make_user('eve')
+    assert board(QUIZ, first.id) == []
+
+    submit(ann, first, 3)
+    submit(bob, first, 3)
+    submit(eve, first, 1)
+    submit(eve, second, 4)
+    assert board(QUIZ, first.id) == [(1, 'bob', 3), (1, 'ann', 3), (3, 'eve', 1)]
+    assert board(CATEGORY, first.category_id) == [(1, 'eve', 5), (2, 'bob', 3), (2, 'ann', 3)]
+    ranks = user_ranks(eve.id, [(QUIZ, first.id), (CATEGORY, first.category_id), (QUIZ, 999)])
+    assert ranks[QUIZ, first.id][:] == (3, 1, 3)
+    assert ranks[CATEGORY, first.category_id][:] == (1, 5, 3)
+    assert ranks[QUIZ, 999] is None
+
+    # a resubmission replaces the quiz score and moves the category total by the difference
+    submit(eve, first, 4)
+    assert board(QUIZ, first.id)[0] == (1, 'eve', 4)
+    assert board(CATEGORY, first.category_id)[0] == (1, 'eve', 8)
+
+
+def test_deleted_results_leave_the_leaderboards(quizzes):
+    first, second = quizzes
+    ann, bob = make_user('ann'), make_user('bob')
+    submit(ann, first, 2)
+    submit(ann, second, 1)
+    submit(bob, first, 1)
+    board(QUIZ, first.id), board(CATEGORY, first.category_id)
+
+    remove_result(QuizResult.query.filter_by(user_id=ann.id, quiz_id=first.id).one())
+    assert board(QUIZ, first.id) == [(1, 'bob', 1)]
+    assert board(CATEGORY, first.category_id) == [(1, 'bob', 1), (1, 'ann', 1)]
+
+
+def test_rebuild_matches_the_results(app, quizzes):
+    first, second = quizzes
+    ann, bob = make_user('ann'), make_user('bob')
+    submit(ann, first, 2)
+    submit(bob, first, 4)
+    submit(bob, second, 1)
+    expected = board(QUIZ, first.id), board(QUIZ, second.id), board(CATEGORY, first.category_id)
+
+    # a drift: a score which no result has
+    get_cache().backend.zadd(board_key(QUIZ, first.id), str(ann.id), 40)
+    assert rebuild_leaderboards() == (2, 1)
+    assert (board(QUIZ, first.id), board(QUIZ, second.id), board(CATEGORY, first.category_id)) == expected
+
+
+def test_missing_leaderboards_are_rebuilt_when_read(app, quizzes, tmp_path):
+    first, second = quizzes
+    ann, bob = make_user('ann'), make_user('bob')
+    submit(ann, first, 2)
+    flush(app, tmp_path)
+
+    # the scores recorded before the board is built are in the results it is built from
+    submit(bob, first, 3)
+    assert board(QUIZ, first.id) == [(1, 'bob', 3), (2, 'ann', 2)]
+    assert user_ranks(ann.id, [(CATEGORY, first.category_id)])[CATEGORY, first.category_id][:] == (2, 2, 2)
+    # then they are updated incrementally
+    submit(ann, first, 4)
+    assert board(QUIZ, first.id) == [(1, 'ann', 4), (2, 'bob', 3)]
+    assert board(CATEGORY, first.category_id) == [(1, 'ann', 4), (2, 'bob', 3)]
+
+
+def test_moved_and_deleted_quizzes_patch_the_category_leaderboards(client, quizzes, monkeypatch):
+    first, second = quizzes
+    other = Category(name='Other')
+    db.session.add(other)
+    db.session.commit()
+    ann, bob = make_user('ann'), make_user('bob')
+    submit(ann, first, 2)
+    submit(ann, second, 1)
+    submit(bob, second, 3)
+    board(CATEGORY, first.category_id), board(CATEGORY, other.id)
+
+    def rebuild(*args):
+        raise AssertionError('the leaderboards are not rebuilt')
+    monkeypatch.setattr(leaderboards, 'rebuild_boards', rebuild)
+    make_user('admin', is_admin=True)
+    login(client, 'admin')
+    response = client.post(f'/admin/update_quiz/{second.id}', data={
+        'title': second.title, 'description': second.description, 'category_id': other.id, 'total_questions': 4,
+    })
+    assert response.status_code == 302
+    # bob has no other result in the category
+    assert board(CATEGORY, first.category_id) == [(1, 'ann', 2)]
+    assert board(CATEGORY, other.id) == [(1, 'bob', 3), (2, 'ann', 1)]
+
+    assert client.get(f'/admin/delete_quiz/{second.id}').status_code == 302
+    assert board(CATEGORY, other.id) == []
+    assert get_cache().backend.ztop(board_key(QUIZ, second.id), 10) == []
+    assert board(CATEGORY, first.category_id) == [(1, 'ann', 2)]
+
+
+def test_production_refuses_the_local_backend():
+    class Production(ProductionConfig):
+        SECRET_KEY = 'test'
+        SQLALCHEMY_DATABASE_URI = 'sqlite://'
+        CACHE_BACKEND = 'local'
+    with pytest.raises(RuntimeError, match='CACHE_BACKEND'):
+        create_app(Production)
@@ -0,0 +1,120 @@
+import io
+import json
+import os
+import pytest
+from flask_migrate import upgrade, downgrade
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+from app import create_app, db
+from app.duplicates import remove_duplicate_results
+from app.models import QuizAttempt
+from app.submission import submit_quiz, load_response_rows
+from conftest import Config, make_user, make_quiz, answers_with_score, answer_key
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+
+
+@pytest.fixture
+def file_app(tmp_path):
+    ''' An application on an empty database file, its schema is made by the migrations. '''
+    class FileConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path / "quiz_app.db"}'
+    app = create_app(FileConfig)
+    with app.app_context():
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+
+def execute(statement, **params):
+    with db.engine.begin() as connection:
+        return connection.execute(text(statement), params)
+
+
+def insert_results(results):
+    ''' Insert (result id, user id, score) results of quiz 1, each with a response, in the schema of 5f2d027cd8bc. '''
+    execute("INSERT INTO user (id, username, email, password) VALUES (1, 'one', 'one@example.com', 'x'), "
+            "(2, 'two', 'two@example.com', 'x')")
+    execute("INSERT INTO category (id, name) VALUES (1, 'Category')")
+    execute("INSERT INTO quiz (id, title, description, total_questions, category_id) "
+            "VALUES (1, 'Quiz', 'A quiz', 1, 1), (2, 'Quiz', 'Same title', 1, 1)")
+    execute("INSERT INTO question (id, text, options, correct_option, quiz_id) "
+            "VALUES (1, 'Question', '[\"a\", \"b\"]', 1, 1), (2, 'Question', '[\"a\", \"b\"]', 1, 2)")
+    for result_id, user_id, score in results:
+        execute('INSERT INTO quiz_result (id, score, user_id, quiz_id) VALUES (:id, :score, :user_id, 1)',
+                id=result_id, score=score, user_id=user_id)
+        execute('INSERT INTO response (user_id, quiz_id, question_id, selected_option, is_correct, quiz_result_id) '
+                'VALUES (:user_id, 1, 1, 1, :score, :id)', id=result_id, score=score, user_id=user_id)
+
+
+def test_duplicate_results_stop_the_upgrade_until_they_are_removed(file_app):
+    upgrade(MIGRATIONS, '5f2d027cd8bc')
+    insert_results([(1, 1, 0), (2, 1, 1), (3, 2, 1)])
+
+    # flask_migrate logs the error of the migration and exits
+    with pytest.raises(SystemExit):
+        upgrade(MIGRATIONS, '7c3e9a1d54b2')
+    assert execute('SELECT COUNT(*) FROM quiz_result').scalar() == 3
+
+    report = io.StringIO()
+    with db.engine.begin() as connection:
+        assert remove_duplicate_results(connection, report, dry_run=True) == (1, 1)
+    assert execute('SELECT COUNT(*) FROM quiz_result').scalar() == 3
+    report = io.StringIO()
+    with db.engine.begin() as connection:
+        assert remove_duplicate_results(connection, report) == (1, 1)
+    removed = [json.loads(line) for line in report.getvalue().splitlines()]
+    assert [(line['table'], line['row']['id']) for line in removed][0] == ('quiz_result', 1)
+    assert removed[1]['table'] == 'response' and removed[1]['row']['quiz_result_id'] == 1
+    assert execute('SELECT id FROM quiz_result ORDER BY id').scalars().all() == [2, 3]
+
+    # the repeated quiz titles and question texts are only indexed by this migration
+    upgrade(MIGRATIONS, '7c3e9a1d54b2')
+    upgrade(MIGRATIONS, 'c8e3f1b6a2d7')
+    assert execute('SELECT COUNT(*) FROM quiz_result').scalar() == 2
+    # and have to be renamed before they are made unique
+    with pytest.raises(SystemExit):
+        upgrade(MIGRATIONS, 'a4f7c2e9d1b3')
+    execute("UPDATE quiz SET title = 'Other quiz' WHERE id = 2")
+    execute("UPDATE question SET text = 'Other question' WHERE id = 2")
+    upgrade(MIGRATIONS)
+    with pytest.raises(IntegrityError):
+        execute("UPDATE quiz SET title = 'Quiz' WHERE id = 2")
+
+
+def test_downgrade_turns_the_packed_answers_back_into_rows(file_app):
+    upgrade(MIGRATIONS)
+    user = make_user()
+    quiz = make_quiz(correct_options=(1, 2, 3, 4, 4, 3, 2, 1, 1))
+    submit_quiz(user.id, quiz.id, answers_with_score(quiz, 2), answer_key(quiz))
+    file_app.config['RESPONSE_STORAGE'] = 'packed'
+    for score in (9, 5):
+        submit_quiz(user.id, quiz.id, answers_with_score(quiz, score), answer_key(quiz))
+    attempts = {attempt.id: load_response_rows(attempt.id) for attempt in QuizAttempt.query}
+    user_id, quiz_id = user.id, quiz.id
+    db.session.remove()
+
+    downgrade(MIGRATIONS, 'e5b7c2d8f316')
+    rows = execute('SELECT attempt_id, question_id, selected_option, is_correct, user_id, quiz_id, quiz_result_id '
+                   'FROM response').all()
+    assert sorted((row[0], row[1], row[2], bool(row[3])) for row in rows) == sorted(
+        (attempt_id, row['question_id'], row['selected_option'], row['is_correct'])
+        for attempt_id, attempt_rows in attempts.items() for row in attempt_rows)
+    assert {row[4:] for row in rows} == {(user_id, quiz_id, 1)}
+    columns = [column[1] for column in execute('PRAGMA table_info(quiz_attempt)')]
+    assert 'packed_answers' not in columns and 'correct_bitmap' not in columns
+
+
+def test_option_stats_are_backfilled_from_the_stored_options(file_app):
+    upgrade(MIGRATIONS, '7c3e9a1d54b2')
+    insert_results([(1, 1, 1)])
+    execute('UPDATE question SET options = :options WHERE id = 1', options=json.dumps(['a', 'b', 'c', 'd', 'e']))
+    # an answer to an option which the question no longer has
+    execute("INSERT INTO response (user_id, quiz_id, question_id, selected_option, is_correct, quiz_result_id) "
+            "VALUES (2, 1, 2, 3, 0, 1)")
+
+    upgrade(MIGRATIONS, 'b84f1e6c2a90')
+    rows = execute('SELECT question_id, option_number, selected_count FROM question_option_stats '
+                   'ORDER BY question_id, option_number').all()
+    assert rows == [(1, 1, 1), (1, 2, 0), (1, 3, 0), (1, 4, 0), (1, 5, 0), (2, 1, 0), (2, 2, 0), (2, 3, 1)]
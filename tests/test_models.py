@@ -0,0 +1,200 @@
+import pytest
+from flask import g
+from sqlalchemy import event, inspect, text
+from sqlalchemy.engine import make_url
+
+from app import create_app, db
+import app.cache_backends as cache_backends
+from app.attempts import start_attempt
+from app.cache import get_cache, get_quiz_snapshot, get_cached_html, get_session_user, invalidate_quizzes
+from app.cache_backends import LocalBackend, SQLiteBackend
+from app.database import engine_options, statement_timeout_args
+from app.forms import QuestionForm
+from app.models import Quiz, User
+from app.profiling import SQL_STATEMENTS
+from app.replicas import use_primary
+from app.status import load_quiz_statuses, IN_PROGRESS, COMPLETED
+from app.submission import submit_quiz
+from conftest import Config, make_user, make_quiz, answer_key, answers_with_score
+
+
+class Statements:
+    ''' Count the SQL statements run on an engine. '''
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self.record)
+
+    def record(self, *args):
+        self.count += 1
+
+
+def test_quiz_statuses_are_loaded_with_two_queries(app):
+    user = make_user()
+    completed, started, resumed, untouched = (make_quiz(title) for title in ('A', 'B', 'C', 'D'))
+    submit_quiz(user.id, completed.id, answers_with_score(completed, 3), answer_key(completed))
+    start_attempt(user.id, started.id)
+    submit_quiz(user.id, resumed.id, answers_with_score(resumed, 1), answer_key(resumed))
+    start_attempt(user.id, resumed.id)
+    user = db.session.get(User, user.id)
+
+    statements = Statements(db.engine)
+    statuses = load_quiz_statuses(user)
+    assert statements.count == 2
+    assert {quiz_id: status.status for quiz_id, status in statuses.items()} == {
+        completed.id: COMPLETED, started.id: IN_PROGRESS, resumed.id: IN_PROGRESS,
+    }
+    # an attempt started again keeps the score of the result
+    assert statuses[resumed.id].score == 1 and statuses[completed.id].score == 3
+    assert set(load_quiz_statuses(user, [completed.id, untouched.id])) == {completed.id}
+
+    assert completed.is_completed_by(user) and completed.get_user_score(user) == 3
+    assert started.is_started_by(user) and not untouched.is_started_by(user)
+    assert not untouched.is_completed_by(user)
+
+
+def test_quiz_snapshots_are_cached_until_the_quiz_is_invalidated(app):
+    quiz = make_quiz()
+    question = quiz.questions[0]
+    snapshot = get_quiz_snapshot(quiz.id)
+    assert snapshot.answer_key[question.id] == 1
+    assert get_quiz_snapshot(quiz.id) is snapshot
+    with pytest.raises(TypeError):
+        snapshot.answer_key[question.id] = 2
+
+    question.correct_option = 2
+    db.session.commit()
+    assert get_quiz_snapshot(quiz.id).answer_key[question.id] == 1
+    invalidate_quizzes(quiz.id)
+    assert get_quiz_snapshot(quiz.id).answer_key[question.id] == 2
+    assert get_quiz_snapshot(12345) is None
+
+
+def test_fragments_are_rendered_once_per_generation(app):
+    renders = []
+
+    def render():
+        renders.append(1)
+        return f'<p>{len(renders)}</p>'
+    assert get_cached_html('quiz:1', 'questions', render) == '<p>1</p>'
+    assert get_cached_html('quiz:1', 'questions', render) == '<p>1</p>'
+    invalidate_quizzes(1)
+    assert get_cached_html('quiz:1', 'questions', render) == '<p>2</p>'
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.mark.parametrize('backend_class', [LocalBackend, SQLiteBackend])
+def test_cache_backends_expire_their_keys(backend_class, tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_backends, 'time', clock)
+    backend = backend_class() if backend_class is LocalBackend else backend_class(str(tmp_path / 'cache.db'))
+
+    backend.set('key', b'value', ttl=10)
+    backend.set('kept', b'value')
+    assert backend.incr('counter', ttl=10) == 1
+    assert backend.incr('counter', 2, ttl=10) == 3
+    assert backend.get('key') == b'value' and backend.get_int('counter') == 3
+
+    # the increments don't extend the ttl of a counter
+    clock.now += 11
+    assert backend.get('key') is None and backend.get_int('counter') == 0
+    assert backend.get('kept') == b'value'
+    assert backend.incr('counter', ttl=10) == 1
+    backend.delete('kept', 'counter')
+    assert backend.get('kept') is None and backend.get_int('counter') == 0
+
+
+def test_session_users_are_cached_until_the_user_changes(app):
+    user = make_user()
+    assert get_session_user(user.id).username == 'user'
+
+    # a change made outside of the session is not seen until the entry expires
+    db.session.execute(text("UPDATE user SET username = 'outside'"))
+    db.session.commit()
+    assert get_session_user(user.id).username == 'user'
+
+    user = db.session.get(User, user.id)
+    user.username = 'renamed'
+    db.session.commit()
+    assert get_session_user(user.id).username == 'renamed'
+    db.session.delete(user)
+    db.session.commit()
+    assert get_session_user(user.id) is None
+
+
+def test_engine_options_follow_the_config(app):
+    config = {**app.config, 'DB_POOL_SIZE': 3, 'DB_MAX_OVERFLOW': 4, 'DB_STATEMENT_TIMEOUT': 1000}
+    # an in-memory database has a single connection
+    assert engine_options(config, 'sqlite://') == {'connect_args': {'timeout': config['SQLITE_BUSY_TIMEOUT']}}
+
+    options = engine_options(config, 'postgresql://db/quiz', max_overflow=0)
+    assert (options['pool_size'], options['max_overflow']) == (3, 0)
+    assert options['connect_args'] == {'options': '-c statement_timeout=1000'}
+    assert statement_timeout_args(make_url('postgresql+asyncpg://db/quiz'), 1000) == \
+        {'server_settings': {'statement_timeout': '1000'}}
+    assert statement_timeout_args(make_url('mysql://db/quiz'), 1000) == \
+        {'init_command': 'SET SESSION max_execution_time=1000'}
+    assert statement_timeout_args(make_url('postgresql://db/quiz'), 0) == {}
+
+
+def test_read_only_requests_read_from_a_replica(tmp_path, monkeypatch):
+    # the bind of the replica registers its metadata on db, the next apps don't have it
+    monkeypatch.setattr(db, 'metadatas', dict(db.metadatas))
+
+    class ReplicaConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path / "primary.db"}'
+        SQLALCHEMY_REPLICA_URIS = f'sqlite:///{tmp_path / "replica.db"}'
+    app = create_app(ReplicaConfig)
+    mapper = inspect(Quiz)
+    with app.test_request_context():
+        primary, replica = db.engines[None], db.engines['replica_0']
+        assert db.session.get_bind(mapper) is primary
+        g.read_only = True
+        assert db.session.get_bind(mapper) is replica
+        with use_primary():
+            assert db.session.get_bind(mapper) is primary
+        # and once the session wrote
+        db.session.info['wrote'] = True
+        assert db.session.get_bind(mapper) is primary
+        db.session.remove()
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def test_profiled_requests_count_their_statements():
+    class ProfiledConfig(Config):
+        PROFILING_ENABLED = True
+        PROFILING_SLOW_SAMPLE_RATE = 0
+    app = create_app(ProfiledConfig)
+    with app.app_context():
+        db.create_all()
+
+    def count():
+        samples = {tuple(labels.items()): value for suffix, labels, value in SQL_STATEMENTS.samples()
+                   if suffix == '_count'}
+        return samples.get((('endpoint', 'main.login'),), 0)
+    before = count()
+    assert app.test_client().get('/login').status_code == 200
+    assert count() == before + 1
+
+
+def test_select_choices_are_loaded_when_the_field_is_used(app):
+    quiz = make_quiz()
+    with app.test_request_context():
+        form = QuestionForm(meta={'csrf': False})
+        assert form.quiz_id._choices is None
+        assert form.quiz_id.choices == [(quiz.id, 'Quiz')]
+    # they come from the cache
+    statements = Statements(db.engine)
+    with app.test_request_context():
+        assert QuestionForm(meta={'csrf': False}).quiz_id.choices == [(quiz.id, 'Quiz')]
+    assert statements.count == 0
+    assert get_cache().get('quizzes', 'choices') == [(quiz.id, 'Quiz')]
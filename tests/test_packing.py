@@ -0,0 +1,120 @@
+import json
+import random
+from datetime import datetime, timedelta, timezone
+import pytest
+
+from app.attempts import parse_saved_answers, pack_responses, compact_attempts
+from app.export import export_rows
+from app.models import QuizAttempt, QuizResult, Response
+from app.packing import ANSWER_SIZE, pack_answers, unpack_answers
+from app.results import load_result_view
+from app.submission import parse_answers, parse_json_answers, submit_quiz, load_response_rows
+from conftest import make_user, make_quiz, answer_key, answers_with_score, login
+
+
+@pytest.mark.parametrize('count', [0, 1, 7, 8, 9, 50])
+def test_pack_unpack_round_trip(count):
+    rnd = random.Random(count)
+    rows = [{'question_id': rnd.randrange(2 ** 32), 'selected_option': rnd.randint(1, 255),
+             'is_correct': rnd.random() < 0.5} for _ in range(count)]
+    rows = list({row['question_id']: row for row in rows}.values())
+
+    packed, bitmap = pack_answers(rows)
+    assert len(packed) == ANSWER_SIZE * len(rows)
+    assert len(bitmap) == (len(rows) + 7) // 8
+    assert unpack_answers(packed, bitmap) == sorted(rows, key=lambda row: row['question_id'])
+
+
+@pytest.mark.parametrize('option', [0, -1, 256, 300])
+def test_options_out_of_a_byte_are_refused(option):
+    key = {1: 1, 2: 2}
+    with pytest.raises(ValueError, match='between 1 and 255'):
+        parse_answers({'question_1': '1', 'question_2': str(option)}, key)
+    with pytest.raises(ValueError, match=r'questions \[2\]'):
+        parse_json_answers({'1': 1, '2': option}, key)
+    with pytest.raises(ValueError, match='between 1 and 255'):
+        parse_saved_answers({'2': option}, key)
+    with pytest.raises(ValueError, match='between 1 and 255'):
+        pack_answers([{'question_id': 1, 'selected_option': option, 'is_correct': False}])
+    assert parse_json_answers({'1': 1, '2': 255}, key) == {1: 1, 2: 255}
+
+
+def test_submissions_of_an_option_out_of_a_byte_are_refused(app, client):
+    app.config['RESPONSE_STORAGE'] = 'packed'
+    quiz = make_quiz()
+    make_user()
+    login(client)
+    answers = {str(question.id): 1 for question in quiz.questions}
+    answers[str(quiz.questions[0].id)] = 256
+    response = client.post(f'/api/v1/quizzes/{quiz.id}/submit', json={'answers': answers})
+    assert response.status_code == 400
+    assert QuizAttempt.query.count() == 0
+
+
+def test_stored_options_out_of_a_byte_are_kept_as_rows(app):
+    quiz = make_quiz()
+    user = make_user()
+    # stored before the submissions refused them
+    submit_quiz(user.id, quiz.id, {question.id: 300 for question in quiz.questions}, answer_key(quiz))
+    submit_quiz(user.id, quiz.id, answers_with_score(quiz, 2), answer_key(quiz))
+
+    assert pack_responses() == 1
+    assert Response.query.count() == 4
+    assert {row['selected_option'] for row in load_response_rows(QuizAttempt.query.first().id)} == {300}
+
+
+def export(kind):
+    return [json.loads(line) for chunk in export_rows(kind, 'jsonl', 2) for line in chunk.splitlines()]
+
+
+def as_answers(rows):
+    fields = ('attempt_id', 'quiz_result_id', 'user_id', 'quiz_id', 'question_id', 'selected_option', 'is_correct')
+    return sorted(tuple(row[field] for field in fields) for row in rows)
+
+
+@pytest.fixture
+def submissions(app):
+    ''' Two users with two attempts each at two quizzes, their responses stored as rows. '''
+    quizzes = [make_quiz('First'), make_quiz('Second', correct_options=(4, 3, 2, 1, 1, 2, 3, 4, 1))]
+    for user in (make_user('ann'), make_user('bob')):
+        for quiz in quizzes:
+            for score in (user.id, 2 * user.id):
+                submit_quiz(user.id, quiz.id, answers_with_score(quiz, score), answer_key(quiz))
+    return quizzes
+
+
+def test_pack_responses_keeps_the_scores_and_the_exports(submissions):
+    responses = export('responses')
+    scores = [(attempt.id, attempt.score) for attempt in QuizAttempt.query.order_by(QuizAttempt.id)]
+    result_views = [load_result_view(result.id, result.user_id) for result in QuizResult.query]
+    rows = {attempt_id: load_response_rows(attempt_id) for attempt_id, _ in scores}
+
+    assert pack_responses(batch_size=3) == len(scores)
+
+    assert Response.query.count() == 0
+    assert [(attempt.id, attempt.score) for attempt in QuizAttempt.query.order_by(QuizAttempt.id)] == scores
+    assert as_answers(export('answers')) == as_answers(responses)
+    assert export('responses') == []
+    assert [load_result_view(result.id, result.user_id) for result in QuizResult.query] == result_views
+    for attempt_id, attempt_rows in rows.items():
+        assert load_response_rows(attempt_id) == sorted(attempt_rows, key=lambda row: row['question_id'])
+
+
+def test_compact_attempts_packs_the_old_attempts_only(submissions):
+    kept = {attempt_id for result in QuizResult.query for attempt_id in (result.latest_attempt_id,
+                                                                          result.best_attempt_id)}
+    old = {attempt.id: load_response_rows(attempt.id) for attempt in QuizAttempt.query if attempt.id not in kept}
+    assert old
+    scores = {result.id: result.score for result in QuizResult.query}
+
+    tomorrow = datetime.now(timezone.utc) + timedelta(days=1)
+    assert compact_attempts(tomorrow) == (len(old), 0)
+    for attempt in QuizAttempt.query:
+        assert (attempt.archived_at is not None) == (attempt.id in old)
+        assert (attempt.packed_answers is not None) == (attempt.id in old)
+    for attempt_id, attempt_rows in old.items():
+        assert load_response_rows(attempt_id) == sorted(attempt_rows, key=lambda row: row['question_id'])
+
+    assert compact_attempts(tomorrow, tomorrow) == (0, len(old))
+    assert {attempt.id for attempt in QuizAttempt.query} == kept
+    assert {result.id: result.score for result in QuizResult.query} == scores
@@ -0,0 +1,235 @@
+import pytest
+from sqlalchemy import func, select
+
+from app import db
+from app.models import Quiz, Question, QuizAttempt, QuizResult, QuizStats, Response
+from app.pagination import keyset_paginate
+import app.submission as submission
+from app.submission import submit_quiz
+from conftest import make_user, make_quiz, answer_key, answers_with_score, login
+
+
+def count(model):
+    return db.session.execute(select(func.count()).select_from(model)).scalar()
+
+
+@pytest.fixture
+def quiz(app):
+    return make_quiz()
+
+
+@pytest.fixture
+def user(app):
+    return make_user()
+
+
+def test_first_submission_creates_a_result_and_its_responses(quiz, user):
+    result = submit_quiz(user.id, quiz.id, answers_with_score(quiz, 3), answer_key(quiz))
+
+    assert (result.score, result.total) == (3, 4)
+    quiz_result = db.session.get(QuizResult, result.result_id)
+    assert (quiz_result.user_id, quiz_result.quiz_id, quiz_result.score) == (user.id, quiz.id, 3)
+    assert count(QuizResult) == 1
+    responses = Response.query.filter_by(quiz_result_id=result.result_id).all()
+    assert len(responses) == 4
+    assert sum(response.is_correct for response in responses) == 3
+    assert {response.attempt_id for response in responses} == {quiz_result.latest_attempt_id}
+
+
+def test_resubmission_replaces_the_score(quiz, user):
+    first = submit_quiz(user.id, quiz.id, answers_with_score(quiz, 1), answer_key(quiz))
+    second = submit_quiz(user.id, quiz.id, answers_with_score(quiz, 4), answer_key(quiz))
+
+    assert second.result_id == first.result_id
+    assert count(QuizResult) == 1
+    quiz_result = db.session.get(QuizResult, first.result_id)
+    assert quiz_result.score == 4
+    # the previous attempt is kept, the result points to the new one
+    assert count(QuizAttempt) == 2
+    assert quiz_result.latest_attempt_id == quiz_result.best_attempt_id != quiz_result.attempts[0].id
+    assert Response.query.filter_by(attempt_id=quiz_result.latest_attempt_id).count() == 4
+    stats = db.session.get(QuizStats, quiz.id)
+    assert (stats.attempts, stats.submissions, stats.total_score) == (1, 2, 4)
+
+
+def test_concurrent_first_submission_updates_the_existing_result(quiz, user, monkeypatch):
+    existing = submit_quiz(user.id, quiz.id, answers_with_score(quiz, 1), answer_key(quiz))
+    find_result = submission.find_result
+    calls = []
+
+    def not_found_the_first_time(*args, **kwargs):
+        # the other submission was not committed yet when the result was looked up
+        calls.append(args)
+        return None if len(calls) == 1 else find_result(*args, **kwargs)
+    monkeypatch.setattr(submission, 'find_result', not_found_the_first_time)
+
+    result = submit_quiz(user.id, quiz.id, answers_with_score(quiz, 2), answer_key(quiz))
+
+    assert len(calls) == 2
+    assert result.result_id == existing.result_id
+    assert count(QuizResult) == 1
+    assert db.session.get(QuizResult, existing.result_id).score == 2
+    stats = db.session.get(QuizStats, quiz.id)
+    assert (stats.attempts, stats.submissions, stats.total_score) == (1, 2, 2)
+
+
+def test_failed_submission_writes_nothing(quiz, user, monkeypatch):
+    def failing_insert(table):
+        raise RuntimeError('the database went away')
+    monkeypatch.setattr(submission, 'insert', failing_insert)
+
+    with pytest.raises(RuntimeError):
+        submit_quiz(user.id, quiz.id, answers_with_score(quiz, 3), answer_key(quiz))
+
+    assert count(QuizAttempt) == count(QuizResult) == count(Response) == 0
+    stats = db.session.get(QuizStats, quiz.id)
+    assert (stats.attempts, stats.submissions, stats.total_score) == (0, 0, 0)
+
+
+def page(query_page):
+    return [item.id for item in query_page], query_page.prev_cursor, query_page.next_cursor
+
+
+def test_keyset_pages_walk_forwards_and_backwards(app):
+    quizzes = [make_quiz(f'Quiz {number}').id for number in range(5)]
+    query = Quiz.query
+
+    first = keyset_paginate(query, [Quiz.id], 2)
+    assert page(first) == (quizzes[:2], None, str(quizzes[1]))
+    second = keyset_paginate(query, [Quiz.id], 2, after=first.next_cursor)
+    assert page(second) == (quizzes[2:4], str(quizzes[2]), str(quizzes[3]))
+    last = keyset_paginate(query, [Quiz.id], 2, after=second.next_cursor)
+    assert page(last) == (quizzes[4:], str(quizzes[4]), None)
+
+    assert page(keyset_paginate(query, [Quiz.id], 2, before=last.prev_cursor)) == page(second)
+    assert page(keyset_paginate(query, [Quiz.id], 2, before=second.prev_cursor)) == page(first)
+    # past the ends
+    assert page(keyset_paginate(query, [Quiz.id], 2, after=str(quizzes[4]))) == ([], None, None)
+    assert keyset_paginate(query.filter(Quiz.id < 0), [Quiz.id], 2).items == []
+
+
+def test_keyset_pages_on_a_composite_key(app):
+    first, second = make_quiz('First', (1, 2, 3)), make_quiz('Second', (1, 2))
+    questions = [(question.quiz_id, question.id) for question in Question.query.order_by(Question.quiz_id, Question.id)]
+    columns = [Question.quiz_id, Question.id]
+
+    pages = [keyset_paginate(Question.query, columns, 2)]
+    while pages[-1].has_next:
+        pages.append(keyset_paginate(Question.query, columns, 2, after=pages[-1].next_cursor))
+    assert [(item.quiz_id, item.id) for current in pages for item in current] == questions
+    assert pages[1].prev_cursor == '.'.join(map(str, questions[2]))
+    back = keyset_paginate(Question.query, columns, 2, before=pages[2].prev_cursor)
+    assert [item.id for item in back] == [item.id for item in pages[1]]
+
+
+@pytest.mark.parametrize('cursor', ['', 'x', '1.2', '1.', '.', '1e3', str(2 ** 63), str(-2 ** 64)])
+def test_malformed_cursors_give_the_first_page(app, cursor):
+    quizzes = [make_quiz(f'Quiz {number}').id for number in range(3)]
+    assert page(keyset_paginate(Quiz.query, [Quiz.id], 2, after=cursor)) == (quizzes[:2], None, str(quizzes[1]))
+    assert page(keyset_paginate(Quiz.query, [Quiz.id], 2, before=cursor)) == (quizzes[:2], None, str(quizzes[1]))
+
+
+def test_list_views_accept_any_cursor(client, user):
+    make_quiz()
+    login(client)
+    for cursor in ('x', str(2 ** 70), '1'):
+        assert client.get(f'/?after={cursor}').status_code == 200
+        assert client.get(f'/?before={cursor}').status_code == 200
+
+
+def test_admins_cant_repeat_a_quiz_title_or_a_question_text(client, quiz):
+    make_user('admin', is_admin=True)
+    login(client, 'admin')
+    other = make_quiz('Other')
+    question = other.questions[0]
+
+    response = client.post('/admin/add_quiz', data={
+        'title': 'Quiz', 'description': 'The same title again', 'category_id': quiz.category_id,
+        'total_questions': 1,
+    })
+    assert response.get_json() == {'message': 'quiz already exist'}
+    response = client.post(f'/admin/update_quiz/{other.id}', data={
+        'title': 'Quiz', 'description': other.description, 'category_id': other.category_id, 'total_questions': 4,
+    })
+    assert response.get_json() == {'message': 'quiz already exist'}
+    assert Quiz.query.filter_by(title='Quiz').count() == 1
+
+    options = {'options-0': 'a', 'options-1': 'b', 'options-2': 'c', 'options-3': 'd'}
+    response = client.post('/admin/add_question', data={
+        'text': quiz.questions[0].text, **options, 'correct_option': 1, 'quiz_id': quiz.id,
+    })
+    assert response.get_json() == {'message': 'question already exist'}
+    response = client.post(f'/admin/update_question/{question.id}', data={
+        'text': quiz.questions[0].text, **options, 'correct_option': 1, 'quiz_id': other.id,
+    })
+    assert response.get_json() == {'message': 'question already exist'}
+    assert Question.query.filter_by(text=quiz.questions[0].text).count() == 1
+    assert db.session.get(Quiz, other.id).rescore_requested_at is None
+
+
+def attempt_id_of(response):
+    return int(response.headers['Location'].rsplit('/', 1)[1].split('?')[0])
+
+
+def test_an_open_attempt_is_resumed_with_its_answers(app, client, quiz, user):
+    app.config['ATTEMPT_PAGE_SIZE'] = 2
+    login(client)
+    questions = sorted(quiz.questions, key=lambda question: question.id)
+    attempt_id = attempt_id_of(client.get(f'/quiz/{quiz.id}/attempt'))
+    response = client.post(f'/attempt/{attempt_id}?page=1', data={
+        f'question_{questions[0].id}': 1, f'question_{questions[1].id}': 3,
+    })
+    assert response.headers['Location'].endswith(f'/attempt/{attempt_id}?page=2')
+
+    # the web pages and the API resume the same attempt
+    assert attempt_id_of(client.get(f'/quiz/{quiz.id}/attempt')) == attempt_id
+    response = client.post(f'/api/v1/quizzes/{quiz.id}/attempts')
+    assert response.get_json()['id'] == attempt_id
+    response = client.patch(f'/api/v1/attempts/{attempt_id}', json={'answers': {str(questions[1].id): 2}})
+    assert response.get_json() == {'saved': 1, 'answered': 2, 'total_questions': 4}
+    attempt = client.get(f'/api/v1/attempts/{attempt_id}').get_json()
+    assert attempt['answers'] == {str(questions[0].id): 1, str(questions[1].id): 2}
+    assert not attempt['finished']
+    assert client.get(f'/attempt/{attempt_id}?page=1').status_code == 200
+    assert count(QuizAttempt) == 1
+
+
+def test_an_attempt_is_finished_once(client, quiz, user):
+    login(client)
+    attempt_id = client.post(f'/api/v1/quizzes/{quiz.id}/attempts').get_json()['id']
+    client.patch(f'/api/v1/attempts/{attempt_id}', json={'answers': {
+        str(question.id): question.correct_option for question in quiz.questions[:3]
+    }})
+    response = client.post(f'/api/v1/attempts/{attempt_id}/finish')
+    assert response.status_code == 201 and response.get_json()['score'] == 3
+
+    assert client.post(f'/api/v1/attempts/{attempt_id}/finish').status_code == 409
+    response = client.patch(f'/api/v1/attempts/{attempt_id}', json={'answers': {str(quiz.questions[3].id): 4}})
+    assert response.status_code == 409
+    # the page of a finished attempt leads to its result, whose score didn't move
+    result = QuizResult.query.one()
+    assert client.post(f'/attempt/{attempt_id}', data={'action': 'finish'}).headers['Location'] \
+        .endswith(f'/quiz_result/{result.id}')
+    assert (result.score, result.latest_attempt_id) == (3, attempt_id)
+    assert count(QuizResult) == 1 and count(Response) == 3
+
+    # the next attempt is a new one
+    assert client.post(f'/api/v1/quizzes/{quiz.id}/attempts').get_json()['id'] != attempt_id
+
+
+def test_the_attempts_of_another_user_are_not_found(client, quiz, user):
+    login(client)
+    attempt_id = client.post(f'/api/v1/quizzes/{quiz.id}/attempts').get_json()['id']
+    client.get('/logout')
+    make_user('other')
+    login(client, 'other')
+
+    assert client.get(f'/api/v1/attempts/{attempt_id}').status_code == 404
+    response = client.patch(f'/api/v1/attempts/{attempt_id}', json={'answers': {str(quiz.questions[0].id): 1}})
+    assert response.status_code == 404
+    assert client.post(f'/api/v1/attempts/{attempt_id}/finish').status_code == 404
+    response = client.post(f'/attempt/{attempt_id}', data={'action': 'finish'})
+    assert response.headers['Location'] == '/'
+    attempt = db.session.get(QuizAttempt, attempt_id)
+    assert attempt.answers == {} and attempt.is_open
+    assert count(QuizResult) == 0
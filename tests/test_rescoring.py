@@ -0,0 +1,168 @@
+import numpy as np
+import pytest
+
+from app import db, leaderboards
+from app.leaderboards import QUIZ, CATEGORY, top
+from app.models import Quiz, Question, QuizAttempt, QuizResult, QuizStats, QuestionStats
+from app.packing import pack_answers
+from app.rescoring import check_answers, has_answers, rescore_quiz
+from app.submission import submit_quiz, load_response_rows
+from conftest import make_user, make_quiz, answer_key, login
+from test_stats import recount, stored
+
+
+def test_check_answers_keeps_the_correctness_of_unknown_questions():
+    key = np.array([10, 20, 30]), np.array([1, 2, 3])
+    question_ids = np.array([10, 20, 25, 40, 30, 5])
+    selected_options = np.array([1, 1, 2, 2, 3, 1])
+    is_correct = np.array([False, True, True, False, False, True])
+
+    assert check_answers(key, question_ids, selected_options, is_correct).tolist() == \
+        [True, False, True, False, True, True]
+    assert check_answers((np.zeros(0, np.int64), np.zeros(0, np.int64)), question_ids, selected_options,
+                         is_correct).tolist() == is_correct.tolist()
+
+
+@pytest.fixture(params=['rows', 'packed'])
+def storage(request, app):
+    app.config['RESPONSE_STORAGE'] = request.param
+    return request.param
+
+
+@pytest.fixture
+def submitted(storage):
+    ''' Ann answered all the questions right, then all but the last one; Bob only missed the last one.
+        Returns the quiz and its users. '''
+    quiz = make_quiz()
+    questions = [question.id for question in quiz.questions]
+    ann, bob = make_user('ann'), make_user('bob')
+    submit_quiz(ann.id, quiz.id, dict(zip(questions, [1, 2, 3, 4])), answer_key(quiz), category_id=quiz.category_id)
+    submit_quiz(ann.id, quiz.id, dict(zip(questions, [1, 2, 3, 1])), answer_key(quiz), category_id=quiz.category_id)
+    submit_quiz(bob.id, quiz.id, dict(zip(questions, [4, 4, 4, 1])), answer_key(quiz), category_id=quiz.category_id)
+    return quiz, ann, bob
+
+
+def change_last_answer(quiz, correct_option=1):
+    quiz.questions[-1].correct_option = correct_option
+    db.session.commit()
+
+
+def board(kind, board_id):
+    return [(entry.username, entry.score) for entry in top(kind, board_id, 10)]
+
+
+def test_rescore_moves_the_scores_the_best_attempts_and_the_stats(storage, submitted):
+    quiz, ann, bob = submitted
+    first, second = QuizAttempt.query.filter_by(user_id=ann.id).order_by(QuizAttempt.id)
+    assert db.session.get(QuizResult, first.quiz_result_id).best_attempt_id == first.id
+    assert db.session.get(QuizStats, quiz.id).total_score == 3 + 0
+
+    change_last_answer(quiz)
+    rescore = rescore_quiz(quiz.id, batch_size=2)
+    # the last answer of the three attempts
+    assert rescore == (3, 3, 2)
+
+    assert (first.score, second.score) == (3, 4)
+    ann_result = QuizResult.query.filter_by(user_id=ann.id).one()
+    assert (ann_result.score, ann_result.latest_attempt_id, ann_result.best_attempt_id) == (4, second.id, second.id)
+    assert QuizResult.query.filter_by(user_id=bob.id).one().score == 1
+    assert db.session.get(QuizStats, quiz.id).total_score == 4 + 1
+    assert stored(quiz) == recount(quiz)
+
+    key = answer_key(quiz)
+    for attempt in QuizAttempt.query:
+        rows = load_response_rows(attempt.id)
+        assert all(row['is_correct'] == (row['selected_option'] == key[row['question_id']]) for row in rows)
+        if storage == 'packed':
+            assert attempt.correct_bitmap == pack_answers(rows)[1]
+
+    # nothing changes the second time
+    assert rescore_quiz(quiz.id) == (0, 0, 0)
+    assert stored(quiz) == recount(quiz)
+
+
+def test_rescore_moves_the_built_leaderboards(submitted, monkeypatch):
+    quiz, ann, bob = submitted
+    assert board(QUIZ, quiz.id) == [('ann', 3), ('bob', 0)]
+    assert board(CATEGORY, quiz.category_id) == [('ann', 3), ('bob', 0)]
+
+    def rebuild(*args):
+        raise AssertionError('the leaderboards are not rebuilt')
+    monkeypatch.setattr(leaderboards, 'rebuild_boards', rebuild)
+    change_last_answer(quiz)
+    rescore_quiz(quiz.id)
+    assert board(QUIZ, quiz.id) == [('ann', 4), ('bob', 1)]
+    assert board(CATEGORY, quiz.category_id) == [('ann', 4), ('bob', 1)]
+
+
+def test_changing_an_answer_schedules_the_rescore(app, client, submitted):
+    quiz, ann, bob = submitted
+    question = quiz.questions[-1]
+    make_user('admin', is_admin=True)
+    login(client, 'admin')
+
+    response = client.post(f'/admin/update_question/{question.id}', data={
+        'text': question.text, 'options-0': 'a', 'options-1': 'b', 'options-2': 'c', 'options-3': 'd',
+        'correct_option': 1, 'quiz_id': quiz.id,
+    })
+    assert response.status_code == 302
+    with client.session_transaction() as session:
+        assert ('info', 'Rescore scheduled.') in session['_flashes']
+    # the request only marks the quiz
+    assert db.session.get(Quiz, quiz.id).rescore_requested_at is not None
+    assert QuizResult.query.filter_by(user_id=ann.id).one().score == 3
+
+    output = app.test_cli_runner().invoke(args=['rescore', '--pending']).output
+    assert output == f'quiz {quiz.id}: 3 responses, 3 attempts and 2 results rescored.\n'
+    db.session.expire_all()
+    assert db.session.get(Quiz, quiz.id).rescore_requested_at is None
+    assert QuizResult.query.filter_by(user_id=ann.id).one().score == 4
+    assert app.test_cli_runner().invoke(args=['rescore', '--pending']).output == ''
+
+
+def test_rescore_drops_the_answers_of_deleted_questions(storage, submitted):
+    quiz, ann, bob = submitted
+    deleted = quiz.questions[0].id
+    db.session.delete(db.session.get(Question, deleted))
+    quiz.total_questions -= 1
+    change_last_answer(quiz)
+
+    rescore_quiz(quiz.id)
+    # the rows and the packed answers give the same scores, without the deleted question
+    assert [attempt.score for attempt in QuizAttempt.query.order_by(QuizAttempt.id)] == [2, 3, 1]
+    assert [QuizResult.query.filter_by(user_id=user.id).one().score for user in (ann, bob)] == [3, 1]
+    for attempt in QuizAttempt.query:
+        rows = load_response_rows(attempt.id)
+        assert len(rows) == 3 and deleted not in {row['question_id'] for row in rows}
+    assert stored(quiz) == recount(quiz)
+    assert rescore_quiz(quiz.id) == (0, 0, 0)
+
+
+def move_question(client, question, quiz_id):
+    return client.post(f'/admin/update_question/{question.id}', data={
+        'text': question.text, 'options-0': 'a', 'options-1': 'b', 'options-2': 'c', 'options-3': 'd',
+        'correct_option': question.correct_option, 'quiz_id': quiz_id,
+    })
+
+
+def test_answered_questions_are_not_moved(storage, client, submitted):
+    quiz, ann, bob = submitted
+    other = make_quiz('Other')
+    question = quiz.questions[0]
+    make_user('admin', is_admin=True)
+    login(client, 'admin')
+
+    assert move_question(client, question, other.id).status_code == 409
+    assert db.session.get(Question, question.id).quiz_id == quiz.id
+    # the packed answers of the older attempts count too
+    db.session.get(QuestionStats, question.id).answered = 0
+    db.session.commit()
+    assert has_answers(question.id, quiz.id)
+
+    # a question without answers moves, with the number of questions of the two quizzes
+    unanswered = other.questions[0]
+    assert not has_answers(unanswered.id, other.id)
+    assert move_question(client, unanswered, quiz.id).status_code == 302
+    db.session.expire_all()
+    assert db.session.get(Question, unanswered.id).quiz_id == quiz.id
+    assert (db.session.get(Quiz, quiz.id).total_questions, db.session.get(Quiz, other.id).total_questions) == (5, 3)
@@ -0,0 +1,75 @@
+from collections import Counter
+import pytest
+
+from app import db
+from app.models import QuizResult, QuizStats, QuestionStats, QuestionOptionStats
+from app.stats import sync_option_stats
+from app.submission import submit_quiz, remove_result, load_response_rows
+from conftest import make_user, make_quiz, answer_key
+
+
+def recount(quiz):
+    ''' Count the stats of a quiz from the responses of the latest attempt of each result. '''
+    results = QuizResult.query.filter_by(quiz_id=quiz.id).all()
+    rows = [row for result in results for row in load_response_rows(result.latest_attempt_id)]
+    return {
+        'quiz': (len(results), sum(result.score for result in results)),
+        'questions': {question.id: (sum(row['question_id'] == question.id for row in rows),
+                                    sum(row['question_id'] == question.id and row['is_correct'] for row in rows))
+                      for question in quiz.questions},
+        'options': Counter((row['question_id'], row['selected_option']) for row in rows),
+    }
+
+
+def stored(quiz):
+    stats = db.session.get(QuizStats, quiz.id)
+    return {
+        'quiz': (stats.attempts, stats.total_score),
+        'questions': {question.id: (db.session.get(QuestionStats, question.id).answered,
+                                    db.session.get(QuestionStats, question.id).correct)
+                      for question in quiz.questions},
+        'options': Counter({(option.question_id, option.option_number): option.selected_count
+                            for option in QuestionOptionStats.query if option.selected_count}),
+    }
+
+
+@pytest.mark.parametrize('storage', ['rows', 'packed'])
+def test_resubmission_replaces_the_contribution_to_the_stats(app, storage):
+    app.config['RESPONSE_STORAGE'] = storage
+    quiz = make_quiz()
+    questions = [question.id for question in quiz.questions]
+    first, second = make_user('first'), make_user('second')
+
+    submit_quiz(first.id, quiz.id, dict(zip(questions, [1, 2, 3, 4])), answer_key(quiz))
+    submit_quiz(second.id, quiz.id, dict(zip(questions, [1, 1, 1, 1])), answer_key(quiz))
+    assert stored(quiz) == recount(quiz)
+
+    # different options, some questions become right and others wrong
+    submit_quiz(first.id, quiz.id, dict(zip(questions, [2, 2, 4, 4])), answer_key(quiz))
+    assert stored(quiz) == recount(quiz)
+    assert stored(quiz)['quiz'] == (2, 3)
+    assert db.session.get(QuizStats, quiz.id).submissions == 3
+
+    remove_result(QuizResult.query.filter_by(user_id=second.id).one())
+    assert stored(quiz) == recount(quiz)
+    assert stored(quiz)['quiz'] == (1, 2)
+
+
+def test_option_stats_follow_the_options_of_a_question(app):
+    quiz = make_quiz()
+    question = quiz.questions[0]
+    user = make_user()
+
+    question.options = ['a', 'b', 'c', 'd', 'e']
+    sync_option_stats(question)
+    db.session.commit()
+    submit_quiz(user.id, quiz.id, {question.id: 5}, answer_key(quiz))
+    assert stored(quiz) == recount(quiz)
+    assert db.session.get(QuestionOptionStats, (question.id, 5)).selected_count == 1
+
+    # the removed options keep their stats while responses select them
+    question.options = ['a', 'b', 'c']
+    sync_option_stats(question)
+    db.session.commit()
+    assert sorted(option.option_number for option in question.option_stats) == [1, 2, 3, 5]
+    assert stored(quiz) == recount(quiz)